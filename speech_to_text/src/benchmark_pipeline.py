@@ -0,0 +1,165 @@
+import os
+import sys
+from typing import Optional, Tuple
+
+import matplotlib
+
+# Figures are only rendered in memory.
+matplotlib.use('Agg')
+
+import click
+
+import bisk_benchmark
+
+
+@click.command()
+@click.option('-n', '--n-rows', help='number of rows of the synthetic dataset', required=False, type=int, default=20000)
+@click.option('-c', '--n-predicted-cols',
+              help='number of predicted columns of the synthetic dataset',
+              required=False,
+              type=int,
+              default=3)
+@click.option('--gender-distribution',
+              help='probabilities of genders as comma-separated "value=probability" pairs',
+              required=False,
+              default=None)
+@click.option('--age-distribution',
+              help='probabilities of age groups as comma-separated "value=probability" pairs',
+              required=False,
+              default=None)
+@click.option('-e', '--error-rate',
+              help='probability of an error per word in predicted columns; repeat to vary it between columns',
+              required=False,
+              type=float,
+              multiple=True,
+              default=[0.1])
+@click.option('-r', '--n-repetitions',
+              help='number of bootstrap repetitions',
+              required=False,
+              type=int,
+              default=1000)
+@click.option('-j', '--n-jobs',
+              help='number of parallel processes bootstrapping metrics',
+              required=False,
+              type=int,
+              default=1)
+@click.option('-k', '--n-runs', help='number of timed runs of each benchmark', required=False, type=int, default=5)
+@click.option('-s', '--random-state',
+              help='random state of the synthetic dataset and bootstrapping',
+              required=False,
+              type=int,
+              default=0)
+@click.option('-b', '--baseline-path',
+              help=('JSON file path with baseline times to compare with; fail if the file does not exist'
+                    ' or any benchmark is slower than tolerated'),
+              required=True)
+@click.option('--save-baseline',
+              help='if specified, save times to the baseline file instead of comparing with it',
+              is_flag=True,
+              required=False,
+              default=False)
+@click.option('-t', '--tolerance',
+              help='allowed relative increase of the median time of a benchmark over the baseline',
+              required=False,
+              type=float,
+              default=bisk_benchmark.REGRESSION_TOLERANCE)
+@click.option('--benchmark',
+              help='benchmark to run; repeat to run several; all benchmarks are run if omitted',
+              required=False,
+              type=click.Choice(bisk_benchmark.BENCHMARK_NAMES),
+              multiple=True,
+              default=None)
+def main(
+      n_rows: int,
+      n_predicted_cols: int,
+      gender_distribution: Optional[str],
+      age_distribution: Optional[str],
+      error_rate: Tuple[float],
+      n_repetitions: int,
+      n_jobs: int,
+      n_runs: int,
+      random_state: int,
+      baseline_path: str,
+      save_baseline: bool,
+      tolerance: float,
+      benchmark: Tuple[str],
+):
+  parameters = {
+    'n_rows': n_rows,
+    'n_predicted_cols': n_predicted_cols,
+    'gender_distribution': _parse_distribution(gender_distribution) or bisk_benchmark.GENDER_DISTRIBUTION,
+    'age_distribution': _parse_distribution(age_distribution) or bisk_benchmark.AGE_DISTRIBUTION,
+    'error_rates': list(error_rate),
+    'n_repetitions': n_repetitions,
+    'n_jobs': n_jobs,
+    'random_state': random_state,
+  }
+
+  if not save_baseline and not os.path.exists(baseline_path):
+    print(f'Baseline "{baseline_path}" not found, create it by running with --save-baseline', file=sys.stderr)
+    sys.exit(3)
+
+  print(f'Generating a synthetic dataset with {n_rows} rows and {n_predicted_cols} predicted columns')
+
+  df = bisk_benchmark.generate_dataset(
+    n_rows,
+    n_predicted_cols=n_predicted_cols,
+    gender_distribution=parameters['gender_distribution'],
+    age_distribution=parameters['age_distribution'],
+    error_rates=parameters['error_rates'],
+    random_state=random_state,
+  )
+
+  baseline = None
+  if not save_baseline:
+    baseline = bisk_benchmark.load_baseline(baseline_path)
+
+    if baseline['parameters'] != parameters:
+      print(f'Parameters differ from the baseline parameters {baseline["parameters"]}', file=sys.stderr)
+      sys.exit(2)
+
+  print(f'Running benchmarks {n_runs} times')
+
+  results = bisk_benchmark.run_benchmarks(
+    df,
+    n_runs=n_runs,
+    n_repetitions=n_repetitions,
+    random_state=random_state,
+    benchmark_names=list(benchmark),
+    n_jobs=n_jobs,
+  )
+
+  bisk_benchmark.print_results(results, baseline)
+
+  if save_baseline:
+    print(f'Saving baseline to "{baseline_path}"')
+    bisk_benchmark.save_baseline(baseline_path, results, parameters)
+    return
+
+  if baseline is not None:
+    regressions = bisk_benchmark.get_regressions(results, baseline, tolerance=tolerance)
+
+    for regression in regressions:
+      print(
+        f'Regression in {regression["name"]}: median {regression["median"]:.3f} s is {regression["ratio"]:.2f}x'
+        f' the baseline median {regression["baseline_median"]:.3f} s', file=sys.stderr)
+
+    if regressions:
+      sys.exit(1)
+
+
+def _parse_distribution(value):
+  if not value:
+    return None
+
+  distribution = {}
+
+  for pair in value.split(','):
+    name, probability = pair.split('=')
+    distribution[name.strip()] = float(probability)
+
+  return distribution
+
+
+if __name__ == '__main__':
+  main()
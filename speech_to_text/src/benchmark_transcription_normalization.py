@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import click
+
+import bisk_preprocessing
+
+
+N_SENTENCES = 1_000_000
+N_WORDS_PER_SENTENCE = 12
+
+WORDS = [
+  'Dobrý', 'deň', 'ako', 'sa', 'máš', 'Bratislava', 'je', 'hlavné', 'mesto', 'Slovenska', 'ďakujem', 'pekne',
+  'kôň', 'päť', 'ľudia', 'čítajú', 'knihy', 'v', 'knižnici', 'žena', 'muž', 'dieťa', 'škola', 'úloha',
+]
+SEPARATORS = [' ', ' ', ' ', ' ', '  ', ', ', '. ', '? ', '! ', ' „', '“ ', ' \'', ';', ' - ', '\t']
+
+
+@click.command()
+@click.option('-n', '--n-sentences', help='number of generated sentences', required=False, type=int, default=N_SENTENCES)
+@click.option('-s', '--seed', help='seed of generated sentences', required=False, type=int, default=0)
+def main(
+      n_sentences: int,
+      seed: int,
+):
+  print(f'Generating {n_sentences} sentences')
+
+  sentences = _generate_sentences(n_sentences, seed)
+  n_bytes = sum(len(sentence.encode('utf-8')) for sentence in sentences)
+
+  sentences_arrow = sentences.astype('string[pyarrow]')
+
+  for name, input_sentences in [('object', sentences), ('Arrow', sentences_arrow)]:
+    # Output is compared with multiple passes over the same dtype, as the `str` accessor differs between dtypes.
+    expected_sentences, elapsed_time = _time(_preprocess_transcriptions_multiple_passes, input_sentences)
+    _print_throughput(f'Multiple passes ({name})', elapsed_time, n_sentences, n_bytes)
+
+    normalized_sentences, elapsed_time = _time(bisk_preprocessing.normalize_transcriptions, input_sentences)
+    _print_throughput(f'Single pass ({name})', elapsed_time, n_sentences, n_bytes)
+
+    if not normalized_sentences.equals(expected_sentences):
+      raise AssertionError(f'Sentences normalized in a single pass ({name}) differ from multiple passes')
+
+  print('Normalized sentences are identical')
+
+
+def _generate_sentences(n_sentences, seed):
+  rng = np.random.default_rng(seed)
+
+  words = rng.choice(np.array(WORDS, dtype=object), size=(n_sentences, N_WORDS_PER_SENTENCE))
+  separators = rng.choice(np.array(SEPARATORS, dtype=object), size=(n_sentences, N_WORDS_PER_SENTENCE))
+
+  return pd.Series(
+    [''.join(word + separator for word, separator in zip(*row)) for row in zip(words, separators)], dtype=object)
+
+
+def _preprocess_transcriptions_multiple_passes(sentences):
+  sentences = sentences.str.lower()
+  sentences = bisk_preprocessing.remove_unwanted_characters(sentences)
+  sentences = bisk_preprocessing.remove_punctuation_including_periods(sentences)
+  sentences = bisk_preprocessing.remove_extra_space(sentences)
+  return sentences.str.strip()
+
+
+def _time(func, *args):
+  start_time = time.perf_counter()
+  result = func(*args)
+  return result, time.perf_counter() - start_time
+
+
+def _print_throughput(name, elapsed_time, n_sentences, n_bytes):
+  print(
+    f'{name}: {elapsed_time:.2f} s, {n_sentences / elapsed_time:,.0f} sentences/s,'
+    f' {n_bytes / elapsed_time / 1e6:.1f} MB/s')
+
+
+if __name__ == '__main__':
+  main()
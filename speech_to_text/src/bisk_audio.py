@@ -1,8 +1,39 @@
+import functools
+import io
 import os
+import time
 
+import joblib
+import numpy as np
+import pandas as pd
+import torch
 import torchaudio
+import tqdm
 import whisper
 
+import bisk_packed_audio
+import config
+
+
+# Default thresholds used by `whisper.transcribe` to decide whether to retry decoding with a higher temperature
+WHISPER_COMPRESSION_RATIO_THRESHOLD = 2.4
+WHISPER_LOGPROB_THRESHOLD = -1.0
+WHISPER_NO_SPEECH_THRESHOLD = 0.6
+# Number of spectrogram frames per output token and duration of a single timestamp token in seconds
+WHISPER_INPUT_STRIDE = 2
+WHISPER_TIME_PRECISION = whisper.audio.HOP_LENGTH * WHISPER_INPUT_STRIDE / whisper.audio.SAMPLE_RATE
+# Number of spectrogram frames following the `len(audio) // HOP_LENGTH` frames containing audio, up to and including
+# the first frame whose window does not overlap with the audio, for any remainder of the audio length
+WHISPER_N_FRAMES_OVERLAPPING_AUDIO_END = (
+  (whisper.audio.HOP_LENGTH - 1 + whisper.audio.N_FFT // 2) // whisper.audio.HOP_LENGTH + 2)
+
+# Number of audio files resampled in a single parallel job
+RESAMPLE_CHUNK_SIZE = 64
+
+AUDIO_METADATA_COLS = [
+  'sample_rate', 'bits_per_sample', 'num_channels', 'num_frames', 'encoding', config.AUDIO_DURATION_COL]
+AUDIO_METADATA_INTEGER_COLS = ['sample_rate', 'bits_per_sample', 'num_channels', 'num_frames']
+
 
 def get_audio_metadata(row, root_dirpath, audio_path_col):
   loaded_metadata = torchaudio.info(os.path.join(root_dirpath, row[audio_path_col]))
@@ -16,20 +47,540 @@ def get_audio_metadata(row, root_dirpath, audio_path_col):
   return row
 
 
-def transcribe_audio_whisper(audio_rel_filepath, root_dirpath, model, language='sk'):
-  return whisper.transcribe(model, os.path.join(root_dirpath, audio_rel_filepath), language=language)
+def transcribe_audio_whisper(audio_rel_filepath, root_dirpath, model, language='sk', audio=None):
+  if audio is None:
+    audio = os.path.join(root_dirpath, audio_rel_filepath)
 
+  return whisper.transcribe(model, audio, language=language)
 
-def resample_audio(row, input_root_dirpath, audio_path_col, current_sampling_rate_col, output_root_dirpath, target_sampling_rate, **resample_kwargs):
-  try:
-    audio = torchaudio.load(os.path.join(input_root_dirpath, row[audio_path_col]))[0]
-  except RuntimeError:
-    row['audio_resample_success'] = False
+
+def get_audio_sources(df, audio_path_col, root_dirpath):
+  """Returns audio sources of rows in `df`, being either audio file paths or `bisk_packed_audio.PackedAudioClip`s.
+
+  Clips are returned if `df` contains waveform locations in packed shards, with shards located in `root_dirpath`.
+  Raises `ValueError` if audio of any row failed to be packed.
+  """
+  if config.AUDIO_SHARD_COL in df.columns:
+    is_unpacked = df[config.AUDIO_SHARD_COL].isna()
+
+    if is_unpacked.any():
+      unpacked_row_labels = df.index[is_unpacked].tolist()
+      raise ValueError(
+        f'Audio of {len(unpacked_row_labels)} rows failed to be packed (see the "audio_resample_success" column),'
+        f' remove these rows first: {unpacked_row_labels[:10]}{"..." if len(unpacked_row_labels) > 10 else ""}')
+
+    return [
+      bisk_packed_audio.PackedAudioClip(os.path.join(root_dirpath, shard_rel_filepath), int(offset), int(length))
+      for shard_rel_filepath, offset, length in zip(
+        df[config.AUDIO_SHARD_COL], df[config.AUDIO_OFFSET_COL], df[config.AUDIO_LENGTH_COL])]
+
+  return [os.path.join(root_dirpath, audio_rel_filepath) for audio_rel_filepath in df[audio_path_col]]
+
+
+def get_audio_duration(audio_source):
+  """Returns the duration of the audio in seconds."""
+  if isinstance(audio_source, bisk_packed_audio.PackedAudioClip):
+    return audio_source.length / config.PROCESSED_SAMPLING_RATE
+
+  metadata = torchaudio.info(audio_source)
+
+  return metadata.num_frames / metadata.sample_rate
+
+
+def add_audio_duration_col(df, audio_path_col, root_dirpath):
+  """Adds the duration of audio in seconds to `df` unless it was already obtained during preprocessing."""
+  if config.AUDIO_DURATION_COL in df.columns and not df[config.AUDIO_DURATION_COL].isna().any():
+    return
+
+  df[config.AUDIO_DURATION_COL] = [
+    get_audio_duration(audio_source) for audio_source in get_audio_sources(df, audio_path_col, root_dirpath)]
+
+
+def load_audio_whisper(audio_source):
+  if isinstance(audio_source, bisk_packed_audio.PackedAudioClip):
+    # Whisper converts audio to tensors, which requires writable arrays rather than read-only memory-mapped ones.
+    return np.array(audio_source.load())
+
+  return whisper.load_audio(audio_source)
+
+
+def transcribe_audio_whisper_batch(
+      audio_sources, model, languages=('sk',), feature_cache=None, mels=None, return_inference_times=False):
+  """Transcribes multiple audio sources at once, returning the same output as `transcribe_audio_whisper` for each.
+
+  Audio fitting into a single 30-second window is encoded in one batch, with the same encoder input as
+  `whisper.transcribe`, i.e. the log-mel spectrogram of the audio padded by zeros. The encoder output is then decoded
+  with greedy decoding for each of the `languages`, `None` standing for automatic language detection, which
+  `whisper.transcribe` performs on the spectrogram padded by the spectrogram of silence instead. Files that are
+  longer, whose transcription would make `whisper.transcribe` fall back to a higher temperature or continue decoding
+  from the last timestamp in another window, are transcribed individually via `transcribe_audio_whisper`.
+
+  If `feature_cache` (a `bisk_feature_cache.FeatureCache`) is specified, spectrograms are loaded from the cache
+  if possible instead of decoding the audio. Spectrograms may also be precomputed via
+  `load_whisper_log_mel_spectrograms` and passed as `mels`.
+
+  `audio_sources` are audio file paths or `bisk_packed_audio.PackedAudioClip`s.
+
+  Returns a list of results per audio source for each language. If `return_inference_times` is `True`, also returns
+  inference times in seconds per audio source for each language, with the time of the shared encoder and of batched
+  decoding split equally among audio sources of the batch.
+  """
+  audio_sources = list(audio_sources)
+  results_per_language = [[None] * len(audio_sources) for _ in languages]
+  inference_times_per_language = [[0.0] * len(audio_sources) for _ in languages]
+
+  if mels is None:
+    mels = load_whisper_log_mel_spectrograms(audio_sources, model.dims.n_mels, feature_cache=feature_cache)
+
+  batch_mels = []
+  batch_n_content_frames = []
+  batch_indexes = []
+
+  for index, (audio_source, mel) in enumerate(zip(audio_sources, mels)):
+    if mel is None:
+      for results, inference_times, language in zip(results_per_language, inference_times_per_language, languages):
+        start_time = time.perf_counter()
+        results[index] = whisper.transcribe(model, load_audio_whisper(audio_source), language=language)
+        inference_times[index] += time.perf_counter() - start_time
+      continue
+
+    batch_mels.append(mel[0])
+    batch_n_content_frames.append(mel[1])
+    batch_indexes.append(index)
+
+  if not batch_mels:
+    return (results_per_language, inference_times_per_language) if return_inference_times else results_per_language
+
+  fp16 = model.device.type != 'cpu'
+  dtype = torch.float16 if fp16 else torch.float32
+
+  start_time = time.perf_counter()
+
+  silence_padded_mels = torch.stack(batch_mels)
+  zero_padded_mels = silence_padded_mels.clone()
+  for mel_index, n_content_frames in enumerate(batch_n_content_frames):
+    zero_padded_mels[mel_index, :, n_content_frames:] = 0
+
+  with torch.no_grad():
+    audio_features = model.embed_audio(zero_padded_mels.to(model.device, dtype=dtype))
+
+  _synchronize(model.device)
+  encoder_time_per_sample = (time.perf_counter() - start_time) / len(batch_indexes)
+
+  for results, inference_times, language in zip(results_per_language, inference_times_per_language, languages):
+    start_time = time.perf_counter()
+
+    if language is not None:
+      languages_per_sample = [language] * len(batch_indexes)
+    elif not model.is_multilingual:
+      languages_per_sample = ['en'] * len(batch_indexes)
+    else:
+      languages_per_sample = _detect_whisper_languages(model, silence_padded_mels.to(model.device, dtype=dtype))
+
+    decoding_results = [None] * len(batch_indexes)
+
+    # Encoded audio features are passed instead of spectrograms, so that the encoder runs only once.
+    for sample_language in dict.fromkeys(languages_per_sample):
+      positions = [
+        position for position, language_for_sample in enumerate(languages_per_sample)
+        if language_for_sample == sample_language]
+
+      for position, decoding_result in zip(positions, whisper.decode(
+            model,
+            audio_features[positions],
+            whisper.DecodingOptions(language=sample_language, temperature=0.0, fp16=fp16))):
+        decoding_results[position] = decoding_result
+
+    decoding_time_per_sample = (time.perf_counter() - start_time) / len(batch_indexes)
+
+    for index, n_content_frames, decoding_result in zip(batch_indexes, batch_n_content_frames, decoding_results):
+      inference_times[index] += encoder_time_per_sample + decoding_time_per_sample
+
+      # The same conditions are used by `whisper.transcribe` to decide whether to retry decoding.
+      is_silent = (
+        decoding_result.no_speech_prob > WHISPER_NO_SPEECH_THRESHOLD
+        and decoding_result.avg_logprob < WHISPER_LOGPROB_THRESHOLD)
+      needs_fallback = (
+        decoding_result.compression_ratio > WHISPER_COMPRESSION_RATIO_THRESHOLD
+        or decoding_result.avg_logprob < WHISPER_LOGPROB_THRESHOLD)
+
+      result = None
+      if not needs_fallback or is_silent:
+        result = _get_whisper_transcription_result(model, decoding_result, n_content_frames)
+
+      if result is None:
+        start_time = time.perf_counter()
+        results[index] = whisper.transcribe(model, load_audio_whisper(audio_sources[index]), language=language)
+        inference_times[index] += time.perf_counter() - start_time
+      else:
+        results[index] = result
+
+  return (results_per_language, inference_times_per_language) if return_inference_times else results_per_language
+
+
+def load_whisper_log_mel_spectrograms(audio_sources, n_mels, feature_cache=None):
+  return [
+    load_whisper_log_mel_spectrogram(audio_source, n_mels, feature_cache=feature_cache)
+    for audio_source in audio_sources
+  ]
+
+
+def load_whisper_log_mel_spectrogram(audio_source, n_mels, feature_cache=None):
+  """Returns the log-mel spectrogram of the first 30-second window and the number of frames containing audio.
+
+  The spectrogram is padded by the spectrogram of silence, as used by `whisper.transcribe` to detect the language.
+  Returns `None` if the audio is longer than a single window.
+  """
+  if feature_cache is not None:
+    key = feature_cache.get_key(audio_source, whisper.audio.SAMPLE_RATE, n_mels)
+    cached_mel = feature_cache.load(key)
+
+    if cached_mel is not None:
+      return _restore_whisper_log_mel_spectrogram(cached_mel)
+
+  audio = load_audio_whisper(audio_source)
+
+  if len(audio) > whisper.audio.N_SAMPLES:
+    return None
+
+  # Padding by 30 seconds of silence matches the spectrogram computed by `whisper.transcribe`.
+  mel = whisper.log_mel_spectrogram(audio, n_mels, padding=whisper.audio.N_SAMPLES)
+  n_content_frames = len(audio) // whisper.audio.HOP_LENGTH
+
+  if feature_cache is not None:
+    # Frames not overlapping with the audio all have the same value, hence only the preceding frames are stored
+    # and the remaining frames are restored by repeating the last stored frame. The number of stored frames
+    # also determines the number of frames containing audio.
+    feature_cache.save(key, mel[:, :n_content_frames + WHISPER_N_FRAMES_OVERLAPPING_AUDIO_END].numpy())
+
+  return mel[:, :whisper.audio.N_FRAMES], n_content_frames
+
+
+def _restore_whisper_log_mel_spectrogram(cached_mel):
+  n_frames_to_pad = max(whisper.audio.N_FRAMES - cached_mel.shape[1], 0)
+
+  mel = np.pad(cached_mel, ((0, 0), (0, n_frames_to_pad)), mode='edge')[:, :whisper.audio.N_FRAMES]
+
+  return torch.from_numpy(mel), cached_mel.shape[1] - WHISPER_N_FRAMES_OVERLAPPING_AUDIO_END
+
+
+def _detect_whisper_languages(model, mels):
+  with torch.no_grad():
+    _, probs_per_sample = model.detect_language(mels)
+
+  return [max(probs, key=probs.get) for probs in probs_per_sample]
+
+
+def _synchronize(device):
+  # CUDA kernels run asynchronously, so they are waited for to attribute their time correctly.
+  if device.type == 'cuda':
+    torch.cuda.synchronize(device)
+
+
+def _get_whisper_transcription_result(model, decoding_result, n_content_frames):
+  """Returns the result of `whisper.transcribe` for the first window, or `None` if it would continue decoding.
+
+  Tokens are split into segments by consecutive timestamps as done by `whisper.transcribe`, which decodes
+  another window starting at the last timestamp unless the last segment ends with a single timestamp.
+  """
+  tokenizer = whisper.tokenizer.get_tokenizer(
+    model.is_multilingual, num_languages=model.num_languages, language=decoding_result.language, task='transcribe')
+
+  # Decoding is skipped by `whisper.transcribe` for windows without speech.
+  is_skipped = (
+    decoding_result.no_speech_prob > WHISPER_NO_SPEECH_THRESHOLD
+    and not decoding_result.avg_logprob > WHISPER_LOGPROB_THRESHOLD)
+
+  if is_skipped or n_content_frames == 0:
+    return {'text': '', 'segments': [], 'language': decoding_result.language}
+
+  tokens = decoding_result.tokens
+  is_timestamp = [token >= tokenizer.timestamp_begin for token in tokens]
+  is_single_timestamp_ending = is_timestamp[-2:] == [False, True]
+  consecutive_timestamp_ends = [
+    position + 1 for position in range(len(tokens) - 1) if is_timestamp[position] and is_timestamp[position + 1]]
+
+  segments = []
+
+  if consecutive_timestamp_ends:
+    slice_ends = consecutive_timestamp_ends + ([len(tokens)] if is_single_timestamp_ending else [])
+    slice_start = 0
+
+    for slice_end in slice_ends:
+      sliced_tokens = tokens[slice_start:slice_end]
+      segments.append(_get_whisper_segment(
+        (sliced_tokens[0] - tokenizer.timestamp_begin) * WHISPER_TIME_PRECISION,
+        (sliced_tokens[-1] - tokenizer.timestamp_begin) * WHISPER_TIME_PRECISION,
+        sliced_tokens, decoding_result, tokenizer))
+      slice_start = slice_end
+
+    if not is_single_timestamp_ending:
+      n_decoded_frames = (tokens[slice_start - 1] - tokenizer.timestamp_begin) * WHISPER_INPUT_STRIDE
+
+      if n_decoded_frames < n_content_frames:
+        return None
   else:
-    resampled_audio = torchaudio.functional.resample(audio, row[current_sampling_rate_col], target_sampling_rate, **resample_kwargs)
+    end = n_content_frames * whisper.audio.HOP_LENGTH / whisper.audio.SAMPLE_RATE
+    timestamp_tokens = [token for token, is_token_timestamp in zip(tokens, is_timestamp) if is_token_timestamp]
 
-    torchaudio.save(os.path.join(output_root_dirpath, row[audio_path_col]), resampled_audio, target_sampling_rate)
+    if timestamp_tokens and timestamp_tokens[-1] != tokenizer.timestamp_begin:
+      end = (timestamp_tokens[-1] - tokenizer.timestamp_begin) * WHISPER_TIME_PRECISION
 
-    row['audio_resample_success'] = True
+    segments.append(_get_whisper_segment(0.0, end, tokens, decoding_result, tokenizer))
 
-  return row
+  for segment_id, segment in enumerate(segments):
+    segment['id'] = segment_id
+
+    # Instantaneous segments and segments without text are cleared by `whisper.transcribe`.
+    if segment['start'] == segment['end'] or not segment['text'].strip():
+      segment['text'] = ''
+      segment['tokens'] = []
+
+  return {
+    'text': tokenizer.decode([token for segment in segments for token in segment['tokens']]),
+    'segments': segments,
+    'language': decoding_result.language,
+  }
+
+
+def _get_whisper_segment(start, end, tokens, decoding_result, tokenizer):
+  return {
+    'seek': 0,
+    'start': start,
+    'end': end,
+    'text': tokenizer.decode([token for token in tokens if token < tokenizer.eot]),
+    'tokens': list(tokens),
+    'temperature': 0.0,
+    'avg_logprob': decoding_result.avg_logprob,
+    'compression_ratio': decoding_result.compression_ratio,
+    'no_speech_prob': decoding_result.no_speech_prob,
+  }
+
+
+def load_audio_files(audio_sources, sampling_rate=config.PROCESSED_SAMPLING_RATE):
+  """Returns the first channel of each audio file as a NumPy array, resampled to `sampling_rate` if needed.
+
+  Packed clips (`bisk_packed_audio.PackedAudioClip`) are returned as stored, as they are already resampled.
+  """
+  audio_data = []
+
+  for audio_source in audio_sources:
+    if isinstance(audio_source, bisk_packed_audio.PackedAudioClip):
+      audio_data.append(audio_source.load())
+      continue
+
+    waveform, current_sampling_rate = torchaudio.load(audio_source)
+
+    if current_sampling_rate != sampling_rate:
+      waveform = torchaudio.functional.resample(waveform, current_sampling_rate, sampling_rate)
+
+    audio_data.append(waveform[0].numpy())
+
+  return audio_data
+
+
+def ingest_audio_files(
+      df,
+      input_root_dirpath,
+      audio_path_col,
+      output_root_dirpath,
+      target_sampling_rate,
+      n_jobs=1,
+      chunk_size=RESAMPLE_CHUNK_SIZE,
+      skip_existing=True,
+      packed_audio_writer=None,
+      **resample_kwargs):
+  """Obtains audio metadata and resamples audio files in a single pass, reading each file only once.
+
+  Fills the same metadata columns as `get_audio_metadata` plus the duration in seconds, and resamples files
+  to `target_sampling_rate`, with files already resampled being skipped if `skip_existing` is `True`.
+  Metadata are obtained from the file content read into memory, which is then decoded for resampling.
+
+  If `packed_audio_writer` (a `bisk_packed_audio.PackedAudioWriter`) is specified, resampled audio is mixed down
+  to mono and appended to its shards instead of being saved to `output_root_dirpath`, and columns locating
+  the audio in the shards are set. No files are skipped in this case.
+
+  Sets the `audio_resample_success` column in `df` and returns the status of each row, being one of `'resampled'`,
+  `'skipped'` or `'failed'`.
+  """
+  audio_rel_filepaths = df[audio_path_col].tolist()
+  pack = packed_audio_writer is not None
+
+  chunk_starts = range(0, len(df), chunk_size)
+
+  jobs = (
+    joblib.delayed(_ingest_audio_files_for_chunk)(
+      audio_rel_filepaths[start:start + chunk_size],
+      input_root_dirpath,
+      output_root_dirpath,
+      target_sampling_rate,
+      skip_existing and not pack,
+      tuple(sorted(resample_kwargs.items())),
+      pack,
+    )
+    for start in chunk_starts)
+
+  metadata_list = []
+  statuses = []
+  packed_audio_locations = []
+
+  with tqdm.tqdm(total=len(df)) as progress_bar:
+    for metadata_for_chunk, statuses_for_chunk, waveforms_for_chunk in joblib.Parallel(
+          n_jobs=n_jobs, return_as='generator')(jobs):
+      metadata_list.extend(metadata_for_chunk)
+      statuses.extend(statuses_for_chunk)
+
+      if pack:
+        # Waveforms are written as chunks complete to keep only a few chunks in memory.
+        packed_audio_locations.extend(
+          packed_audio_writer.write(waveform) if waveform is not None else (None, None, None)
+          for waveform in waveforms_for_chunk)
+
+      progress_bar.update(len(statuses_for_chunk))
+
+  for col in AUDIO_METADATA_COLS:
+    values = [metadata[col] for metadata in metadata_list]
+
+    if col in AUDIO_METADATA_INTEGER_COLS and any(value is None for value in values):
+      # Keep integer values for files with metadata instead of converting all values to floats.
+      values = pd.array(values, dtype='Int64')
+
+    df[col] = values
+
+  if pack:
+    bisk_packed_audio.set_packed_audio_cols(df, packed_audio_locations)
+
+  df['audio_resample_success'] = [status != 'failed' for status in statuses]
+
+  return statuses
+
+
+def _ingest_audio_files_for_chunk(
+      audio_rel_filepaths,
+      input_root_dirpath,
+      output_root_dirpath,
+      target_sampling_rate,
+      skip_existing,
+      resample_kwargs,
+      pack=False):
+  metadata_list = []
+  statuses = []
+  waveforms = []
+
+  for audio_rel_filepath in audio_rel_filepaths:
+    input_filepath = os.path.join(input_root_dirpath, audio_rel_filepath)
+    output_filepath = os.path.join(output_root_dirpath, audio_rel_filepath) if not pack else None
+    audio_format = os.path.splitext(audio_rel_filepath)[1][1:] or None
+
+    metadata = dict.fromkeys(AUDIO_METADATA_COLS)
+    metadata_list.append(metadata)
+    waveforms.append(None)
+
+    try:
+      with open(input_filepath, 'rb') as f:
+        content = f.read()
+
+      loaded_metadata = torchaudio.info(io.BytesIO(content), format=audio_format)
+    except (OSError, RuntimeError):
+      statuses.append('failed')
+      continue
+
+    metadata['sample_rate'] = loaded_metadata.sample_rate
+    metadata['bits_per_sample'] = loaded_metadata.bits_per_sample
+    metadata['num_channels'] = loaded_metadata.num_channels
+    metadata['num_frames'] = loaded_metadata.num_frames
+    metadata['encoding'] = loaded_metadata.encoding
+
+    if loaded_metadata.num_frames:
+      metadata[config.AUDIO_DURATION_COL] = loaded_metadata.num_frames / loaded_metadata.sample_rate
+
+    if skip_existing and _is_audio_resampled(output_filepath, target_sampling_rate, loaded_metadata.num_channels):
+      statuses.append('skipped')
+      continue
+
+    try:
+      audio = torchaudio.load(io.BytesIO(content), format=audio_format)[0]
+    except RuntimeError:
+      statuses.append('failed')
+      continue
+
+    if not loaded_metadata.num_frames:
+      # Some formats do not store the number of frames in the header.
+      metadata[config.AUDIO_DURATION_COL] = audio.shape[-1] / loaded_metadata.sample_rate
+
+    if pack:
+      waveforms[-1] = _get_packed_waveform(
+        audio, loaded_metadata.sample_rate, target_sampling_rate, resample_kwargs)
+    else:
+      _resample_and_save_audio(
+        audio, loaded_metadata.sample_rate, output_filepath, target_sampling_rate, resample_kwargs)
+
+    statuses.append('resampled')
+
+  return metadata_list, statuses, waveforms
+
+
+def pack_audio_files(
+      df,
+      root_dirpath,
+      audio_path_col,
+      packed_audio_writer,
+      target_sampling_rate=config.PROCESSED_SAMPLING_RATE,
+      **resample_kwargs):
+  """Appends audio files to shards of `packed_audio_writer`, resampled to `target_sampling_rate` and mixed down
+  to mono, and sets columns locating the audio in the shards.
+
+  Sets the `audio_resample_success` column in `df`.
+  """
+  packed_audio_locations = []
+
+  for audio_rel_filepath in tqdm.tqdm(df[audio_path_col]):
+    try:
+      audio, current_sampling_rate = torchaudio.load(os.path.join(root_dirpath, audio_rel_filepath))
+    except RuntimeError:
+      packed_audio_locations.append((None, None, None))
+      continue
+
+    packed_audio_locations.append(packed_audio_writer.write(_get_packed_waveform(
+      audio, current_sampling_rate, target_sampling_rate, tuple(sorted(resample_kwargs.items())))))
+
+  bisk_packed_audio.set_packed_audio_cols(df, packed_audio_locations)
+
+  df['audio_resample_success'] = [location[0] is not None for location in packed_audio_locations]
+
+
+def _get_packed_waveform(audio, current_sampling_rate, target_sampling_rate, resample_kwargs):
+  if current_sampling_rate != target_sampling_rate:
+    audio = _get_resample_transform(current_sampling_rate, target_sampling_rate, resample_kwargs)(audio)
+
+  return audio.mean(dim=0).numpy()
+
+
+def _resample_and_save_audio(audio, current_sampling_rate, output_filepath, target_sampling_rate, resample_kwargs):
+  resampled_audio = _get_resample_transform(current_sampling_rate, target_sampling_rate, resample_kwargs)(audio)
+
+  # Files are saved under a temporary name first so that interrupted writes are not skipped on the next run.
+  output_filepath_root, output_filepath_ext = os.path.splitext(output_filepath)
+  temp_output_filepath = f'{output_filepath_root}.tmp{output_filepath_ext}'
+
+  torchaudio.save(temp_output_filepath, resampled_audio, target_sampling_rate)
+  os.replace(temp_output_filepath, output_filepath)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_resample_transform(current_sampling_rate, target_sampling_rate, resample_kwargs):
+  # The kernel is computed in the same precision as by `torchaudio.functional.resample` for loaded audio.
+  return torchaudio.transforms.Resample(
+    int(current_sampling_rate), int(target_sampling_rate), dtype=torch.float32, **dict(resample_kwargs))
+
+
+def _is_audio_resampled(audio_filepath, sampling_rate, n_channels=None):
+  if not os.path.exists(audio_filepath):
+    return False
+
+  try:
+    metadata = torchaudio.info(audio_filepath)
+  except RuntimeError:
+    return False
+
+  return metadata.sample_rate == sampling_rate and (n_channels is None or metadata.num_channels == n_channels)
@@ -0,0 +1,295 @@
+import json
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from matplotlib import pyplot as plt
+
+import bisk_metrics
+import bisk_plot
+import bisk_preprocessing
+import bisk_scenarios
+import config
+
+
+GENDER_DISTRIBUTION = {'male': 0.5, 'female': 0.3, 'unknown': 0.2}
+AGE_DISTRIBUTION = {'teens': 0.1, 'twenties': 0.4, 'thirties': 0.25, 'fourties': 0.15, 'fifties': 0.1}
+
+SYLLABLES = [
+  'ba', 'bo', 'ce', 'či', 'da', 'ďa', 'do', 'je', 'ka', 'ko', 'la', 'ľu', 'ma', 'mi', 'na', 'ne', 'ňo', 'po',
+  'pra', 'ri', 'sa', 'sk', 'so', 'ša', 'ta', 'ti', 'ťa', 'to', 'va', 'vý', 'za', 'že', 'á', 'é', 'í', 'ô', 'ú',
+]
+PUNCTUATION = ['', '', '', '', ',', '.', '?', '!', ';', ':']
+QUOTES = [('', ''), ('', ''), ('', ''), ('„', '“'), ('"', '"'), ("'", "'")]
+
+N_WORDS = 5000
+N_WORDS_PER_SENTENCE_RANGE = (3, 16)
+
+BENCHMARK_NAMES = [
+  'preprocess_transcriptions',
+  'add_has_sentence_male_and_female_gender',
+  'compute_metrics_per_row',
+  'compute_metrics_via_bootstrapping',
+  'get_confidence_interval_summary',
+  'plot_bars',
+  'plot_bars_from_summary',
+]
+
+# Allowed relative increase of the median time of a benchmark over the baseline
+REGRESSION_TOLERANCE = 0.25
+
+# Scenarios plotted by the plotting benchmarks, as within-group names and scenario suffixes
+_PLOTTED_SCENARIOS = {
+  'all genders': '_all_genders',
+  'male': '_male_only',
+  'female': '_female_only',
+}
+
+
+def generate_dataset(
+      n_rows,
+      n_predicted_cols=3,
+      gender_distribution=None,
+      age_distribution=None,
+      error_rates=(0.1,),
+      n_sentences=None,
+      random_state=None):
+  """Generates a dataset of random Slovak-like sentences with raw ground truth and predicted transcriptions.
+
+  Sentences are drawn from `n_sentences` distinct sentences (`n_rows // 4` by default), so that some sentences are
+  recorded by multiple speakers. Genders and age groups are drawn from `gender_distribution` and `age_distribution`,
+  dictionaries mapping values to probabilities. Words of each predicted column are substituted, deleted or followed
+  by an inserted word with the probability given by the corresponding item of `error_rates` (cycled if shorter).
+  Raw transcriptions contain capitalization, punctuation and quotes removed by `preprocess_transcriptions`.
+  """
+  random_generator = np.random.default_rng(random_state)
+
+  gender_distribution = gender_distribution or GENDER_DISTRIBUTION
+  age_distribution = age_distribution or AGE_DISTRIBUTION
+  n_sentences = n_sentences or max(n_rows // 4, 1)
+
+  words = _generate_words(random_generator)
+
+  sentences = [
+    list(random_generator.choice(words, size=random_generator.integers(*N_WORDS_PER_SENTENCE_RANGE)))
+    for _ in range(n_sentences)]
+  sentence_indexes = random_generator.integers(n_sentences, size=n_rows)
+
+  df = pd.DataFrame({
+    config.GROUND_TRUTH_RAW_COL: [
+      _decorate_sentence(sentences[index], random_generator) for index in sentence_indexes],
+    config.GENDER_COL: _sample(gender_distribution, n_rows, random_generator),
+    config.AGE_GROUP_COL: _sample(age_distribution, n_rows, random_generator),
+  })
+
+  for col_index in range(n_predicted_cols):
+    error_rate = error_rates[col_index % len(error_rates)]
+
+    df[f'{config.PREDICTED_COL_PREFIX}model-{col_index:02d}_lang-sk'] = [
+      _decorate_sentence(_corrupt_sentence(sentences[index], words, error_rate, random_generator), random_generator)
+      for index in sentence_indexes]
+
+  return df
+
+
+def run_benchmarks(df, n_runs=5, n_repetitions=1000, random_state=None, benchmark_names=None, n_jobs=1):
+  """Times each of `benchmark_names` (all of `BENCHMARK_NAMES` by default) `n_runs` times on a dataset generated
+  by `generate_dataset`.
+
+  Inputs of each benchmark are prepared by the preceding steps of the pipeline outside of the timed code.
+  Metrics are bootstrapped for all scenarios from `bisk_scenarios.get_scenarios`, including age groups,
+  in `n_jobs` processes as by `compute_metrics`.
+  Returns a dictionary mapping benchmark names to a dictionary of times in seconds and their median and minimum.
+  """
+  benchmark_names = benchmark_names or BENCHMARK_NAMES
+
+  df_normalized = _preprocess(df.copy())
+  df_preprocessed = bisk_preprocessing.add_has_sentence_male_and_female_gender(
+    df_normalized, config.GROUND_TRUTH_COL, config.GENDER_COL)
+
+  df_with_metrics = df_preprocessed.copy()
+  bisk_metrics.compute_metrics_per_row(df_with_metrics)
+
+  df_metrics = _compute_metrics_via_bootstrapping(df_with_metrics, n_repetitions, random_state, n_jobs)
+  summary = bisk_metrics.get_confidence_interval_summary(df_metrics)
+
+  benchmarks = {
+    'preprocess_transcriptions': (lambda: (df.copy(),), _preprocess),
+    'add_has_sentence_male_and_female_gender': (
+      lambda: (df_normalized,),
+      lambda df_: bisk_preprocessing.add_has_sentence_male_and_female_gender(
+        df_, config.GROUND_TRUTH_COL, config.GENDER_COL)),
+    'compute_metrics_per_row': (lambda: (df_preprocessed.copy(),), bisk_metrics.compute_metrics_per_row),
+    'compute_metrics_via_bootstrapping': (
+      lambda: (df_with_metrics, n_repetitions, random_state, n_jobs), _compute_metrics_via_bootstrapping),
+    'get_confidence_interval_summary': (lambda: (df_metrics,), bisk_metrics.get_confidence_interval_summary),
+    'plot_bars': (lambda: (df_metrics,), _plot_bars),
+    'plot_bars_from_summary': (lambda: (summary,), _plot_bars),
+  }
+
+  results = {}
+
+  for name in benchmark_names:
+    get_args, func = benchmarks[name]
+    times = []
+
+    for _ in range(n_runs):
+      args = get_args()
+
+      start_time = time.perf_counter()
+      func(*args)
+      times.append(time.perf_counter() - start_time)
+
+    results[name] = {'times': times, 'median': statistics.median(times), 'min': min(times)}
+
+  return results
+
+
+def save_baseline(filepath, results, parameters):
+  with open(filepath, 'w') as f:
+    json.dump({'parameters': parameters, 'results': results}, f, indent=2)
+
+
+def load_baseline(filepath):
+  with open(filepath) as f:
+    return json.load(f)
+
+
+def get_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+  """Returns benchmarks whose median time exceeds the median time in `baseline` by more than `tolerance`.
+
+  Each regression is a dictionary with the benchmark name, the median times and their ratio.
+  """
+  regressions = []
+
+  for name, result in results.items():
+    if name not in baseline['results']:
+      continue
+
+    baseline_median = baseline['results'][name]['median']
+    ratio = result['median'] / baseline_median if baseline_median > 0 else float('inf')
+
+    if ratio > 1 + tolerance:
+      regressions.append({'name': name, 'median': result['median'], 'baseline_median': baseline_median, 'ratio': ratio})
+
+  return regressions
+
+
+def print_results(results, baseline=None):
+  for name, result in results.items():
+    line = f'{name}: median {result["median"]:.3f} s, min {result["min"]:.3f} s'
+
+    if baseline is not None and name in baseline['results']:
+      baseline_median = baseline['results'][name]['median']
+      line += f' (baseline median {baseline_median:.3f} s, {result["median"] / baseline_median:.2f}x)'
+
+    print(line)
+
+
+def _generate_words(random_generator):
+  words = set()
+
+  while len(words) < N_WORDS:
+    n_syllables = random_generator.integers(1, 5)
+    words.add(''.join(random_generator.choice(SYLLABLES, size=n_syllables)))
+
+  return np.array(sorted(words), dtype=object)
+
+
+def _sample(distribution, n_rows, random_generator):
+  values = list(distribution)
+  probabilities = np.array([distribution[value] for value in values], dtype=np.float64)
+
+  return random_generator.choice(np.array(values, dtype=object), size=n_rows, p=probabilities / probabilities.sum())
+
+
+def _corrupt_sentence(words, vocabulary, error_rate, random_generator):
+  corrupted_words = []
+
+  # Substitutions, deletions and insertions are equally likely.
+  for word, operation_value in zip(words, random_generator.random(len(words))):
+    if operation_value < error_rate / 3:
+      corrupted_words.append(random_generator.choice(vocabulary))
+    elif operation_value < error_rate * 2 / 3:
+      continue
+    elif operation_value < error_rate:
+      corrupted_words.extend([word, random_generator.choice(vocabulary)])
+    else:
+      corrupted_words.append(word)
+
+  return corrupted_words
+
+
+def _decorate_sentence(words, random_generator):
+  if not words:
+    return ''
+
+  opening_quote, closing_quote = QUOTES[random_generator.integers(len(QUOTES))]
+  punctuation = random_generator.choice(PUNCTUATION, size=len(words))
+
+  sentence = ' '.join(word + mark for word, mark in zip(words, punctuation))
+
+  return f'{opening_quote}{sentence[0].upper()}{sentence[1:]}{closing_quote}'
+
+
+def _preprocess(df):
+  bisk_preprocessing.preprocess_transcriptions(df, config.GROUND_TRUTH_RAW_COL, config.GROUND_TRUTH_COL)
+
+  for col in bisk_metrics.get_predicted_cols(df):
+    bisk_preprocessing.preprocess_transcriptions(df, col, col)
+
+  return df
+
+
+def _compute_metrics_via_bootstrapping(df, n_repetitions, random_state, n_jobs=1):
+  predicted_cols = bisk_metrics.get_predicted_cols(df)
+
+  scenarios_with_metrics = bisk_metrics.compute_metrics_via_bootstrapping_for_scenarios(
+    bisk_metrics.get_row_statistics(df, predicted_cols),
+    bisk_scenarios.get_scenarios(df),
+    predicted_cols=predicted_cols,
+    n_repetitions=n_repetitions,
+    random_state=random_state,
+    n_jobs=n_jobs,
+  )
+
+  metrics = {}
+
+  for _scenario, metrics_for_scenario in scenarios_with_metrics:
+    metrics.update(metrics_for_scenario)
+
+  return pd.DataFrame(metrics)
+
+
+def _plot_bars(df_metrics):
+  if bisk_metrics.is_confidence_interval_summary(df_metrics):
+    group_names = sorted(df_metrics['model'].unique())
+    affixes_to_match = {
+      'metric': config.WER_PREFIX.rstrip('_'),
+      'average': 'micro_average',
+      'language': 'sk',
+      'scenario': [suffix.lstrip('_') for suffix in _PLOTTED_SCENARIOS.values()],
+      config.AGE_GROUP_COL: 'all',
+      config.SUBSET_COL: 'all',
+    }
+    affixes_for_splitting = [[{'model': model} for model in group_names]]
+  else:
+    group_names = sorted({
+      col[col.index('model-'):col.index('_lang-sk') + len('_lang-sk')] for col in df_metrics.columns})
+    affixes_to_match = [config.WER_PREFIX, 'micro_average']
+    affixes_for_splitting = [
+      group_names, [lambda col: col.endswith(tuple(_PLOTTED_SCENARIOS.values()))]]
+
+  fig, _ax = bisk_plot.plot_bars(
+    df_metrics,
+    affixes_to_match=affixes_to_match,
+    affixes_for_splitting=affixes_for_splitting,
+    group_names=group_names,
+    within_group_names=list(_PLOTTED_SCENARIOS),
+    title='Word error rate',
+    ylabel='Word Error Rate',
+  )
+
+  plt.close(fig)
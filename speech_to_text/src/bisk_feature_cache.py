@@ -0,0 +1,157 @@
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import bisk_packed_audio
+
+
+# Version of the layout of cached features, changed to invalidate files cached in a previous layout
+FEATURE_LAYOUT_VERSION = 2
+
+
+class FeatureCache:
+  """Persistent cache of audio features stored as `.npy` files and loaded as memory maps.
+
+  Features are keyed by the audio file path (or location of a packed clip), a hash of the audio content,
+  the sampling rate and the number of mel bins, so that they can be shared by models using the same features.
+  Once the total size of cached files exceeds `max_size_bytes`, the least recently used files are removed.
+  The cache may be shared by multiple threads. If used from other processes, statistics are only updated
+  for the copy of the cache in each process.
+  """
+
+  def __init__(self, dirpath, max_size_bytes=None):
+    self.dirpath = dirpath
+    self.max_size_bytes = max_size_bytes
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    os.makedirs(self.dirpath, exist_ok=True)
+
+    # Sizes of cached files ordered from the least to the most recently used
+    self._sizes = collections.OrderedDict()
+    self._total_size = 0
+    self._lock = threading.Lock()
+
+    stats = {
+      filename: os.stat(os.path.join(self.dirpath, filename))
+      for filename in os.listdir(self.dirpath)
+      if filename.endswith('.npy') and not filename.endswith('.tmp.npy')}
+
+    for filename in sorted(stats, key=lambda filename: stats[filename].st_mtime):
+      self._sizes[filename] = stats[filename].st_size
+      self._total_size += stats[filename].st_size
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['_lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+  def get_key(self, audio_source, sampling_rate, n_mels):
+    if isinstance(audio_source, bisk_packed_audio.PackedAudioClip):
+      audio_id = (os.path.abspath(audio_source.shard_filepath), audio_source.offset, audio_source.length)
+      audio_hash = audio_source.get_hash()
+    else:
+      audio_id = os.path.abspath(audio_source)
+      audio_hash = get_file_hash(audio_source)
+
+    key_fields = (FEATURE_LAYOUT_VERSION, audio_id, audio_hash, sampling_rate, n_mels)
+
+    return hashlib.sha256(repr(key_fields).encode('utf-8')).hexdigest()
+
+  def load(self, key):
+    with self._lock:
+      return self._load(key)
+
+  def save(self, key, features):
+    filename = f'{key}.npy'
+    filepath = os.path.join(self.dirpath, filename)
+    temp_filepath = os.path.join(self.dirpath, f'{key}.{os.getpid()}.{threading.get_ident()}.tmp.npy')
+
+    np.save(temp_filepath, features)
+    os.replace(temp_filepath, filepath)
+
+    with self._lock:
+      size = os.stat(filepath).st_size
+      self._total_size += size - self._sizes.get(filename, 0)
+      self._sizes[filename] = size
+      self._sizes.move_to_end(filename)
+
+      self._evict()
+
+  def _load(self, key):
+    filename = f'{key}.npy'
+
+    if filename not in self._sizes:
+      self.misses += 1
+      return None
+
+    filepath = os.path.join(self.dirpath, filename)
+
+    try:
+      features = np.load(filepath, mmap_mode='r')
+    except (OSError, ValueError):
+      # The file was removed or is incomplete, e.g. if written by another process at the same time.
+      self._remove(filename)
+      self.misses += 1
+      return None
+
+    # Modification time marks the last use for eviction in later runs, as access time is not updated on some file
+    # systems.
+    os.utime(filepath)
+    self._sizes.move_to_end(filename)
+
+    self.hits += 1
+
+    return features
+
+  def get_statistics(self):
+    with self._lock:
+      return self._get_statistics()
+
+  def _get_statistics(self):
+    n_lookups = self.hits + self.misses
+
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / n_lookups if n_lookups else float('nan'),
+      'evictions': self.evictions,
+      'n_files': len(self._sizes),
+      'size_bytes': self._total_size,
+    }
+
+  def _evict(self):
+    if self.max_size_bytes is None or self._total_size <= self.max_size_bytes:
+      return
+
+    # The most recently saved file is last and is kept even if it alone exceeds the limit.
+    while self._total_size > self.max_size_bytes and len(self._sizes) > 1:
+      self._remove(next(iter(self._sizes)))
+      self.evictions += 1
+
+  def _remove(self, filename):
+    try:
+      os.remove(os.path.join(self.dirpath, filename))
+    except FileNotFoundError:
+      pass
+
+    self._total_size -= self._sizes.pop(filename, 0)
+
+
+def get_file_hash(filepath, chunk_size=1 << 20):
+  hash_obj = hashlib.blake2b(digest_size=16)
+
+  with open(filepath, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      hash_obj.update(chunk)
+
+  return hash_obj.hexdigest()
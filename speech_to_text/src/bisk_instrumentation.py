@@ -0,0 +1,275 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+
+REPORT_FILENAME_SUFFIX = '_run_report.json'
+PROFILE_FILENAME_SUFFIX = '_profile.prof'
+# Number of functions with the highest cumulative time included in the run report when profiling
+N_PROFILED_FUNCTIONS = 30
+
+_current_run_report = None
+# Largest high-water mark of the resident set size in kilobytes before it was reset by a span
+_rss_high_water_mark_before_reset = 0
+
+
+class RunReport:
+  """Records wall time, peak memory and throughput of a run and its stages and saves them to a JSON file.
+
+  A run is entered as a context manager, which makes it the current run for `span`, and the report is saved
+  to `filepath` on exit, including when the run fails. Stages of the run are recorded as spans.
+
+  If `profile` is `True`, the run is profiled by `cProfile`, with statistics saved next to the report and
+  the functions with the highest cumulative time included in the report. If `trace_memory` is `True`, memory
+  allocated by Python is traced by `tracemalloc` and the peak traced memory is reported for each span.
+
+  The peak resident set size of each span is obtained by resetting the high-water mark of the process at the start
+  of the span, which is supported on Linux only. The peak is `None` elsewhere, where only the peak of the process
+  up to the end of the span is reported.
+  """
+
+  def __init__(self, name, filepath, parameters=None, profile=False, trace_memory=False):
+    self.name = name
+    self.filepath = filepath
+    self.parameters = parameters or {}
+    self.profile = profile
+    self.trace_memory = trace_memory
+
+    self.spans = []
+    self.metrics = {}
+
+    self._start_time = None
+    self._start_datetime = None
+    self._span_names = []
+    # Peak traced memory of the run and of each running span, as the peak is reset at the start of each span
+    self._traced_memory_peak = 0
+    self._traced_memory_peaks = []
+    # Peak resident set size in kilobytes of each running span
+    self._rss_peaks = []
+    self._profiler = None
+    self._previous_run_report = None
+
+  def __enter__(self):
+    global _current_run_report
+
+    self._previous_run_report = _current_run_report
+    _current_run_report = self
+
+    if self.trace_memory:
+      tracemalloc.start()
+
+    if self.profile:
+      self._profiler = cProfile.Profile()
+      self._profiler.enable()
+
+    self._start_datetime = datetime.datetime.now(datetime.timezone.utc)
+    self._start_time = time.perf_counter()
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    global _current_run_report
+
+    wall_time = time.perf_counter() - self._start_time
+
+    if self._profiler is not None:
+      self._profiler.disable()
+
+    report = self._get_report(wall_time, exc_value)
+
+    if self.trace_memory:
+      tracemalloc.stop()
+
+    _current_run_report = self._previous_run_report
+
+    _save_json(report, self.filepath)
+
+    print(f'Saved run report to "{self.filepath}"')
+
+  @contextlib.contextmanager
+  def span(self, name, n_rows=None):
+    """Records wall time, peak memory and throughput of a stage of the run.
+
+    Yields a dictionary of the span, in which the number of processed rows may be set as `n_rows` if it is not known
+    in advance. Spans may be nested, in which case their names are joined by `/`.
+    """
+    self._span_names.append(name)
+
+    span = {'name': '/'.join(self._span_names), 'n_rows': n_rows}
+
+    if self.trace_memory:
+      traced_memory_before_span = tracemalloc.get_traced_memory()[0]
+      self._update_traced_memory_peaks()
+      self._traced_memory_peaks.append(0)
+      tracemalloc.reset_peak()
+
+    self._update_rss_peaks()
+    self._rss_peaks.append(0)
+    is_rss_high_water_mark_reset = _reset_rss_high_water_mark()
+
+    start_time = time.perf_counter()
+
+    try:
+      yield span
+    finally:
+      span['start_time'] = start_time - self._start_time
+      span['wall_time'] = time.perf_counter() - start_time
+
+      if span['n_rows'] is not None:
+        span['rows_per_second'] = span['n_rows'] / max(span['wall_time'], 1e-9)
+
+      self._update_rss_peaks()
+      rss_peak = self._rss_peaks.pop()
+      span['peak_rss_mb'] = rss_peak / 1024 if is_rss_high_water_mark_reset else None
+      span['process_peak_rss_mb_at_end'] = get_peak_rss_mb()
+
+      if self.trace_memory:
+        self._update_traced_memory_peaks()
+        span['traced_memory_peak_mb'] = (self._traced_memory_peaks.pop() - traced_memory_before_span) / 1024 ** 2
+
+      self._span_names.pop()
+      self.spans.append(span)
+
+  def _get_report(self, wall_time, exc_value):
+    report = {
+      'name': self.name,
+      'status': 'failed' if exc_value is not None else 'succeeded',
+      'error': repr(exc_value) if exc_value is not None else None,
+      'start_datetime': self._start_datetime.isoformat(),
+      'wall_time': wall_time,
+      'peak_rss_mb': get_peak_rss_mb(),
+      'peak_rss_children_mb': get_peak_rss_mb(children=True),
+      'parameters': self.parameters,
+      'spans': self.spans,
+      'metrics': self.metrics,
+    }
+
+    if self.trace_memory:
+      self._update_traced_memory_peaks()
+      report['traced_memory_peak_mb'] = self._traced_memory_peak / 1024 ** 2
+
+    if self._profiler is not None:
+      profile_filepath = f'{os.path.splitext(self.filepath)[0]}{PROFILE_FILENAME_SUFFIX}'
+
+      os.makedirs(os.path.dirname(os.path.abspath(profile_filepath)), exist_ok=True)
+      self._profiler.dump_stats(profile_filepath)
+
+      report['profile_filepath'] = profile_filepath
+      report['profiled_functions'] = _get_profiled_functions(self._profiler)
+
+    return report
+
+  def _update_traced_memory_peaks(self):
+    traced_memory_peak = tracemalloc.get_traced_memory()[1]
+
+    self._traced_memory_peak = max(self._traced_memory_peak, traced_memory_peak)
+    self._traced_memory_peaks = [max(peak, traced_memory_peak) for peak in self._traced_memory_peaks]
+
+  def _update_rss_peaks(self):
+    rss_high_water_mark = _get_rss_high_water_mark()
+
+    if rss_high_water_mark is not None:
+      self._rss_peaks = [max(peak, rss_high_water_mark) for peak in self._rss_peaks]
+
+
+@contextlib.contextmanager
+def span(name, n_rows=None):
+  """Records a span in the current run report (see `RunReport.span`), doing nothing outside of a run."""
+  if _current_run_report is None:
+    yield {'name': name, 'n_rows': n_rows}
+    return
+
+  with _current_run_report.span(name, n_rows=n_rows) as span_:
+    yield span_
+
+
+def add_metrics(**metrics):
+  """Adds metrics, e.g. cache statistics, to the current run report, doing nothing outside of a run."""
+  if _current_run_report is not None:
+    _current_run_report.metrics.update(metrics)
+
+
+def get_report_filepath(output_filepath):
+  """Returns the path of the run report saved next to `output_filepath`."""
+  return f'{os.path.splitext(output_filepath)[0]}{REPORT_FILENAME_SUFFIX}'
+
+
+def get_peak_rss_mb(children=False):
+  """Returns the peak resident set size of this process, or the largest of its terminated child processes."""
+  peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+
+  if not children:
+    # Resetting the high-water mark in spans also resets the peak reported by `getrusage`.
+    peak_rss = max(peak_rss, _rss_high_water_mark_before_reset)
+
+  # The peak resident set size is reported in bytes on macOS and in kilobytes elsewhere.
+  return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def _get_rss_high_water_mark():
+  """Returns the peak resident set size of this process in kilobytes since the last reset, or `None` if unknown."""
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except OSError:
+    pass
+
+  return None
+
+
+def _reset_rss_high_water_mark():
+  global _rss_high_water_mark_before_reset
+
+  rss_high_water_mark = _get_rss_high_water_mark()
+
+  if rss_high_water_mark is None:
+    return False
+
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+  except OSError:
+    return False
+
+  _rss_high_water_mark_before_reset = max(_rss_high_water_mark_before_reset, rss_high_water_mark)
+
+  return True
+
+
+def _get_profiled_functions(profiler):
+  stats = pstats.Stats(profiler).stats
+
+  profiled_functions = []
+
+  for (filename, line_number, function_name), (_, n_calls, total_time, cumulative_time, _) in sorted(
+        stats.items(), key=lambda item: item[1][3], reverse=True)[:N_PROFILED_FUNCTIONS]:
+    profiled_functions.append({
+      'function': f'{filename}:{line_number}({function_name})',
+      'n_calls': n_calls,
+      'total_time': total_time,
+      'cumulative_time': cumulative_time,
+    })
+
+  return profiled_functions
+
+
+def _save_json(report, filepath):
+  dirpath = os.path.dirname(filepath)
+  if dirpath:
+    os.makedirs(dirpath, exist_ok=True)
+
+  temp_filepath = f'{filepath}.tmp'
+
+  with open(temp_filepath, 'w') as f:
+    json.dump(report, f, indent=2, default=str)
+
+  os.replace(temp_filepath, filepath)
@@ -1,47 +1,255 @@
 import collections
+import hashlib
+import os
+import tempfile
+import warnings
 
 import joblib
 import numpy as np
+import pandas as pd
 import scipy.stats
 
-import torchmetrics
-
 import tqdm
 
+import bisk_scenarios
 import config
 
 
-def compute_metrics_per_row(df):
-  tqdm.tqdm.pandas()
+# Number of bootstrap repetitions evaluated at once
+BOOTSTRAP_BLOCK_SIZE = 100
+# Number of bootstrap repetitions per job when computing metrics for multiple scenarios in parallel
+BOOTSTRAP_JOB_SIZE = 250
+# Number of transcription pairs processed at once by the edit distance kernel
+EDIT_DISTANCE_BATCH_SIZE = 2048
 
-  wer = torchmetrics.text.WordErrorRate()
-  cer = torchmetrics.text.CharErrorRate()
+AVERAGE_TYPES = ['micro_average', 'macro_average']
 
-  cols = df.columns[
-    df.columns.str.startswith(config.PREDICTED_COL_PREFIX)
-    & ~df.columns.str.startswith(config.PREDICTED_RAW_COL_PREFIX)]
+# Dimensions of a confidence interval summary identifying the bootstrapped metric of each row
+SUMMARY_DIM_COLS = [
+  'model', 'language', 'metric', 'average', 'scenario', config.AGE_GROUP_COL, config.SUBSET_COL]
+SUMMARY_VALUE_COLS = ['n_repetitions', 'mean', 'lower', 'upper']
 
-  for col in cols:
-    wer_col_name = config.WER_PREFIX + col[len(config.PREDICTED_COL_PREFIX):]
-    df[wer_col_name] = df.progress_apply(_compute_metric, args=(wer, col), axis=1)
+_METRIC_PREFIXES = {
+  'word': config.WER_PREFIX,
+  'char': config.CER_PREFIX,
+}
 
-    cer_col_name = config.CER_PREFIX + col[len(config.PREDICTED_COL_PREFIX):]
-    df[cer_col_name] = df.progress_apply(_compute_metric, args=(cer, col), axis=1)
+_EDIT_OPERATION_PREFIXES = {
+  'word': {
+    'substitutions': config.WORD_SUBSTITUTIONS_PREFIX,
+    'insertions': config.WORD_INSERTIONS_PREFIX,
+    'deletions': config.WORD_DELETIONS_PREFIX,
+  },
+  'char': {
+    'substitutions': config.CHAR_SUBSTITUTIONS_PREFIX,
+    'insertions': config.CHAR_INSERTIONS_PREFIX,
+    'deletions': config.CHAR_DELETIONS_PREFIX,
+  },
+}
 
+_REFERENCE_LENGTH_COLS = {
+  'word': config.WORD_REFERENCE_LENGTH_COL,
+  'char': config.CHAR_REFERENCE_LENGTH_COL,
+}
 
-def _compute_metric(row, torch_metrics_obj, predicted_col):
-  return torch_metrics_obj(row[predicted_col], row[config.GROUND_TRUTH_COL]).item()
 
+def compute_metrics_per_row(df, n_jobs=1):
+  """Computes WER, CER and the underlying edit operations for each row and each predicted column.
 
-def compute_metrics_via_bootstrapping_for_all_predicted_columns(
-      df, suffix='', n_repetitions=1000, random_state=None, n_jobs=1, save_indexes=False):
-  predicted_cols = [
+  Transcriptions are tokenized once into integer ids at word and character level, and edit operations
+  for all predicted columns are computed in batches by a vectorized edit distance kernel.
+  Counts of substitutions, insertions and deletions and reference lengths are stored as new columns
+  so that bootstrapping can reuse them.
+  """
+  predicted_cols = get_predicted_cols(df)
+
+  for level, tokenize_func in [('word', _tokenize_into_word_ids), ('char', _tokenize_into_char_ids)]:
+    target_token_ids, predicted_token_ids_per_col = tokenize_func(
+      df[config.GROUND_TRUTH_COL], [df[col] for col in predicted_cols])
+
+    # Edit operations for all predicted columns are computed in a single pass.
+    target_ids, target_offsets = _concatenate_token_ids([target_token_ids] * len(predicted_cols))
+    predicted_ids, predicted_offsets = _concatenate_token_ids(predicted_token_ids_per_col)
+
+    substitutions, insertions, deletions = compute_edit_operations(
+      predicted_ids, predicted_offsets, target_ids, target_offsets, n_jobs=n_jobs)
+
+    reference_lengths = np.diff(target_token_ids[1])
+    df[_REFERENCE_LENGTH_COLS[level]] = reference_lengths
+
+    for col_index, col in enumerate(predicted_cols):
+      col_root = col[len(config.PREDICTED_COL_PREFIX):]
+      rows = slice(col_index * len(df), (col_index + 1) * len(df))
+
+      df[_EDIT_OPERATION_PREFIXES[level]['substitutions'] + col_root] = substitutions[rows]
+      df[_EDIT_OPERATION_PREFIXES[level]['insertions'] + col_root] = insertions[rows]
+      df[_EDIT_OPERATION_PREFIXES[level]['deletions'] + col_root] = deletions[rows]
+
+      df[_METRIC_PREFIXES[level] + col_root] = _divide_like_torchmetrics(
+        substitutions[rows] + insertions[rows] + deletions[rows], reference_lengths)
+
+
+def get_predicted_cols(df):
+  return [
     col for col in df.columns
     if col.startswith(config.PREDICTED_COL_PREFIX) and not col.startswith(config.PREDICTED_RAW_COL_PREFIX)]
 
+
+def compute_edit_operations(predicted_ids, predicted_offsets, target_ids, target_offsets, n_jobs=1):
+  """Computes the number of substitutions, insertions and deletions for each pair of token sequences.
+
+  Sequences are given as flat arrays of integer token ids, with the i-th sequence spanning
+  `ids[offsets[i]:offsets[i + 1]]`. Pairs of similar lengths are grouped into batches and each
+  batch is processed by a dynamic programming kernel vectorized across the pairs in the batch.
+  """
+  predicted_lengths = np.diff(predicted_offsets)
+  target_lengths = np.diff(target_offsets)
+
+  pair_order = np.lexsort((predicted_lengths, target_lengths))
+
+  batches = [
+    (
+      _pad_token_ids(predicted_ids, predicted_offsets[pair_indexes], predicted_lengths[pair_indexes]),
+      predicted_lengths[pair_indexes],
+      _pad_token_ids(target_ids, target_offsets[pair_indexes], target_lengths[pair_indexes]),
+      target_lengths[pair_indexes],
+    )
+    for pair_indexes in np.array_split(pair_order, max(1, -(-len(pair_order) // EDIT_DISTANCE_BATCH_SIZE)))
+  ]
+
+  operations_per_batch = joblib.Parallel(n_jobs=n_jobs)(
+    joblib.delayed(_compute_edit_operations_for_batch)(*batch) for batch in tqdm.tqdm(batches)
+  )
+
+  operations = np.zeros((len(pair_order), 3), dtype=np.int64)
+  if operations_per_batch:
+    operations[pair_order] = np.concatenate(operations_per_batch)
+
+  return operations[:, 0], operations[:, 1], operations[:, 2]
+
+
+def _compute_edit_operations_for_batch(predicted, predicted_lengths, target, target_lengths):
+  # Each cell of the dynamic programming table holds a single integer packing the edit distance,
+  # the number of substitutions and the number of insertions, in this order of significance.
+  # Taking the minimum thus selects the shortest alignment and breaks ties consistently,
+  # and the number of deletions is the remainder of the edit distance.
+  base = max(predicted.shape[1], target.shape[1]) + 1
+  deletion_cost = base * base
+  insertion_cost = deletion_cost + 1
+  substitution_cost = deletion_cost + base
+
+  batch_indexes = np.arange(len(predicted))
+  insertion_costs_per_column = np.arange(predicted.shape[1] + 1, dtype=np.int64) * insertion_cost
+
+  previous_row = np.tile(insertion_costs_per_column, (len(predicted), 1))
+  packed_results = previous_row[batch_indexes, predicted_lengths].copy()
+
+  for i in range(1, target.shape[1] + 1):
+    costs = np.where(predicted == target[:, i - 1:i], 0, substitution_cost)
+
+    current_row = np.empty_like(previous_row)
+    current_row[:, 0] = previous_row[:, 0] + deletion_cost
+    current_row[:, 1:] = np.minimum(previous_row[:, 1:] + deletion_cost, previous_row[:, :-1] + costs)
+    # Insertions chain along the row, which a cumulative minimum resolves without a Python loop.
+    current_row = (
+      np.minimum.accumulate(current_row - insertion_costs_per_column, axis=1) + insertion_costs_per_column)
+
+    is_finished = target_lengths == i
+    packed_results[is_finished] = current_row[batch_indexes[is_finished], predicted_lengths[is_finished]]
+
+    previous_row = current_row
+
+  distances, remainders = np.divmod(packed_results, base * base)
+  substitutions, insertions = np.divmod(remainders, base)
+
+  return np.stack([substitutions, insertions, distances - substitutions - insertions], axis=1)
+
+
+def _pad_token_ids(ids, offsets, lengths):
+  max_length = lengths.max(initial=0)
+  positions = offsets[:, np.newaxis] + np.arange(max_length)
+  is_token = np.arange(max_length) < lengths[:, np.newaxis]
+
+  if len(ids) == 0:
+    return np.full(positions.shape, -1, dtype=np.int64)
+
+  return np.where(is_token, ids[np.minimum(positions, len(ids) - 1)], -1)
+
+
+def _tokenize_into_word_ids(target_transcriptions, predicted_transcriptions_per_col):
+  tokens_per_col = [
+    [transcription.split() for transcription in transcriptions]
+    for transcriptions in [target_transcriptions, *predicted_transcriptions_per_col]
+  ]
+
+  # A single vocabulary ensures that equal words map to equal ids across all columns.
+  ids, _vocabulary = pd.factorize(
+    np.array([token for tokens in tokens_per_col for transcription in tokens for token in transcription], dtype=object))
+
+  token_ids_per_col = []
+  start = 0
+  for tokens in tokens_per_col:
+    offsets = np.concatenate([[0], np.cumsum([len(transcription) for transcription in tokens], dtype=np.int64)])
+    token_ids_per_col.append((ids[start:start + offsets[-1]].astype(np.int64), offsets))
+    start += offsets[-1]
+
+  return token_ids_per_col[0], token_ids_per_col[1:]
+
+
+def _tokenize_into_char_ids(target_transcriptions, predicted_transcriptions_per_col):
+  token_ids_per_col = []
+
+  for transcriptions in [target_transcriptions, *predicted_transcriptions_per_col]:
+    transcriptions = list(transcriptions)
+    # Unicode code points serve as character ids.
+    ids = np.frombuffer(''.join(transcriptions).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum([len(transcription) for transcription in transcriptions], dtype=np.int64)])
+    token_ids_per_col.append((ids, offsets))
+
+  return token_ids_per_col[0], token_ids_per_col[1:]
+
+
+def _concatenate_token_ids(token_ids_per_col):
+  ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [ids for ids, _offsets in token_ids_per_col])
+
+  offsets = [np.zeros(1, dtype=np.int64)]
+  start = 0
+  for ids_per_col, offsets_per_col in token_ids_per_col:
+    offsets.append(offsets_per_col[1:] + start)
+    start += len(ids_per_col)
+
+  return ids, np.concatenate(offsets)
+
+
+def _divide_like_torchmetrics(errors, totals):
+  # torchmetrics accumulates the counts and divides them in single precision.
+  # The division is kept in single precision so that the results match torchmetrics.
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return (np.asarray(errors).astype(np.float32) / np.asarray(totals).astype(np.float32)).astype(np.float64)
+
+
+def compute_metrics_via_bootstrapping_for_all_predicted_columns(
+      df, suffix='', n_repetitions=1000, random_state=None, n_jobs=1, sampled_indexes=None,
+      rows=None, predicted_cols=None):
+  """Computes bootstrapped metrics for all predicted columns.
+
+  All columns are evaluated on the same resampled rows, which makes the comparisons between models paired.
+
+  `rows` contains positions of rows in `df` to evaluate, e.g. rows of a particular scenario. If not specified,
+  all rows are evaluated. `predicted_cols` may be specified if `df` contains only per-row statistics
+  (see `get_row_statistics`) rather than the transcriptions.
+  """
+  if predicted_cols is None:
+    predicted_cols = get_predicted_cols(df)
+
+  n_rows = len(df.index) if rows is None else len(rows)
+
+  if sampled_indexes is None:
+    sampled_indexes = get_bootstrap_indexes(n_rows, n_repetitions, random_state)
+
   metrics_list = joblib.Parallel(n_jobs=n_jobs)(
     joblib.delayed(compute_metrics_via_bootstrapping)(
-      df, col, suffix, n_repetitions, random_state, save_indexes)
+      df, col, suffix, n_repetitions, random_state, sampled_indexes, rows)
     for col in predicted_cols
   )
 
@@ -53,42 +261,369 @@ def compute_metrics_via_bootstrapping_for_all_predicted_columns(
 
 
 def compute_metrics_via_bootstrapping(
-        df, predicted_col, suffix='', n_repetitions=1000, random_state=None, save_indexes=False):
+        df, predicted_col, suffix='', n_repetitions=1000, random_state=None, sampled_indexes=None, rows=None):
+  """Computes micro- and macro-averaged WER and CER for each bootstrap repetition.
+
+  Edit distances and reference lengths are computed once per row. Each repetition then only sums
+  the per-row statistics over the sampled rows, which is done for a block of repetitions at once.
+
+  If `sampled_indexes` (as returned by `get_bootstrap_indexes`) is not given, it is generated
+  from `n_repetitions` and `random_state`. If `rows` is specified, only rows at these positions are evaluated
+  and `sampled_indexes` refers to positions within `rows`.
+  """
+  rows = np.arange(len(df.index)) if rows is None else np.asarray(rows)
+
+  if sampled_indexes is None:
+    sampled_indexes = get_bootstrap_indexes(len(rows), n_repetitions, random_state)
+
+  return _compute_bootstrapped_metrics(
+    _get_row_statistics_for_col(df, predicted_col),
+    predicted_col[len(config.PREDICTED_COL_PREFIX):],
+    suffix,
+    rows,
+    sampled_indexes,
+  )
+
+
+def compute_metrics_via_bootstrapping_for_scenarios(
+      df, scenarios, predicted_cols=None, n_repetitions=1000, random_state=None, n_jobs=1,
+      n_repetitions_per_job=BOOTSTRAP_JOB_SIZE, indexes_dirpath=None, cache_dirpath=None, tolerance=None):
+  """Computes bootstrapped metrics for all scenarios and predicted columns in a pool of processes.
+
+  Work is split into jobs, one per scenario, predicted column and chunk of `n_repetitions_per_job` repetitions.
+  Per-row statistics, rows of each scenario and bootstrap indexes are stored in memory-mapped files
+  shared by the worker processes rather than being copied to each job.
+
+  Yields pairs of scenario and its metrics in the order of `scenarios` (see `bisk_scenarios.get_scenarios`).
+  The results do not depend on `n_jobs`. If `indexes_dirpath` is specified, bootstrap indexes and rows
+  of each scenario are kept in that directory.
+
+  If `cache_dirpath` and `random_state` are specified, metrics of each pair of scenario and predicted column are stored
+  in that directory under a fingerprint of their inputs (see `get_bootstrap_fingerprint`), and pairs
+  whose metrics are already stored are not computed again. Without a fixed `random_state`, bootstrap samples
+  differ between runs, hence no metrics are cached.
+
+  If `tolerance` is specified, metrics for each pair of scenario and predicted column are computed in a single job
+  in blocks of `BOOTSTRAP_BLOCK_SIZE` repetitions. Computation stops once the lower and upper bounds of confidence
+  intervals (see `get_confidence_interval_and_mean`) of all metrics change by less than `tolerance` after adding
+  a block, or after `n_repetitions` repetitions. The number of repetitions then differs between predicted columns
+  and scenarios.
+  """
+  if predicted_cols is None:
+    predicted_cols = get_predicted_cols(df)
+
+  if random_state is None:
+    cache_dirpath = None
+
+  if tolerance is None:
+    n_jobs_per_col = len(range(0, n_repetitions, n_repetitions_per_job))
+  else:
+    n_jobs_per_col = 1
+
+  with tempfile.TemporaryDirectory() as temp_dirpath:
+    row_statistics_filepath = os.path.join(temp_dirpath, 'row_statistics.joblib')
+    joblib.dump({col: _get_row_statistics_for_col(df, col) for col in predicted_cols}, row_statistics_filepath)
+    row_statistics = joblib.load(row_statistics_filepath, mmap_mode='r')
+
+    plan = []
+    for scenario in scenarios:
+      rows = np.flatnonzero(scenario['mask'])
+
+      fingerprints = {}
+      cached_metrics = {}
+      if cache_dirpath is not None:
+        for col in predicted_cols:
+          fingerprints[col] = get_bootstrap_fingerprint(
+            row_statistics[col], rows, col, n_repetitions, random_state, tolerance)
+          cached_metrics[col] = _load_cached_metrics(cache_dirpath, fingerprints[col], scenario['suffix'])
+
+      plan.append({
+        'scenario': scenario,
+        'rows': rows,
+        'cols_to_compute': [col for col in predicted_cols if cached_metrics.get(col) is None],
+        'fingerprints': fingerprints,
+        'cached_metrics': cached_metrics,
+      })
+
+    jobs = _generate_bootstrap_jobs(
+      row_statistics, df.index.to_numpy(), plan, n_repetitions, random_state,
+      n_repetitions_per_job, temp_dirpath, indexes_dirpath, tolerance)
+
+    results = joblib.Parallel(n_jobs=n_jobs, return_as='generator')(jobs)
+
+    for item in plan:
+      metrics = {}
+
+      # Results arrive in the order of jobs, i.e. by predicted column and then by chunk of repetitions.
+      for col in predicted_cols:
+        if col not in item['cols_to_compute']:
+          metrics.update(item['cached_metrics'][col])
+          continue
+
+        metrics_for_col = collections.defaultdict(list)
+        for _ in range(n_jobs_per_col):
+          for name, values in next(results).items():
+            metrics_for_col[name].extend(values)
+
+        if cache_dirpath is not None:
+          _save_cached_metrics(cache_dirpath, item['fingerprints'][col], item['scenario']['suffix'], metrics_for_col)
+
+        metrics.update(metrics_for_col)
+
+      yield item['scenario'], metrics
+
+
+def get_bootstrap_fingerprint(
+      row_statistics_for_col, rows, predicted_col, n_repetitions, random_state, tolerance=None):
+  """Returns a fingerprint of inputs determining bootstrapped metrics of a single scenario and predicted column.
+
+  The fingerprint covers the name of the predicted column, positions of rows in the scenario,
+  per-row statistics of these rows, the number of repetitions, the random state and the convergence tolerance.
+  """
+  hash_obj = hashlib.sha256()
+
+  hash_obj.update(repr((predicted_col, n_repetitions, random_state, tolerance)).encode('utf-8'))
+  hash_obj.update(np.ascontiguousarray(rows, dtype=np.int64).tobytes())
+
+  for name in sorted(row_statistics_for_col):
+    hash_obj.update(name.encode('utf-8'))
+    hash_obj.update(np.ascontiguousarray(row_statistics_for_col[name][rows]).tobytes())
+
+  return hash_obj.hexdigest()
+
+
+def _load_cached_metrics(cache_dirpath, fingerprint, suffix):
+  filepath = os.path.join(cache_dirpath, f'{fingerprint}.parquet')
+
+  if not os.path.exists(filepath):
+    return None
+
+  # Metric names are stored without the scenario suffix as the same metrics may be shared by multiple scenarios.
+  return {
+    f'{name}{suffix}': values.tolist()
+    for name, values in pd.read_parquet(filepath).items()
+  }
+
+
+def _save_cached_metrics(cache_dirpath, fingerprint, suffix, metrics):
+  os.makedirs(cache_dirpath, exist_ok=True)
+
+  filepath = os.path.join(cache_dirpath, f'{fingerprint}.parquet')
+  temp_filepath = f'{filepath}.tmp'
+
+  pd.DataFrame({name[:len(name) - len(suffix)]: values for name, values in metrics.items()}).to_parquet(temp_filepath)
+  # Renaming ensures that incomplete files are never picked up after a failure.
+  os.replace(temp_filepath, filepath)
+
+
+def _generate_bootstrap_jobs(
+      row_statistics, row_labels, plan, n_repetitions, random_state,
+      n_repetitions_per_job, temp_dirpath, indexes_dirpath, tolerance):
+  # Bootstrap indexes are generated lazily, only once jobs of the corresponding scenario are dispatched.
+  for item in plan:
+    scenario = item['scenario']
+    rows = item['rows']
+
+    if indexes_dirpath is not None:
+      np.save(os.path.join(indexes_dirpath, f'sampled_rows__{scenario["suffix"]}.npy'), row_labels[rows])
+    elif not item['cols_to_compute']:
+      continue
+
+    rows = _to_memory_map(rows, os.path.join(temp_dirpath, f'rows__{scenario["suffix"]}.npy'))
+
+    sampled_indexes = get_bootstrap_indexes(
+      len(rows),
+      n_repetitions,
+      random_state,
+      filepath=os.path.join(
+        indexes_dirpath if indexes_dirpath is not None else temp_dirpath,
+        f'sampled_indexes__{scenario["suffix"]}.npy'),
+    )
+
+    for col in item['cols_to_compute']:
+      if tolerance is not None:
+        yield joblib.delayed(_compute_bootstrapped_metrics_until_convergence)(
+          row_statistics[col],
+          col[len(config.PREDICTED_COL_PREFIX):],
+          scenario['suffix'],
+          rows,
+          sampled_indexes,
+          tolerance,
+        )
+        continue
+
+      for start in range(0, n_repetitions, n_repetitions_per_job):
+        yield joblib.delayed(_compute_bootstrapped_metrics)(
+          row_statistics[col],
+          col[len(config.PREDICTED_COL_PREFIX):],
+          scenario['suffix'],
+          rows,
+          sampled_indexes[start:start + n_repetitions_per_job],
+        )
+
+
+def _to_memory_map(array, filepath):
+  np.save(filepath, array)
+  return np.load(filepath, mmap_mode='r')
+
+
+def get_bootstrap_indexes(n_rows, n_repetitions=1000, random_state=None, filepath=None):
+  """Samples row positions with replacement for each bootstrap repetition.
+
+  Returns an int32 matrix of shape `(n_repetitions, n_rows)`. If `filepath` is specified,
+  the matrix is written to a `.npy` file and returned as a read-only memory map.
+  """
   random_generator = np.random.default_rng(random_state)
 
+  if filepath is None or n_rows * n_repetitions == 0:
+    sampled_indexes = np.empty((n_repetitions, n_rows), dtype=np.int32)
+  else:
+    sampled_indexes = np.lib.format.open_memmap(filepath, mode='w+', dtype=np.int32, shape=(n_repetitions, n_rows))
+
+  # Sampling row by row preserves the random sequence of the former per-repetition implementation.
+  for repetition_index in range(n_repetitions):
+    sampled_indexes[repetition_index] = random_generator.choice(n_rows, size=n_rows)
+
+  if filepath is None:
+    return sampled_indexes
+
+  if isinstance(sampled_indexes, np.memmap):
+    sampled_indexes.flush()
+    del sampled_indexes
+    return np.load(filepath, mmap_mode='r')
+
+  np.save(filepath, sampled_indexes)
+  return sampled_indexes
+
+
+def get_row_statistics(df, predicted_cols=None):
+  """Returns a table of per-row statistics required for bootstrapping, without the transcriptions.
+
+  The table contains reference lengths, counts of edit operations and per-row metrics
+  computed by `compute_metrics_per_row` for each predicted column.
+  """
+  if predicted_cols is None:
+    predicted_cols = get_predicted_cols(df)
+
+  cols = list(_REFERENCE_LENGTH_COLS.values())
+
+  for col in predicted_cols:
+    col_root = col[len(config.PREDICTED_COL_PREFIX):]
+
+    for level in ['word', 'char']:
+      cols.extend(prefix + col_root for prefix in _EDIT_OPERATION_PREFIXES[level].values())
+      cols.append(_METRIC_PREFIXES[level] + col_root)
+
+  return df[cols]
+
+
+def _get_row_statistics_for_col(df, predicted_col):
   predicted_col_root = predicted_col[len(config.PREDICTED_COL_PREFIX):]
 
-  wer_obj = torchmetrics.text.WordErrorRate()
-  wer_col = config.WER_PREFIX + predicted_col_root
+  word_errors, word_reference_lengths = _get_errors_and_reference_lengths(df, predicted_col, 'word')
+  char_errors, char_reference_lengths = _get_errors_and_reference_lengths(df, predicted_col, 'char')
 
-  cer_obj = torchmetrics.text.CharErrorRate()
-  cer_col = config.CER_PREFIX + predicted_col_root
+  return {
+    'word_errors': word_errors,
+    'word_reference_lengths': word_reference_lengths,
+    'wer': df[config.WER_PREFIX + predicted_col_root].to_numpy(dtype=np.float64),
+    'char_errors': char_errors,
+    'char_reference_lengths': char_reference_lengths,
+    'cer': df[config.CER_PREFIX + predicted_col_root].to_numpy(dtype=np.float64),
+  }
 
+
+def _compute_bootstrapped_metrics(row_statistics, predicted_col_root, suffix, rows, sampled_indexes):
   metrics = collections.defaultdict(list)
 
-  for _ in range(0, n_repetitions):
-    sampled_indexes = random_generator.choice(df.index, size=len(df.index))
+  for block_start in range(0, len(sampled_indexes), BOOTSTRAP_BLOCK_SIZE):
+    sampled_positions = rows[sampled_indexes[block_start:block_start + BOOTSTRAP_BLOCK_SIZE]]
 
-    predicted_transcriptions_sampled = df.loc[sampled_indexes, predicted_col]
-    target_transcriptions_sampled = df.loc[sampled_indexes, config.GROUND_TRUTH_COL]
+    metrics[f'{config.WER_PREFIX}micro_average_{predicted_col_root}{suffix}'].extend(
+      _compute_micro_average(
+        row_statistics['word_errors'], row_statistics['word_reference_lengths'], sampled_positions))
+    metrics[f'{config.WER_PREFIX}macro_average_{predicted_col_root}{suffix}'].extend(
+      _compute_macro_average(row_statistics['wer'], sampled_positions))
 
-    metrics[f'{config.WER_PREFIX}micro_average_{predicted_col_root}{suffix}'].append(
-      wer_obj(predicted_transcriptions_sampled, target_transcriptions_sampled).item())
-    metrics[f'{config.WER_PREFIX}macro_average_{predicted_col_root}{suffix}'].append(
-      df.loc[sampled_indexes, wer_col].mean())
+    metrics[f'{config.CER_PREFIX}micro_average_{predicted_col_root}{suffix}'].extend(
+      _compute_micro_average(
+        row_statistics['char_errors'], row_statistics['char_reference_lengths'], sampled_positions))
+    metrics[f'{config.CER_PREFIX}macro_average_{predicted_col_root}{suffix}'].extend(
+      _compute_macro_average(row_statistics['cer'], sampled_positions))
 
-    metrics[f'{config.CER_PREFIX}micro_average_{predicted_col_root}{suffix}'].append(
-      cer_obj(predicted_transcriptions_sampled, target_transcriptions_sampled).item())
-    metrics[f'{config.CER_PREFIX}macro_average_{predicted_col_root}{suffix}'].append(
-      df.loc[sampled_indexes, cer_col].mean())
+  return metrics
 
-    if save_indexes:
-      metrics[f'sampled_indexes_{predicted_col_root}{suffix}'].append(sampled_indexes)
+
+def _get_errors_and_reference_lengths(df, predicted_col, level):
+  """Returns the number of edit operations and the reference length for each row.
+
+  Counts precomputed by `compute_metrics_per_row` are reused if present.
+  """
+  predicted_col_root = predicted_col[len(config.PREDICTED_COL_PREFIX):]
+  operation_cols = [prefix + predicted_col_root for prefix in _EDIT_OPERATION_PREFIXES[level].values()]
+  reference_length_col = _REFERENCE_LENGTH_COLS[level]
+
+  if all(col in df.columns for col in operation_cols) and reference_length_col in df.columns:
+    return df[operation_cols].to_numpy(dtype=np.int64).sum(axis=1), df[reference_length_col].to_numpy(dtype=np.int64)
+
+  tokenize_func = _tokenize_into_word_ids if level == 'word' else _tokenize_into_char_ids
+  (target_ids, target_offsets), [(predicted_ids, predicted_offsets)] = tokenize_func(
+    df[config.GROUND_TRUTH_COL], [df[predicted_col]])
+
+  substitutions, insertions, deletions = compute_edit_operations(
+    predicted_ids, predicted_offsets, target_ids, target_offsets)
+
+  return substitutions + insertions + deletions, np.diff(target_offsets)
+
+
+def _compute_bootstrapped_metrics_until_convergence(
+      row_statistics, predicted_col_root, suffix, rows, sampled_indexes, tolerance, alpha=0.95):
+  metrics = collections.defaultdict(list)
+  previous_bounds = None
+
+  for block_start in range(0, len(sampled_indexes), BOOTSTRAP_BLOCK_SIZE):
+    metrics_for_block = _compute_bootstrapped_metrics(
+      row_statistics, predicted_col_root, suffix, rows, sampled_indexes[block_start:block_start + BOOTSTRAP_BLOCK_SIZE])
+
+    for name, values in metrics_for_block.items():
+      metrics[name].extend(values)
+
+    with warnings.catch_warnings():
+      # Bounds are undefined for empty scenarios or constant values.
+      warnings.simplefilter('ignore', category=RuntimeWarning)
+      bounds = np.array([get_confidence_interval_and_mean(values, alpha=alpha)[1:] for values in metrics.values()])
+
+    if previous_bounds is not None:
+      is_bound_converged = (np.abs(bounds - previous_bounds) < tolerance) | (np.isnan(bounds) & np.isnan(previous_bounds))
+      if is_bound_converged.all():
+        break
+
+    previous_bounds = bounds
 
   return metrics
 
 
+def _compute_micro_average(errors, totals, sampled_positions):
+  return _divide_like_torchmetrics(
+    errors[sampled_positions].sum(axis=1), totals[sampled_positions].sum(axis=1)).tolist()
+
+
+def _compute_macro_average(metric_per_row, sampled_positions):
+  # Missing values are skipped in the same way as in `pandas.Series.mean`.
+  sampled_metric = metric_per_row[sampled_positions]
+  is_valid = ~np.isnan(sampled_metric)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    macro_averages = np.where(is_valid, sampled_metric, 0).sum(axis=1) / is_valid.sum(axis=1)
+
+  return macro_averages.tolist()
+
+
 def get_confidence_interval_and_mean(means, alpha=0.95):
+  # Metrics bootstrapped until convergence may have fewer repetitions than others, the rest being missing values.
+  means = np.asarray(means, dtype=np.float64)
+  means = means[~np.isnan(means)]
+
   mean, std = scipy.stats.norm.fit(means)
   lower, upper = scipy.stats.norm.interval(alpha, mean, std)
 
@@ -109,3 +644,95 @@ def get_confidence_interval_values_per_col(df, col_groups, within_group_names, a
       upper_per_col[within_group_name].append(upper)
 
   return mean_per_col, lower_per_col, upper_per_col
+
+
+def get_confidence_interval_summary(df_metrics, alphas=(0.95,)):
+  """Returns a long-format table with the mean and confidence interval bounds of each bootstrapped metric and alpha.
+
+  Each row identifies the metric by its column name in `df_metrics` and by `SUMMARY_DIM_COLS` parsed from the name,
+  stored as categorical columns. Values are the same as computed by `get_confidence_interval_and_mean`, but for all
+  columns at once. Columns not named as bootstrapped metrics, such as sampled indexes merged from legacy outputs,
+  are skipped with a warning.
+  """
+  dims_per_col = {col: parse_metric_name(col) for col in df_metrics.columns}
+  skipped_cols = [col for col, dims_for_col in dims_per_col.items() if dims_for_col is None]
+
+  if skipped_cols:
+    warnings.warn(f'Skipping columns not named as bootstrapped metrics: {skipped_cols}')
+    df_metrics = df_metrics.drop(columns=skipped_cols)
+
+  values = df_metrics.to_numpy(dtype=np.float64)
+
+  with warnings.catch_warnings():
+    # Bounds are undefined for empty scenarios or constant values.
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+
+    n_repetitions = (~np.isnan(values)).sum(axis=0)
+    means = np.nanmean(values, axis=0)
+    # Maximum likelihood estimate of the standard deviation, as obtained by `scipy.stats.norm.fit`
+    stds = np.sqrt(np.nanmean((values - means) ** 2, axis=0))
+
+    bounds_per_alpha = [scipy.stats.norm.interval(alpha, means, stds) for alpha in alphas]
+
+  dims = pd.DataFrame([dims_per_col[col] for col in df_metrics.columns], columns=SUMMARY_DIM_COLS)
+
+  summary = pd.concat(
+    [
+      dims.assign(
+        name=df_metrics.columns, alpha=alpha, n_repetitions=n_repetitions, mean=means, lower=lower, upper=upper)
+      for alpha, (lower, upper) in zip(alphas, bounds_per_alpha)
+    ],
+    ignore_index=True,
+  )
+
+  return summary[['name'] + SUMMARY_DIM_COLS + ['alpha'] + SUMMARY_VALUE_COLS].astype(
+    {col: 'category' for col in SUMMARY_DIM_COLS})
+
+
+def parse_metric_name(name):
+  """Splits a name of a bootstrapped metric into values of `SUMMARY_DIM_COLS`, returning `None` for other names."""
+  for metric_prefix in _METRIC_PREFIXES.values():
+    for average in AVERAGE_TYPES:
+      prefix = f'{metric_prefix}{average}_'
+
+      if not name.startswith(prefix):
+        continue
+
+      model, separator, remainder = name[len(prefix):].partition('_lang-')
+      language, _, suffix = remainder.partition('_')
+
+      if not separator or not suffix:
+        break
+
+      return (model, language, metric_prefix.rstrip('_'), average) + bisk_scenarios.parse_suffix(suffix)
+
+  return None
+
+
+def is_confidence_interval_summary(df):
+  return all(col in df.columns for col in ['name', 'alpha'] + SUMMARY_VALUE_COLS)
+
+
+def get_confidence_interval_values_per_col_from_summary(summary, col_groups, within_group_names, alpha=0.95):
+  """Returns the same values as `get_confidence_interval_values_per_col` looked up in a confidence interval summary."""
+  summary_for_alpha = summary[np.isclose(summary['alpha'], alpha)]
+
+  if summary_for_alpha.empty:
+    available_alphas = sorted(summary['alpha'].unique().tolist())
+    raise ValueError(f'Confidence intervals for alpha {alpha} not found in the summary, available: {available_alphas}')
+
+  values_per_name = summary_for_alpha.set_index('name')[['mean', 'lower', 'upper']]
+
+  mean_per_col = collections.defaultdict(list)
+  lower_per_col = collections.defaultdict(list)
+  upper_per_col = collections.defaultdict(list)
+
+  for group in col_groups:
+    for col, within_group_name in zip(group, within_group_names):
+      mean, lower, upper = values_per_name.loc[col]
+
+      mean_per_col[within_group_name].append(mean)
+      lower_per_col[within_group_name].append(lower)
+      upper_per_col[within_group_name].append(upper)
+
+  return mean_per_col, lower_per_col, upper_per_col
@@ -0,0 +1,68 @@
+import copy
+import time
+
+import torch
+import transformers
+
+
+META_MMS_MODEL_ID = 'facebook/mms-1b-fl102'
+
+
+class MetaMmsModel:
+  """Meta MMS model and processor loaded once and switched between language adapters in place.
+
+  The adapter weights, the language model head and the tokenizer of the loaded model are kept aside so that the model
+  can be reset to the default head (used for automatic language recognition) after loading a language adapter.
+
+  `load_time` holds the total time in seconds spent loading the model and switching adapters.
+  """
+
+  def __init__(self, model_id=META_MMS_MODEL_ID, device='cpu'):
+    start_time = time.perf_counter()
+
+    self.model_id = model_id
+    self.device = device
+
+    self.processor = transformers.AutoProcessor.from_pretrained(self.model_id)
+    self.model = transformers.Wav2Vec2ForCTC.from_pretrained(self.model_id)
+
+    self.model.to(self.device)
+    self.model.eval()
+
+    self.language = None
+
+    self._default_target_lang = self.model.target_lang
+    self._default_adapter_weights = {
+      name: param.detach().clone() for name, param in self.model._get_adapters().items()}
+    self._default_tokenizer = copy.deepcopy(self.processor.tokenizer)
+
+    self.load_time = time.perf_counter() - start_time
+
+  def set_language(self, language):
+    """Loads the adapter for `language`, or restores the default head if `language` is `None`."""
+    if language == self.language:
+      return
+
+    start_time = time.perf_counter()
+
+    if language is not None:
+      self.processor.tokenizer.set_target_lang(language)
+      self.model.load_adapter(language)
+    else:
+      self._reset_to_default()
+
+    self.language = language
+
+    self.load_time += time.perf_counter() - start_time
+
+  def _reset_to_default(self):
+    self.processor.tokenizer = copy.deepcopy(self._default_tokenizer)
+
+    default_vocab_size = self._default_adapter_weights['lm_head.weight'].shape[0]
+    if default_vocab_size != self.model.config.vocab_size:
+      self.model.lm_head = torch.nn.Linear(
+        self.model.config.output_hidden_size, default_vocab_size, device=self.model.device, dtype=self.model.dtype)
+      self.model.config.vocab_size = default_vocab_size
+
+    self.model.load_state_dict(self._default_adapter_weights, strict=False)
+    self.model.target_lang = self._default_target_lang
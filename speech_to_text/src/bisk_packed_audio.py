@@ -0,0 +1,140 @@
+import functools
+import hashlib
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+import config
+
+
+PACKED_AUDIO_DIRNAME = 'audio_packed'
+MAX_SHARD_SIZE_BYTES = 1 << 30
+DTYPES = ['float32', 'int16']
+# Formats of preprocessed audio, either individual audio files or shards of a dtype
+AUDIO_FORMATS = ['files'] + [f'packed-{dtype}' for dtype in DTYPES]
+
+# Scale of 16-bit samples, matching the conversion in `whisper.load_audio`
+INT16_SCALE = 32768
+
+
+class PackedAudioClip(NamedTuple):
+  """Mono waveform stored in a shard file at `offset` samples from the start, `length` samples long."""
+
+  shard_filepath: str
+  offset: int
+  length: int
+
+  def load(self):
+    """Returns the waveform as float32 samples, as a memory-mapped slice of the shard if stored as float32."""
+    samples = _open_shard(self.shard_filepath)[self.offset:self.offset + self.length]
+
+    if samples.dtype == np.int16:
+      return samples.astype(np.float32) / INT16_SCALE
+
+    return samples
+
+  def get_hash(self):
+    return hashlib.blake2b(
+      _open_shard(self.shard_filepath)[self.offset:self.offset + self.length].tobytes(), digest_size=16,
+    ).hexdigest()
+
+
+class PackedAudioWriter:
+  """Appends mono waveforms to shard files, starting a new shard once it reaches `max_shard_size_bytes`.
+
+  Shards are written to `rel_dirpath` within `root_dirpath`, the directory path containing audio samples of a dataset.
+
+  Shards are raw arrays of samples of `dtype` (`'float32'` or `'int16'`), named after the dtype. Float samples are
+  expected in the [-1, 1] range and are clipped when converted to 16-bit integers.
+  """
+
+  def __init__(
+        self, root_dirpath, rel_dirpath=PACKED_AUDIO_DIRNAME, dtype='float32', max_shard_size_bytes=MAX_SHARD_SIZE_BYTES):
+    if dtype not in DTYPES:
+      raise ValueError(f'Unsupported dtype "{dtype}", expected one of {DTYPES}')
+
+    self.root_dirpath = root_dirpath
+    self.rel_dirpath = rel_dirpath
+    self.dtype = np.dtype(dtype)
+    self.max_shard_size_bytes = max_shard_size_bytes
+
+    self._shard_index = -1
+    self._shard_file = None
+    self._shard_length = 0
+
+    os.makedirs(os.path.join(self.root_dirpath, self.rel_dirpath), exist_ok=True)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, waveform):
+    """Appends `waveform` and returns the shard path relative to `root_dirpath`, offset and length of the waveform."""
+    samples = self._to_samples(waveform)
+
+    if self._shard_file is None or (
+          self._shard_length > 0
+          and (self._shard_length + len(samples)) * self.dtype.itemsize > self.max_shard_size_bytes):
+      self._start_shard()
+
+    offset = self._shard_length
+
+    self._shard_file.write(samples.tobytes())
+    self._shard_length += len(samples)
+
+    return self._get_shard_rel_filepath(self._shard_index), offset, len(samples)
+
+  def close(self):
+    if self._shard_file is not None:
+      self._shard_file.close()
+      self._shard_file = None
+
+  def _to_samples(self, waveform):
+    waveform = np.asarray(waveform, dtype=np.float32)
+
+    if self.dtype == np.int16:
+      return np.clip(np.round(waveform * INT16_SCALE), -INT16_SCALE, INT16_SCALE - 1).astype(np.int16)
+
+    return waveform
+
+  def _start_shard(self):
+    self.close()
+
+    self._shard_index += 1
+    self._shard_file = open(os.path.join(self.root_dirpath, self._get_shard_rel_filepath(self._shard_index)), 'wb')
+    self._shard_length = 0
+
+  def _get_shard_rel_filepath(self, shard_index):
+    return os.path.join(self.rel_dirpath, f'shard_{shard_index:05d}.{self.dtype.name}')
+
+
+def get_packed_audio_writer(root_dirpath, audio_format):
+  """Returns a `PackedAudioWriter` for the `audio_format` from `AUDIO_FORMATS`, or `None` for individual files."""
+  if audio_format not in AUDIO_FORMATS:
+    raise ValueError(f'Unsupported audio format "{audio_format}", expected one of {AUDIO_FORMATS}')
+
+  if audio_format == 'files':
+    return None
+
+  return PackedAudioWriter(root_dirpath, dtype=audio_format[len('packed-'):])
+
+
+def set_packed_audio_cols(df, locations):
+  """Sets columns locating waveforms in shards from `(shard_rel_filepath, offset, length)` tuples for each row."""
+  df[config.AUDIO_SHARD_COL] = [location[0] for location in locations]
+  df[config.AUDIO_OFFSET_COL] = pd.array([location[1] for location in locations], dtype='Int64')
+  df[config.AUDIO_LENGTH_COL] = pd.array([location[2] for location in locations], dtype='Int64')
+
+
+@functools.lru_cache(maxsize=None)
+def _open_shard(shard_filepath):
+  dtype = os.path.splitext(shard_filepath)[1][1:]
+
+  if dtype not in DTYPES:
+    raise ValueError(f'Unsupported shard file "{shard_filepath}", expected an extension from {DTYPES}')
+
+  return np.memmap(shard_filepath, dtype=dtype, mode='r')
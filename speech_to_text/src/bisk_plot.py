@@ -62,15 +62,34 @@ def plot_bars(
       custom_grid=False,
       bar_label_font_size='medium',
 ):
-  cols = _get_filtered_cols(df, affixes_to_match)
+  """Plots means and confidence intervals of bootstrapped metrics as bars grouped by `affixes_for_splitting`.
 
-  affixes_as_funcs = _get_affixes_as_funcs(affixes_for_splitting)
+  `df` contains either bootstrapped values of metrics as columns or a confidence interval summary obtained via
+  `bisk_metrics.get_confidence_interval_summary`, which contains precomputed values.
 
-  col_groups = _get_col_groups(cols, affixes_as_funcs)
+  For bootstrapped values, affixes are substrings of column names or functions taking a column name and returning
+  whether it matches. For a summary, affixes are dictionaries mapping columns from `bisk_metrics.SUMMARY_DIM_COLS`
+  to a value or a list of values to match, e.g. `{'metric': 'wer', 'language': 'sk'}` for `affixes_to_match`.
+  """
+  is_summary = bisk_metrics.is_confidence_interval_summary(df)
 
-  mean_per_col, lower_per_col, upper_per_col = bisk_metrics.get_confidence_interval_values_per_col(
-      df, col_groups, within_group_names, alpha=alpha,
-  )
+  if is_summary:
+    col_groups = _get_summary_name_groups(df, affixes_to_match, affixes_for_splitting)
+  else:
+    cols = _get_filtered_cols(df.columns, affixes_to_match)
+
+    affixes_as_funcs = _get_affixes_as_funcs(affixes_for_splitting)
+
+    col_groups = _get_col_groups(cols, affixes_as_funcs)
+
+  if is_summary:
+    mean_per_col, lower_per_col, upper_per_col = bisk_metrics.get_confidence_interval_values_per_col_from_summary(
+        df, col_groups, within_group_names, alpha=alpha,
+    )
+  else:
+    mean_per_col, lower_per_col, upper_per_col = bisk_metrics.get_confidence_interval_values_per_col(
+        df, col_groups, within_group_names, alpha=alpha,
+    )
 
   return _plot_bars(
       df, group_names, within_group_names, within_group_name_filter,
@@ -148,8 +167,8 @@ def _plot_bars(
   return fig, ax
 
 
-def _get_filtered_cols(df, affixes_to_match):
-  return [col for col in df.columns if all(affix in col for affix in affixes_to_match)]
+def _get_filtered_cols(cols, affixes_to_match):
+  return [col for col in cols if all(affix in col for affix in affixes_to_match)]
 
 
 def _get_col_groups(cols, affixes_as_funcs):
@@ -167,6 +186,32 @@ def _get_col_groups(cols, affixes_as_funcs):
   return col_groups
 
 
+def _get_summary_name_groups(summary, dims_to_match, dims_for_splitting):
+  summary = summary[_get_summary_mask(summary, dims_to_match)]
+
+  name_groups = []
+
+  for dims_per_group in itertools.product(*dims_for_splitting):
+    mask = np.ones(len(summary), dtype=bool)
+
+    for dims in dims_per_group:
+      mask &= _get_summary_mask(summary, dims)
+
+    # Names are repeated for each alpha in the summary.
+    name_groups.append(summary.loc[mask, 'name'].unique().tolist())
+
+  return name_groups
+
+
+def _get_summary_mask(summary, dims):
+  mask = np.ones(len(summary), dtype=bool)
+
+  for col, values in dims.items():
+    mask &= summary[col].isin(values if isinstance(values, (list, tuple, set)) else [values]).to_numpy()
+
+  return mask
+
+
 def _get_affixes_as_funcs(affixes_for_splitting):
   affixes_as_funcs = []
   for affix_group in affixes_for_splitting:
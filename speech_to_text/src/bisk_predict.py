@@ -1,52 +1,360 @@
+import functools
 import os
+import time
 
+import numpy as np
+import pandas as pd
 import tqdm
 
 import torch
-import torchaudio
 import transformers
+import whisper
 
 import bisk_audio
+import bisk_prefetch
 import bisk_preprocessing
+import config
 
 
-def predict_whisper(df, model, input_col, root_dirpath, language, raw_predicted_col, predicted_col):
-  df[raw_predicted_col] = df[input_col].progress_apply(
-    bisk_audio.transcribe_audio_whisper, args=(root_dirpath, model), language=language)
+# Decoding options distinguishing cached transcriptions obtained in different ways
+WHISPER_DECODING_OPTIONS = {'method': 'transcribe', 'whisper_version': whisper.__version__}
+WHISPER_BATCH_DECODING_OPTIONS = {'method': 'batch_greedy', 'whisper_version': whisper.__version__}
+META_MMS_DECODING_OPTIONS = {'method': 'ctc_greedy', 'transformers_version': transformers.__version__}
+
+THROUGHPUT_PERCENTILES = [50, 90, 95, 99]
+THROUGHPUT_SUMMARY_FILENAME_SUFFIX = '_throughput.parquet'
+
+
+def predict_whisper(
+      df, model, input_col, root_dirpath, language, raw_predicted_col, predicted_col, batch_size=None,
+      prefetch_kwargs=None, transcription_cache=None, model_id=None):
+  """Predicts transcriptions with Whisper, loading upcoming audio samples in the background.
+
+  `prefetch_kwargs` are passed to `bisk_prefetch.Prefetcher`. If `transcription_cache`
+  (a `bisk_transcription_cache.TranscriptionCache`) is specified, only audio samples without a cached transcription
+  for `model_id` and `language` are transcribed. Columns with timings of each row are added as described in
+  `get_timing_cols`. Returns prefetch statistics.
+  """
+  if batch_size is not None:
+    return predict_whisper_multiple_languages(
+      df, model, input_col, root_dirpath, [language], [raw_predicted_col], [predicted_col], batch_size=batch_size,
+      prefetch_kwargs=prefetch_kwargs, transcription_cache=transcription_cache, model_id=model_id)
+
+  audio_rel_filepaths = df[input_col].tolist()
+  audio_sources = bisk_audio.get_audio_sources(df, input_col, root_dirpath)
+
+  [keys], [raw_predictions] = _load_cached_transcriptions(
+    transcription_cache, audio_sources, model_id, [language], WHISPER_DECODING_OPTIONS)
+
+  uncached_indexes = [index for index, raw_prediction in enumerate(raw_predictions) if raw_prediction is None]
+
+  audio_load_times = np.full(len(df), np.nan)
+  inference_times = np.full(len(df), np.nan)
+
+  prefetcher = bisk_prefetch.Prefetcher(
+    functools.partial(_call_timed, bisk_audio.load_audio_whisper),
+    [audio_sources[index] for index in uncached_indexes],
+    **(prefetch_kwargs or {}),
+  )
+
+  for index, (audio, audio_load_time) in zip(uncached_indexes, tqdm.tqdm(prefetcher, total=len(uncached_indexes))):
+    start_time = time.perf_counter()
+
+    raw_predictions[index] = bisk_audio.transcribe_audio_whisper(
+      audio_rel_filepaths[index], root_dirpath, model, language=language, audio=audio)
+
+    inference_times[index] = time.perf_counter() - start_time
+    audio_load_times[index] = audio_load_time
+
+    if transcription_cache is not None:
+      transcription_cache.save(keys[index], raw_predictions[index])
+
+  df[raw_predicted_col] = raw_predictions
+
+  _set_timing_cols(df, predicted_col, audio_load_times, inference_times)
 
   df[predicted_col] = df[raw_predicted_col].apply(lambda x: x['text'])
 
   bisk_preprocessing.preprocess_transcriptions(df, predicted_col, predicted_col)
 
+  return prefetcher.get_statistics()
+
+
+def predict_whisper_multiple_languages(
+      df, model, input_col, root_dirpath, languages, raw_predicted_cols, predicted_cols, batch_size=1,
+      feature_cache=None, prefetch_kwargs=None, transcription_cache=None, model_id=None):
+  """Predicts transcriptions for each of the `languages` in a single pass over audio samples.
+
+  Samples are decoded in batches of `batch_size`, with audio features and encoder output computed only once
+  per sample and shared by all languages. Audio features are reused from `feature_cache` if specified.
+  Audio features of upcoming batches are computed in the background by `bisk_prefetch.Prefetcher` with
+  `prefetch_kwargs`. If `transcription_cache` is specified, only audio samples without a cached transcription
+  for `model_id` and any of the `languages` are transcribed.
+
+  Columns with timings of each row are added for each language as described in `get_timing_cols`, with the time
+  of loading audio features and of running the encoder, both shared by all languages, included for each language.
+
+  Returns prefetch statistics.
+  """
+  audio_sources = bisk_audio.get_audio_sources(df, input_col, root_dirpath)
+
+  keys_per_language, raw_predictions_per_language = _load_cached_transcriptions(
+    transcription_cache, audio_sources, model_id, languages, WHISPER_BATCH_DECODING_OPTIONS)
+
+  uncached_indexes = [
+    index for index in range(len(audio_sources))
+    if any(raw_predictions[index] is None for raw_predictions in raw_predictions_per_language)]
+
+  batches_indexes = [
+    uncached_indexes[start:start + batch_size] for start in range(0, len(uncached_indexes), batch_size)]
+  batches_audio_sources = [[audio_sources[index] for index in batch_indexes] for batch_indexes in batches_indexes]
+
+  audio_load_times = np.full(len(df), np.nan)
+  inference_times_per_language = [np.full(len(df), np.nan) for _ in languages]
+
+  prefetcher = bisk_prefetch.Prefetcher(
+    functools.partial(
+      _call_timed,
+      bisk_audio.load_whisper_log_mel_spectrograms,
+      n_mels=model.dims.n_mels,
+      feature_cache=feature_cache,
+    ),
+    batches_audio_sources,
+    **(prefetch_kwargs or {}),
+  )
+
+  with tqdm.tqdm(total=len(uncached_indexes)) as progress_bar:
+    for batch_indexes, batch_audio_sources, (batch_mels, batch_load_time) in zip(
+          batches_indexes, batches_audio_sources, prefetcher):
+      results_per_language, batch_inference_times_per_language = bisk_audio.transcribe_audio_whisper_batch(
+        batch_audio_sources, model, languages=languages, mels=batch_mels, return_inference_times=True)
+
+      audio_load_times[batch_indexes] = batch_load_time / len(batch_indexes)
+
+      for keys, raw_predictions, results, inference_times, batch_inference_times in zip(
+            keys_per_language, raw_predictions_per_language, results_per_language,
+            inference_times_per_language, batch_inference_times_per_language):
+        inference_times[batch_indexes] = batch_inference_times
+
+        for index, result in zip(batch_indexes, results):
+          raw_predictions[index] = result
+
+          if transcription_cache is not None:
+            transcription_cache.save(keys[index], result)
+
+      progress_bar.update(len(batch_indexes))
+
+  for raw_predictions, inference_times, raw_predicted_col, predicted_col in zip(
+        raw_predictions_per_language, inference_times_per_language, raw_predicted_cols, predicted_cols):
+    df[raw_predicted_col] = raw_predictions
+
+    _set_timing_cols(df, predicted_col, audio_load_times, inference_times)
+
+    df[predicted_col] = df[raw_predicted_col].apply(lambda x: x['text'])
+
+    bisk_preprocessing.preprocess_transcriptions(df, predicted_col, predicted_col)
+
+  return prefetcher.get_statistics()
+
+
+def predict_meta_mms(
+      df, model, input_col, root_dirpath, language, predicted_col, batch_size=1, prefetch_kwargs=None,
+      transcription_cache=None):
+  """Predicts transcriptions with a loaded `bisk_models.MetaMmsModel`, switching it to the adapter for `language`.
+
+  Audio samples are sorted by duration and grouped into batches of `batch_size` to minimize padding. Durations are
+  taken from the duration column of `df`, which is added via `bisk_audio.add_audio_duration_col` if missing.
+  Padded samples are masked via attention masks and logits of padded frames are ignored when decoding.
+  Upcoming batches are loaded in the background by `bisk_prefetch.Prefetcher` with `prefetch_kwargs`.
+  If `transcription_cache` is specified, only audio samples without a cached transcription are transcribed.
+  Columns with timings of each row are added as described in `get_timing_cols`.
+
+  Returns prefetch statistics.
+  """
+  audio_sources = bisk_audio.get_audio_sources(df, input_col, root_dirpath)
+
+  bisk_audio.add_audio_duration_col(df, input_col, root_dirpath)
+  audio_durations = df[config.AUDIO_DURATION_COL].to_numpy()
+
+  [keys], [transcriptions] = _load_cached_transcriptions(
+    transcription_cache, audio_sources, model.model_id, [language], META_MMS_DECODING_OPTIONS)
+
+  uncached_indexes = [index for index, transcription in enumerate(transcriptions) if transcription is None]
 
-def predict_meta_mms(df, input_col, root_dirpath, language, predicted_col):
-  model_id = 'facebook/mms-1b-fl102'
+  if uncached_indexes:
+    model.set_language(language)
 
-  processor = transformers.AutoProcessor.from_pretrained(model_id)
-  model = transformers.Wav2Vec2ForCTC.from_pretrained(model_id)
+  batches_indexes = [
+    [uncached_indexes[index] for index in batch_indexes]
+    for batch_indexes in _get_batches_sorted_by_audio_duration(audio_durations[uncached_indexes], batch_size)]
 
-  if language is not None:
-    processor.tokenizer.set_target_lang(language)
-    model.load_adapter(language)
+  audio_load_times = np.full(len(df), np.nan)
+  inference_times = np.full(len(df), np.nan)
 
-  # Send model to GPU
-  model.to('cuda:0')
+  prefetcher = bisk_prefetch.Prefetcher(
+    functools.partial(_call_timed, bisk_audio.load_audio_files),
+    [[audio_sources[index] for index in batch_indexes] for batch_indexes in batches_indexes],
+    **(prefetch_kwargs or {}),
+  )
 
-  transcriptions = []
+  with tqdm.tqdm(total=len(uncached_indexes)) as progress_bar:
+    for batch_indexes, (audio_data, batch_load_time) in zip(batches_indexes, prefetcher):
+      start_time = time.perf_counter()
+      batch_transcriptions = _transcribe_audio_meta_mms_batch(audio_data, model)
 
-  for rel_path in tqdm.tqdm(df[input_col]):
-    audio_data = torchaudio.load(os.path.join(root_dirpath, rel_path))[0][0]
+      inference_times[batch_indexes] = (time.perf_counter() - start_time) / len(batch_indexes)
+      audio_load_times[batch_indexes] = batch_load_time / len(batch_indexes)
 
-    inputs = processor(audio_data, sampling_rate=16_000, return_tensors='pt')
-    # Send data to GPU
-    inputs.to('cuda:0')
+      for index, transcription in zip(batch_indexes, batch_transcriptions):
+        transcriptions[index] = transcription
 
-    with torch.no_grad():
-      outputs = model(**inputs).logits
+        if transcription_cache is not None:
+          transcription_cache.save(keys[index], transcription)
 
-    ids = torch.argmax(outputs, dim=-1)[0]
-    transcriptions.append(processor.decode(ids))
+      progress_bar.update(len(batch_indexes))
 
   df[predicted_col] = transcriptions
 
+  _set_timing_cols(df, predicted_col, audio_load_times, inference_times)
+
   bisk_preprocessing.preprocess_transcriptions(df, predicted_col, predicted_col)
+
+  return prefetcher.get_statistics()
+
+
+def get_timing_cols(predicted_col):
+  """Returns names of columns with the audio load time, inference time and real-time factor of `predicted_col`.
+
+  Times are in seconds per row, with times of a batch split equally among its rows. The real-time factor is
+  the inference time divided by the audio duration. Timings are missing for transcriptions loaded from a cache.
+  """
+  predicted_col_root = predicted_col[len(config.PREDICTED_COL_PREFIX):]
+
+  return [
+    f'{config.AUDIO_LOAD_TIME_PREFIX}{predicted_col_root}',
+    f'{config.INFERENCE_TIME_PREFIX}{predicted_col_root}',
+    f'{config.REAL_TIME_FACTOR_PREFIX}{predicted_col_root}',
+  ]
+
+
+def get_throughput_summary(df, predicted_cols, percentiles=THROUGHPUT_PERCENTILES):
+  """Returns a table of throughput of each of `predicted_cols` with timing columns from `get_timing_cols`.
+
+  Each row contains the model and the language setting parsed from the column name, the number of timed rows,
+  total times, rows and audio seconds transcribed per second of inference, and `percentiles` of the inference time
+  and the real-time factor per row. Rows without timings, whose transcriptions were loaded from a cache, are left out
+  and only counted as `n_cached_rows`.
+  """
+  summary = []
+
+  for predicted_col in predicted_cols:
+    audio_load_time_col, inference_time_col, real_time_factor_col = get_timing_cols(predicted_col)
+    model_name, _, language_name = predicted_col[len(config.PREDICTED_COL_PREFIX):].rpartition('_lang-')
+
+    df_timed = df[df[inference_time_col].notna()]
+
+    audio_duration = df_timed[config.AUDIO_DURATION_COL].sum()
+    inference_time = df_timed[inference_time_col].sum()
+
+    row = {
+      'model': model_name,
+      'language': language_name,
+      'n_rows': len(df_timed),
+      'n_cached_rows': len(df) - len(df_timed),
+      'audio_duration': audio_duration,
+      'audio_load_time': df_timed[audio_load_time_col].sum(),
+      'inference_time': inference_time,
+      'rows_per_second': len(df_timed) / inference_time if inference_time > 0 else np.nan,
+      'audio_seconds_per_second': audio_duration / inference_time if inference_time > 0 else np.nan,
+    }
+
+    for col, name in [(inference_time_col, 'inference_time'), (real_time_factor_col, 'real_time_factor')]:
+      values = np.percentile(df_timed[col], percentiles) if len(df_timed) else [np.nan] * len(percentiles)
+      row.update({f'{name}_p{percentile}': value for percentile, value in zip(percentiles, values)})
+
+    summary.append(row)
+
+  return pd.DataFrame(summary)
+
+
+def save_throughput_summary(predictions_filepath, predicted_cols, percentiles=THROUGHPUT_PERCENTILES):
+  """Saves the throughput summary of `predicted_cols` in a Parquet file of predictions next to the file.
+
+  Only the audio duration and timing columns are loaded. Returns the summary.
+  """
+  timing_cols = [col for predicted_col in predicted_cols for col in get_timing_cols(predicted_col)]
+  df = pd.read_parquet(predictions_filepath, columns=[config.AUDIO_DURATION_COL] + timing_cols)
+
+  summary = get_throughput_summary(df, predicted_cols, percentiles=percentiles)
+  summary.to_parquet(f'{os.path.splitext(predictions_filepath)[0]}{THROUGHPUT_SUMMARY_FILENAME_SUFFIX}')
+
+  return summary
+
+
+def print_throughput_summary(summary):
+  for row in summary.to_dict('records'):
+    real_time_factor_percentiles = ', '.join(
+      f'{name[len("real_time_factor_"):]} {value:.3f}' for name, value in row.items()
+      if name.startswith('real_time_factor_p'))
+
+    print(
+      f'Throughput of {row["model"]} with language "{row["language"]}": {row["n_rows"]} timed rows'
+      f' ({row["n_cached_rows"]} cached rows left out), {row["rows_per_second"]:.2f} rows/s,'
+      f' {row["audio_seconds_per_second"]:.2f} audio s/s, real-time factor {real_time_factor_percentiles}')
+
+
+def _call_timed(func, *args, **kwargs):
+  start_time = time.perf_counter()
+  result = func(*args, **kwargs)
+  return result, time.perf_counter() - start_time
+
+
+def _set_timing_cols(df, predicted_col, audio_load_times, inference_times):
+  audio_load_time_col, inference_time_col, real_time_factor_col = get_timing_cols(predicted_col)
+
+  df[audio_load_time_col] = audio_load_times
+  df[inference_time_col] = inference_times
+  df[real_time_factor_col] = inference_times / df[config.AUDIO_DURATION_COL].to_numpy(dtype=float)
+
+
+def _load_cached_transcriptions(transcription_cache, audio_sources, model_id, languages, decoding_options):
+  if transcription_cache is None:
+    return [None] * len(languages), [[None] * len(audio_sources) for _ in languages]
+
+  keys_per_language = []
+  transcriptions_per_language = []
+
+  for language in languages:
+    keys = [
+      transcription_cache.get_key(audio_source, model_id, language, decoding_options=decoding_options)
+      for audio_source in audio_sources]
+
+    keys_per_language.append(keys)
+    transcriptions_per_language.append([transcription_cache.load(key) for key in keys])
+
+  return keys_per_language, transcriptions_per_language
+
+
+def _transcribe_audio_meta_mms_batch(audio_data, model):
+  inputs = model.processor(
+    audio_data,
+    sampling_rate=config.PROCESSED_SAMPLING_RATE,
+    padding=True,
+    return_attention_mask=True,
+    return_tensors='pt',
+  )
+  inputs = inputs.to(model.device)
+
+  with torch.no_grad():
+    logits = model.model(**inputs).logits
+
+  ids = torch.argmax(logits, dim=-1).cpu()
+  n_frames = model.model._get_feat_extract_output_lengths(inputs['attention_mask'].sum(dim=-1)).cpu()
+
+  return model.processor.batch_decode([ids_for_sample[:n] for ids_for_sample, n in zip(ids, n_frames.tolist())])
+
+
+def _get_batches_sorted_by_audio_duration(audio_durations, batch_size):
+  sorted_indexes = sorted(range(len(audio_durations)), key=lambda index: audio_durations[index])
+
+  return [sorted_indexes[start:start + batch_size] for start in range(0, len(sorted_indexes), batch_size)]
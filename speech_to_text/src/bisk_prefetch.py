@@ -0,0 +1,108 @@
+import collections
+import concurrent.futures
+import itertools
+import time
+
+
+class Prefetcher:
+  """Iterates over results of `load_func` applied to each of `items`, loading upcoming items in the background.
+
+  Items are loaded by a pool of `n_workers` threads (or processes if `use_processes` is `True`, requiring `load_func`
+  to be picklable), keeping at most `max_queue_size` items loaded or being loaded ahead of the consumer.
+  If `n_workers` is 0, items are loaded synchronously once requested.
+
+  Statistics are collected while iterating: the stall time is the time the consumer waited for an item to be loaded
+  and the queue depth is the number of items already loaded when the consumer requested the next item.
+  """
+
+  def __init__(self, load_func, items, n_workers=2, max_queue_size=4, use_processes=False):
+    self.load_func = load_func
+    self.items = items
+    self.n_workers = n_workers
+    self.max_queue_size = max(max_queue_size, 1)
+    self.use_processes = use_processes
+
+    self.n_loaded_items = 0
+    self.n_stalls = 0
+    self.stall_time = 0.0
+    self.queue_depths = []
+
+  def __iter__(self):
+    if self.n_workers == 0:
+      yield from self._iterate_synchronously()
+      return
+
+    executor_class = (
+      concurrent.futures.ProcessPoolExecutor if self.use_processes else concurrent.futures.ThreadPoolExecutor)
+    executor = executor_class(max_workers=self.n_workers)
+
+    try:
+      items = iter(self.items)
+      futures = collections.deque(
+        executor.submit(self.load_func, item) for item in itertools.islice(items, self.max_queue_size))
+
+      while futures:
+        self.queue_depths.append(sum(future.done() for future in futures))
+
+        future = futures.popleft()
+
+        for item in itertools.islice(items, 1):
+          futures.append(executor.submit(self.load_func, item))
+
+        if future.done():
+          result = future.result()
+        else:
+          start_time = time.perf_counter()
+          result = future.result()
+          self.stall_time += time.perf_counter() - start_time
+          self.n_stalls += 1
+
+        self.n_loaded_items += 1
+
+        yield result
+    finally:
+      executor.shutdown(wait=True, cancel_futures=True)
+
+  def get_statistics(self):
+    return {
+      'n_items': self.n_loaded_items,
+      'n_stalls': self.n_stalls,
+      'stall_time': self.stall_time,
+      'mean_queue_depth': sum(self.queue_depths) / len(self.queue_depths) if self.queue_depths else float('nan'),
+      'min_queue_depth': min(self.queue_depths, default=0),
+    }
+
+  def _iterate_synchronously(self):
+    for item in self.items:
+      self.queue_depths.append(0)
+
+      start_time = time.perf_counter()
+      result = self.load_func(item)
+      self.stall_time += time.perf_counter() - start_time
+      self.n_stalls += 1
+
+      self.n_loaded_items += 1
+
+      yield result
+
+
+def combine_statistics(statistics_list):
+  """Combines statistics of multiple `Prefetcher` instances."""
+  n_items = sum(statistics['n_items'] for statistics in statistics_list)
+
+  return {
+    'n_items': n_items,
+    'n_stalls': sum(statistics['n_stalls'] for statistics in statistics_list),
+    'stall_time': sum(statistics['stall_time'] for statistics in statistics_list),
+    'mean_queue_depth': (
+      sum(statistics['mean_queue_depth'] * statistics['n_items'] for statistics in statistics_list) / n_items
+      if n_items else float('nan')),
+    'min_queue_depth': min((statistics['min_queue_depth'] for statistics in statistics_list), default=0),
+  }
+
+
+def print_statistics(statistics):
+  print(
+    f'Audio prefetch: {statistics["n_items"]} items, stalled {statistics["n_stalls"]} times'
+    f' for {statistics["stall_time"]:.1f} s in total, mean queue depth {statistics["mean_queue_depth"]:.2f}'
+    f' (minimum {statistics["min_queue_depth"]})')
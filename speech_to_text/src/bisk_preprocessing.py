@@ -1,12 +1,92 @@
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
 import config
 
 
+# Characters replaced with a space by `remove_unwanted_characters` and `remove_punctuation_including_periods`
+UNWANTED_CHARACTERS = '"“”„‟‘’‚‛\';'
+PUNCTUATION_INCLUDING_PERIODS = ',;:?!"\'`.'
+
+_REPLACED_CHARACTERS = tuple(dict.fromkeys(UNWANTED_CHARACTERS + PUNCTUATION_INCLUDING_PERIODS))
+
+
 def preprocess_transcriptions(df, source_col, dest_col):
-  df[dest_col] = df[source_col].str.lower()
-  df[dest_col] = remove_unwanted_characters(df[dest_col])
-  df[dest_col] = remove_punctuation_including_periods(df[dest_col])
-  df[dest_col] = remove_extra_space(df[dest_col])
-  df[dest_col] = df[dest_col].str.strip()
+  df[dest_col] = normalize_transcriptions(df[source_col])
+
+
+def normalize_transcriptions(sentences):
+  """Lowercases sentences, replaces unwanted characters and punctuation including periods with spaces, collapses
+  whitespace into single spaces and strips leading and trailing whitespace.
+
+  Produces the same output as the `str` accessor methods `lower` and `strip` with `remove_unwanted_characters`,
+  `remove_punctuation_including_periods` and `remove_extra_space` applied in turn to `sentences`, but in a single
+  pass over `sentences`. Arrow-backed strings are normalized with the same Arrow compute functions as used by
+  the `str` accessor for them, which differ from Python strings for some characters, e.g. `'İ'` and `'Σ'` are
+  lowercased to a single character regardless of context, and only ASCII whitespace is collapsed.
+  """
+  if _is_arrow_string_dtype(sentences.dtype):
+    return pd.Series(
+      pd.array(_normalize_transcriptions_arrow(pa.array(sentences)), dtype=sentences.dtype),
+      index=sentences.index,
+      name=sentences.name,
+    )
+
+  # Values are collected with the object dtype first, so that missing values are kept as they are.
+  normalized_sentences = pd.Series(
+    [_normalize_transcription_value(value) for value in sentences],
+    index=sentences.index,
+    name=sentences.name,
+    dtype=object,
+  )
+
+  if normalized_sentences.dtype != sentences.dtype:
+    normalized_sentences = normalized_sentences.astype(sentences.dtype)
+
+  return normalized_sentences
+
+
+def normalize_transcription(sentence):
+  sentence = sentence.lower()
+
+  # Replacing characters one by one is faster than `str.translate`, which is slow for non-ASCII strings.
+  for character in _REPLACED_CHARACTERS:
+    if character in sentence:
+      sentence = sentence.replace(character, ' ')
+
+  return ' '.join(sentence.split())
+
+
+def _normalize_transcription_value(value):
+  if isinstance(value, str):
+    return normalize_transcription(value)
+
+  # Missing values are kept and other values are converted to missing values as by the `str` accessor of pandas.
+  return value if pd.api.types.is_scalar(value) and pd.isna(value) else np.nan
+
+
+def _is_arrow_string_dtype(dtype):
+  if isinstance(dtype, pd.ArrowDtype):
+    return pa.types.is_string(dtype.pyarrow_dtype) or pa.types.is_large_string(dtype.pyarrow_dtype)
+
+  return isinstance(dtype, pd.StringDtype) and dtype.storage == 'pyarrow'
+
+
+def _normalize_transcriptions_arrow(sentences):
+  normalized_sentences = pc.utf8_lower(sentences)
+  # Each replaced character becomes a space and runs of spaces and whitespace collapse into a single space, hence runs
+  # of both are replaced at once. `\s` matches ASCII whitespace only in RE2 regular expressions used by Arrow.
+  normalized_sentences = pc.replace_substring_regex(
+    normalized_sentences, f'[{_get_regex_character_class(_REPLACED_CHARACTERS)}\\s]+', ' ')
+
+  return pc.utf8_trim_whitespace(normalized_sentences)
+
+
+def _get_regex_character_class(characters):
+  return ''.join(f'\\x{{{ord(character):x}}}' for character in characters)
 
 
 def remove_unwanted_characters(sentences):
@@ -26,24 +106,23 @@ def remove_extra_space(sentences):
 
 
 def add_has_sentence_male_and_female_gender(df, transcription_col, gender_col):
-  def has_sentence_male_and_female_gender(rows):
-    return len(rows['gender'].value_counts()) > 1
-
-  new_col_name = config.HAS_SENTENCE_MALE_AND_FEMALE_GENDER_COL
+  return add_has_sentence_multiple_attribute_values(
+    df, transcription_col, gender_col, ['female', 'male'], config.HAS_SENTENCE_MALE_AND_FEMALE_GENDER_COL)
 
-  df_processed = df[df[gender_col].isin(['female', 'male'])]
-  df_processed = df_processed[df_processed[transcription_col].duplicated(keep=False)]
 
-  df_has_sentence_male_and_female_gender = df_processed.groupby(
-    transcription_col, sort=False).apply(has_sentence_male_and_female_gender)
-  df_has_sentence_male_and_female_gender.name = new_col_name
-  df_has_sentence_male_and_female_gender = df_has_sentence_male_and_female_gender.reset_index()
+def add_has_sentence_multiple_attribute_values(
+      df, transcription_col, attribute_col, attribute_values, new_col_name, min_n_attribute_values=2):
+  """Returns a copy of `df` with a column indicating whether the sentence in each row is recorded with at least
+  `min_n_attribute_values` distinct values of `attribute_col` from `attribute_values`, e.g. by both male and female
+  speakers.
 
-  df_merged = df.merge(df_has_sentence_male_and_female_gender, on=transcription_col, how='left')
+  The number of distinct values is counted per sentence and broadcast to its rows in a single pass over `df`.
+  """
+  values = df[attribute_col].where(df[attribute_col].isin(attribute_values))
 
-  df_merged[new_col_name] = df_merged[new_col_name].fillna(False)
+  n_values_per_sentence = values.groupby(df[transcription_col], sort=False).transform('nunique')
 
-  return df_merged
+  return df.assign(**{new_col_name: (n_values_per_sentence >= min_n_attribute_values).to_numpy()})
 
 
 def get_word_count(df, transcription_col):
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+import config
+
+
+AGE_GROUP_SUFFIX_PREFIX = '__age_'
+TEST_SET_SUFFIX = '__test_set'
+
+
+def get_scenarios(df, include_test_set_only_scenarios=True):
+  """Returns scenarios, i.e. subsets of rows for which metrics are computed.
+
+  Each scenario is a dictionary containing a message to display, a suffix of metric names and a boolean mask
+  selecting rows of `df`. Scenarios only refer to rows of `df` and do not hold copies of the data.
+  """
+  male_and_female_cond = df[config.GENDER_COL].isin(['male', 'female']).to_numpy()
+  male_cond = (df[config.GENDER_COL] == 'male').to_numpy()
+  female_cond = (df[config.GENDER_COL] == 'female').to_numpy()
+  recorded_by_male_and_female_cond = df[config.HAS_SENTENCE_MALE_AND_FEMALE_GENDER_COL].to_numpy(dtype=bool)
+
+  scenarios = [
+    {
+      'message': 'Computing metrics for all genders',
+      'mask': np.ones(len(df), dtype=bool),
+      'suffix': '_all_genders',
+    },
+    {
+      'message': 'Computing metrics for male and female gender',
+      'mask': male_and_female_cond,
+      'suffix': '_male_and_female',
+    },
+    {
+      'message': 'Computing metrics for male gender only',
+      'mask': male_cond,
+      'suffix': '_male_only',
+    },
+    {
+      'message': 'Computing metrics for female gender only',
+      'mask': female_cond,
+      'suffix': '_female_only',
+    },
+    {
+      'message': 'Computing metrics for transcriptions recorded by both male and female gender',
+      'mask': recorded_by_male_and_female_cond & male_and_female_cond,
+      'suffix': '_recorded_by_male_and_female__male_and_female',
+    },
+    {
+      'message': 'Computing metrics for transcriptions recorded by both male and female gender, male gender only',
+      'mask': recorded_by_male_and_female_cond & male_cond,
+      'suffix': '_recorded_by_male_and_female__male_only',
+    },
+    {
+      'message': 'Computing metrics for transcriptions recorded by both male and female gender, female gender only',
+      'mask': recorded_by_male_and_female_cond & female_cond,
+      'suffix': '_recorded_by_male_and_female__female_only',
+    },
+  ]
+
+  if male_and_female_cond.all():
+    # We would obtain the same results
+    del scenarios[0]
+
+  if config.AGE_GROUP_COL in df.columns:
+    age_groups = [item for item in df[config.AGE_GROUP_COL].unique() if not pd.isnull(item)]
+
+    scenarios.extend(expand_scenarios(
+      scenarios,
+      {
+        (f', age group "{age_group}"', f'{AGE_GROUP_SUFFIX_PREFIX}{age_group}'): (
+          df[config.AGE_GROUP_COL] == age_group).to_numpy()
+        for age_group in age_groups
+      },
+    ))
+
+  if include_test_set_only_scenarios and config.SUBSET_COL in df.columns:
+    scenarios.extend(expand_scenarios(
+      scenarios,
+      {(', test set only', TEST_SET_SUFFIX): (df[config.SUBSET_COL] == config.TEST_SET).to_numpy()},
+    ))
+
+  return scenarios
+
+
+def expand_scenarios(scenarios, masks):
+  """Returns a new scenario for each combination of an existing scenario and a mask.
+
+  `masks` maps pairs of message and suffix affixes to boolean masks over the same rows as the scenarios.
+  """
+  new_scenarios = []
+
+  for scenario in scenarios:
+    for (message_affix, suffix_affix), mask in masks.items():
+      new_scenarios.append({
+        'message': scenario['message'] + message_affix,
+        'mask': scenario['mask'] & mask,
+        'suffix': scenario['suffix'] + suffix_affix,
+      })
+
+  return new_scenarios
+
+
+def parse_suffix(suffix):
+  """Splits a scenario suffix into the gender scenario, the age group and the subset.
+
+  The age group and the subset are `'all'` for scenarios not restricted to an age group or the test set.
+  """
+  subset = 'all'
+  if suffix.endswith(TEST_SET_SUFFIX):
+    suffix = suffix[:-len(TEST_SET_SUFFIX)]
+    subset = config.TEST_SET
+
+  age_group = 'all'
+  if AGE_GROUP_SUFFIX_PREFIX in suffix:
+    suffix, age_group = suffix.split(AGE_GROUP_SUFFIX_PREFIX, 1)
+
+  return suffix.lstrip('_'), age_group, subset
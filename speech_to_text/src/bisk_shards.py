@@ -0,0 +1,97 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+SHARD_SIZE = 1000
+
+
+def predict_in_shards(df, predict_func, predicted_cols, dirpath, shard_size=SHARD_SIZE):
+  """Calls `predict_func` on consecutive ranges of `shard_size` rows of `df` and saves the columns it predicts.
+
+  `predicted_cols` set by `predict_func` in a copy of the rows are saved as a Parquet file per row range in `dirpath`,
+  so that only the rows being predicted are held in memory. Row ranges whose file already exists are skipped, which
+  allows resuming an interrupted prediction. Files should be removed if `df` or `shard_size` changes.
+
+  Returns a list of values returned by `predict_func` for row ranges that were not skipped and the number of rows
+  in these ranges.
+  """
+  os.makedirs(dirpath, exist_ok=True)
+
+  results = []
+  n_predicted_rows = 0
+  n_skipped_rows = 0
+
+  for start in range(0, len(df), shard_size):
+    end = min(start + shard_size, len(df))
+    filepath = get_shard_filepath(dirpath, start, end)
+
+    if os.path.exists(filepath):
+      n_skipped_rows += end - start
+      continue
+
+    df_shard = df.iloc[start:end].copy()
+
+    results.append(predict_func(df_shard))
+    n_predicted_rows += end - start
+
+    _write_table(pa.Table.from_pandas(df_shard[predicted_cols], preserve_index=False), filepath)
+
+  if n_skipped_rows:
+    print(f'Skipped {n_skipped_rows} rows with existing predictions in {dirpath}')
+
+  return results, n_predicted_rows
+
+
+def merge_shards(df, dirpaths, output_filepath, shard_size=SHARD_SIZE):
+  """Writes `df` along with predicted columns saved by `predict_in_shards` in each of `dirpaths` to a Parquet file.
+
+  Row ranges are written one at a time, so that predictions are never loaded in memory all at once.
+  Columns of `df` with the same name as predicted columns are replaced.
+  """
+  row_ranges = [(start, min(start + shard_size, len(df))) for start in range(0, len(df), shard_size)]
+  filepaths_per_range = [
+    [get_shard_filepath(dirpath, start, end) for dirpath in dirpaths] for start, end in row_ranges]
+
+  predicted_cols = [
+    col for filepaths in filepaths_per_range[:1] for filepath in filepaths for col in pq.read_schema(filepath).names]
+
+  input_table = pa.Table.from_pandas(df.drop(columns=predicted_cols, errors='ignore'))
+
+  # Types of predicted columns may differ between shards, e.g. empty lists are stored with a null type.
+  schema = pa.unify_schemas(
+    [input_table.schema]
+    + [pq.read_schema(filepath).remove_metadata() for filepaths in filepaths_per_range for filepath in filepaths])
+
+  temp_output_filepath = f'{output_filepath}.tmp'
+
+  with pq.ParquetWriter(temp_output_filepath, schema) as writer:
+    for (start, end), filepaths in zip(row_ranges, filepaths_per_range):
+      table = input_table.slice(start, end - start)
+
+      for filepath in filepaths:
+        shard_table = pq.read_table(filepath)
+
+        if shard_table.num_rows != end - start:
+          raise ValueError(
+            f'{filepath} contains {shard_table.num_rows} rows instead of {end - start},'
+            f' remove predictions saved for a different input')
+
+        for field, column in zip(shard_table.schema, shard_table.columns):
+          table = table.append_column(field, column)
+
+      writer.write_table(table.cast(schema))
+
+  os.replace(temp_output_filepath, output_filepath)
+
+
+def get_shard_filepath(dirpath, start, end):
+  return os.path.join(dirpath, f'rows_{start:09d}-{end:09d}.parquet')
+
+
+def _write_table(table, filepath):
+  temp_filepath = f'{filepath}.tmp'
+
+  pq.write_table(table, temp_filepath)
+  os.replace(temp_filepath, filepath)
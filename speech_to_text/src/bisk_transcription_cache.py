@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+import bisk_feature_cache
+import bisk_packed_audio
+
+
+class TranscriptionCache:
+  """Persistent cache of transcriptions stored in a SQLite database.
+
+  Transcriptions are keyed by a hash of the audio file content, the model ID, the language and decoding options, so
+  that audio files whose content is unchanged are not transcribed again even if moved or renamed. Values must be
+  serializable to JSON.
+
+  Hashes of audio files are also stored along with file size and modification time, so that unchanged files are not
+  read again to compute the hash.
+  """
+
+  def __init__(self, filepath):
+    self.filepath = filepath
+
+    self.hits = 0
+    self.misses = 0
+
+    dirpath = os.path.dirname(self.filepath)
+    if dirpath:
+      os.makedirs(dirpath, exist_ok=True)
+
+    self._connection = sqlite3.connect(self.filepath)
+
+    with self._connection:
+      self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS transcriptions (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+      self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS file_hashes'
+        ' (filepath TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)')
+
+  def get_key(self, audio_source, model_id, language, decoding_options=None):
+    if isinstance(audio_source, bisk_packed_audio.PackedAudioClip):
+      audio_hash = audio_source.get_hash()
+    else:
+      audio_hash = self.get_file_hash(audio_source)
+
+    return hashlib.sha256(
+      json.dumps([audio_hash, model_id, language, decoding_options], sort_keys=True).encode('utf-8'),
+    ).hexdigest()
+
+  def get_file_hash(self, filepath):
+    filepath = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+
+    row = self._connection.execute(
+      'SELECT hash FROM file_hashes WHERE filepath = ? AND size = ? AND mtime_ns = ?',
+      (filepath, stat.st_size, stat.st_mtime_ns),
+    ).fetchone()
+
+    if row is not None:
+      return row[0]
+
+    file_hash = bisk_feature_cache.get_file_hash(filepath)
+
+    with self._connection:
+      self._connection.execute(
+        'INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+        (filepath, stat.st_size, stat.st_mtime_ns, file_hash))
+
+    return file_hash
+
+  def load(self, key):
+    row = self._connection.execute('SELECT value FROM transcriptions WHERE key = ?', (key,)).fetchone()
+
+    if row is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+
+    return json.loads(row[0])
+
+  def save(self, key, value):
+    with self._connection:
+      self._connection.execute(
+        'INSERT OR REPLACE INTO transcriptions VALUES (?, ?)', (key, json.dumps(value, default=_to_json)))
+
+  def get_statistics(self):
+    n_lookups = self.hits + self.misses
+
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / n_lookups if n_lookups else float('nan'),
+    }
+
+  def close(self):
+    self._connection.close()
+
+
+def print_statistics(transcription_cache):
+  statistics = transcription_cache.get_statistics()
+
+  print(
+    f'Transcription cache: {statistics["hits"]} hits, {statistics["misses"]} misses'
+    f' (hit rate {statistics["hit_rate"]:.1%})')
+
+
+def _to_json(value):
+  if isinstance(value, (np.generic, np.ndarray)):
+    return value.tolist()
+
+  raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -1,17 +1,25 @@
-import copy
 import logging
 import os
 import sys
-from typing import Optional
+from typing import Optional, Tuple
 
 import pandas as pd
 
 import click
 
+import bisk_instrumentation
 import bisk_metrics
+import bisk_scenarios
 import config
 
 
+CACHE_DIRNAME = 'cache'
+RUN_REPORT_FILENAME = 'run_report.json'
+METRICS_SUMMARY_FILENAME = 'metrics_summary.parquet'
+N_REPETITIONS_FILENAME = 'n_repetitions.parquet'
+N_REPETITIONS_KEY_COLS = ['scenario', 'predicted_col']
+
+
 @click.command()
 @click.option('-p', '--predictions-path',
               help='file path containing predictions and pre-computed error rates',
@@ -23,155 +31,210 @@ import config
               help='number of times the predictions are resampled during bootstrapping',
               required=False,
               default=1000)
+@click.option('-t', '--tolerance',
+              help=('if specified, stop bootstrapping metrics of each scenario and predicted column once bounds of'
+                    ' confidence intervals change by less than this value after adding a block of repetitions;'
+                    ' the number of repetitions then becomes the maximum number of repetitions'),
+              required=False,
+              type=float,
+              default=None)
 @click.option('-r', '--random-state',
               help='fixed random state to use for bootstrapping; omit if you do not want to use fixed random state',
               required=False,
+              type=int,
               default=None)
 @click.option('-j', '--n-jobs',
-              help='number of parallel jobs to run when computing each metric individually',
+              help=('number of parallel processes computing metrics;'
+                    ' jobs are split by scenario, predicted column and chunk of repetitions'),
               required=False,
               default=1)
+@click.option('--n-repetitions-per-job',
+              help='number of bootstrap repetitions computed by a single job',
+              required=False,
+              default=bisk_metrics.BOOTSTRAP_JOB_SIZE)
 @click.option('-s', '--save-indexes',
-              help='if specified, save indexes of samples during bootstrapping for each repetition',
+              help=('if specified, save indexes of samples during bootstrapping for each repetition,'
+                    ' once per scenario as they are shared by all predicted columns'),
               is_flag=True,
               required=False,
               default=False)
+@click.option('--reuse-computed-metrics/--recompute-metrics',
+              help=('if specified along with a fixed random state, skip metrics of scenarios and predicted columns'
+                    ' whose inputs did not change since a previous run into the same output directory, and merge'
+                    ' the results into the existing metrics; all metrics are recomputed without a fixed random state'),
+              required=False,
+              default=True)
 @click.option('--include-test-set-only-scenarios/--do-not-include-test-set-only-scenarios',
               help='if specified, also compute metrics for the test set if a column indicating subsets exists in the data',
               required=False,
               default=True)
+@click.option('-a', '--alpha',
+              help=('confidence level of confidence intervals in the summary of metrics;'
+                    ' repeat to summarize metrics for multiple confidence levels'),
+              required=False,
+              type=float,
+              multiple=True,
+              default=[0.95])
+@click.option('--profile',
+              help='if specified, profile the run with cProfile and save statistics next to the run report',
+              is_flag=True,
+              default=False)
+@click.option('--trace-memory',
+              help='if specified, trace memory allocated by Python with tracemalloc and report its peak for each stage',
+              is_flag=True,
+              default=False)
 def main(
       predictions_path: str,
       output_dirpath: str,
       n_repetitions: int,
+      tolerance: Optional[float],
       random_state: Optional[int],
       n_jobs: int,
+      n_repetitions_per_job: int,
       save_indexes: bool,
+      reuse_computed_metrics: bool,
       include_test_set_only_scenarios: bool,
+      alpha: Tuple[float],
+      profile: bool,
+      trace_memory: bool,
 ):
-  logger = logging.getLogger(__file__)
-  logging.basicConfig(format='%(asctime)s %(message)s')
-  logger.addHandler(logging.StreamHandler())
-  logger.setLevel('INFO')
-
-  df = pd.read_parquet(predictions_path)
-
-  if config.GENDER_COL not in df.columns:
-    logger.error(f'Column "{config.GENDER_COL}" not found in the dataset')
-    sys.exit(1)
-
-  _precompute_metrics_in_preparation_for_macro_average(df)
-
-  male_and_female_cond = df[config.GENDER_COL].isin(['male', 'female'])
-  male_cond = df[config.GENDER_COL] == 'male'
-  female_cond = df[config.GENDER_COL] == 'female'
-  recorded_by_male_and_female_cond = df[config.HAS_SENTENCE_MALE_AND_FEMALE_GENDER_COL]
-
-  scenarios = [
-    {
-      'message': 'Computing metrics for all genders',
-      'df': df,
-      'suffix': '_all_genders',
-    },
-    {
-      'message': 'Computing metrics for male and female gender',
-      'df': df[male_and_female_cond],
-      'suffix': '_male_and_female',
-    },
-    {
-      'message': 'Computing metrics for male gender only',
-      'df': df[male_cond],
-      'suffix': '_male_only',
-    },
-    {
-      'message': 'Computing metrics for female gender only',
-      'df': df[female_cond],
-      'suffix': '_female_only',
-    },
-    {
-      'message': 'Computing metrics for transcriptions recorded by both male and female gender',
-      'df': df[recorded_by_male_and_female_cond & male_and_female_cond],
-      'suffix': '_recorded_by_male_and_female__male_and_female',
-    },
-    {
-      'message': 'Computing metrics for transcriptions recorded by both male and female gender, male gender only',
-      'df': df[recorded_by_male_and_female_cond & male_cond],
-      'suffix': '_recorded_by_male_and_female__male_only',
-    },
-    {
-      'message': 'Computing metrics for transcriptions recorded by both male and female gender, female gender only',
-      'df': df[recorded_by_male_and_female_cond & female_cond],
-      'suffix': '_recorded_by_male_and_female__female_only',
-    },
-  ]
-
-  if len(df) == len(df[male_and_female_cond]):
-    # We would obtain the same results
-    del scenarios[0]
-
-  if config.AGE_GROUP_COL in df.columns:
-    new_scenarios = []
-
-    for scenario in scenarios:
-      age_groups_per_scenario = [item for item in df[config.AGE_GROUP_COL].unique() if not pd.isnull(item)]
-
-      for age_group in age_groups_per_scenario:
-        new_scenario = copy.copy(scenario)
-        new_scenario['message'] += f', age group "{age_group}"'
-        new_scenario['df'] = new_scenario['df'][new_scenario['df'][config.AGE_GROUP_COL] == age_group]
-        new_scenario['suffix'] += f'__age_{age_group}'
-
-        new_scenarios.append(new_scenario)
-
-    scenarios.extend(new_scenarios)
-
-  if include_test_set_only_scenarios and config.SUBSET_COL in df.columns:
-    new_scenarios = []
-
-    for scenario in scenarios:
-      new_scenario = copy.copy(scenario)
-      new_scenario['message'] += ', test set only'
-      new_scenario['df'] = new_scenario['df'][new_scenario['df'][config.SUBSET_COL] == config.TEST_SET]
-      new_scenario['suffix'] += '__test_set'
-
-      new_scenarios.append(new_scenario)
-
-    scenarios.extend(new_scenarios)
-
-  os.makedirs(output_dirpath, exist_ok=True)
-
-  metrics = {}
-  
-  for scenario in scenarios:
-    message = scenario.pop('message', None)
-    if message is not None:
-      logger.info(message)
-
-    metrics_for_scenario = bisk_metrics.compute_metrics_via_bootstrapping_for_all_predicted_columns(
-      **scenario,
+  run_report = bisk_instrumentation.RunReport(
+    'compute_metrics',
+    os.path.join(output_dirpath, RUN_REPORT_FILENAME),
+    parameters=click.get_current_context().params,
+    profile=profile,
+    trace_memory=trace_memory,
+  )
+
+  with run_report:
+    logger = logging.getLogger(__file__)
+    logging.basicConfig(format='%(asctime)s %(message)s')
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel('INFO')
+
+    if reuse_computed_metrics and random_state is None:
+      # Bootstrap samples differ between runs without a fixed random state, hence results cannot be reused.
+      logger.info('Recomputing all metrics as computed metrics are reused only with a fixed random state')
+      reuse_computed_metrics = False
+
+    with bisk_instrumentation.span('load_predictions') as span:
+      df = pd.read_parquet(predictions_path)
+      span['n_rows'] = len(df)
+
+    if config.GENDER_COL not in df.columns:
+      logger.error(f'Column "{config.GENDER_COL}" not found in the dataset')
+      sys.exit(1)
+
+    with bisk_instrumentation.span('compute_metrics_per_row', n_rows=len(df)):
+      _precompute_metrics_in_preparation_for_macro_average(df, n_jobs)
+
+    scenarios = bisk_scenarios.get_scenarios(df, include_test_set_only_scenarios)
+
+    # All scenarios are evaluated from a single table of numeric per-row statistics.
+    predicted_cols = bisk_metrics.get_predicted_cols(df)
+
+    with bisk_instrumentation.span('get_row_statistics', n_rows=len(df)):
+      df_row_statistics = bisk_metrics.get_row_statistics(df, predicted_cols)
+
+    os.makedirs(output_dirpath, exist_ok=True)
+
+    metrics = {}
+
+    scenarios_with_metrics = bisk_metrics.compute_metrics_via_bootstrapping_for_scenarios(
+      df_row_statistics,
+      scenarios,
+      predicted_cols=predicted_cols,
       n_repetitions=n_repetitions,
       random_state=random_state,
       n_jobs=n_jobs,
-      save_indexes=save_indexes,
+      n_repetitions_per_job=n_repetitions_per_job,
+      indexes_dirpath=output_dirpath if save_indexes else None,
+      cache_dirpath=os.path.join(output_dirpath, CACHE_DIRNAME) if reuse_computed_metrics else None,
+      tolerance=tolerance,
     )
 
-    # Save intermediate results in case of a failure to avoid recomputing everything from scratch.
-    pd.DataFrame(metrics_for_scenario).to_parquet(os.path.join(output_dirpath, f'metrics__{scenario["suffix"]}.parquet'))
+    n_repetitions_per_unit = []
+
+    # Scenarios are bootstrapped lazily while iterating over them.
+    with bisk_instrumentation.span('compute_metrics_via_bootstrapping', n_rows=len(df)):
+      for scenario, metrics_for_scenario in scenarios_with_metrics:
+        logger.info(scenario['message'])
+
+        # Save intermediate results in case of a failure to avoid recomputing everything from scratch.
+        _to_data_frame(metrics_for_scenario).to_parquet(
+          os.path.join(output_dirpath, f'metrics__{scenario["suffix"]}.parquet'))
+
+        metrics.update(metrics_for_scenario)
+
+        for col in predicted_cols:
+          n_repetitions_for_col = len(metrics_for_scenario[
+            f'{config.WER_PREFIX}micro_average_{col[len(config.PREDICTED_COL_PREFIX):]}{scenario["suffix"]}'])
+
+          n_repetitions_per_unit.append({
+            'scenario': scenario['suffix'],
+            'predicted_col': col,
+            'n_repetitions': n_repetitions_for_col,
+          })
+
+          if tolerance is not None:
+            logger.info(f'Number of repetitions for "{col}": {n_repetitions_for_col}')
+
+    bisk_instrumentation.add_metrics(n_repetitions=n_repetitions_per_unit)
+
+    df_n_repetitions = pd.DataFrame(n_repetitions_per_unit, columns=N_REPETITIONS_KEY_COLS + ['n_repetitions'])
+
+    n_repetitions_filepath = os.path.join(output_dirpath, N_REPETITIONS_FILENAME)
+    if reuse_computed_metrics and os.path.exists(n_repetitions_filepath):
+      df_n_repetitions = _merge_n_repetitions(pd.read_parquet(n_repetitions_filepath), df_n_repetitions)
+
+    df_n_repetitions.to_parquet(n_repetitions_filepath)
+
+    df_metrics = _to_data_frame(metrics)
+
+    metrics_filepath = os.path.join(output_dirpath, 'metrics.parquet')
+    if reuse_computed_metrics and os.path.exists(metrics_filepath):
+      logger.info(f'Merging metrics into existing metrics in "{metrics_filepath}"')
+      df_metrics = _merge_metrics(pd.read_parquet(metrics_filepath), df_metrics)
+
+    with bisk_instrumentation.span('save_metrics'):
+      df_metrics.to_parquet(metrics_filepath)
+
+    with bisk_instrumentation.span('summarize_metrics'):
+      bisk_metrics.get_confidence_interval_summary(df_metrics, alphas=alpha).to_parquet(
+        os.path.join(output_dirpath, METRICS_SUMMARY_FILENAME))
+
+    logger.info('Done!')
+
+
+def _to_data_frame(metrics):
+  # Metrics may differ in the number of repetitions if bootstrapped until convergence.
+  return pd.DataFrame({name: pd.Series(values, dtype=float) for name, values in metrics.items()})
+
+
+def _merge_metrics(df_existing_metrics, df_new_metrics):
+  """Replaces existing metrics with new metrics of the same name and appends the remaining new metrics."""
+  cols = list(df_existing_metrics.columns) + [
+    col for col in df_new_metrics.columns if col not in df_existing_metrics.columns]
+
+  return pd.concat(
+    [df_existing_metrics.drop(columns=df_new_metrics.columns, errors='ignore'), df_new_metrics], axis=1)[cols]
 
-    metrics.update(metrics_for_scenario)
 
-  pd.DataFrame(metrics).to_parquet(os.path.join(output_dirpath, 'metrics.parquet'))
+def _merge_n_repetitions(df_existing_n_repetitions, df_new_n_repetitions):
+  """Keeps existing numbers of repetitions of pairs of scenario and predicted column missing in the new ones."""
+  df_n_repetitions = pd.concat([df_existing_n_repetitions, df_new_n_repetitions], ignore_index=True)
 
-  logger.info('Done!')
+  return df_n_repetitions.drop_duplicates(subset=N_REPETITIONS_KEY_COLS, keep='last', ignore_index=True)
 
 
-def _precompute_metrics_in_preparation_for_macro_average(df):
+def _precompute_metrics_in_preparation_for_macro_average(df, n_jobs):
   """Computes metrics for each pair of predicted and target transcription.
 
-  These per-row metrics are used for computing macro-average when later performing bootstrapping.
+  These per-row metrics and the underlying counts of edit operations are used for computing micro- and macro-average
+  when later performing bootstrapping.
   This saves computational resources by avoiding recomputing the metrics from the same pairs multiple times.
   """
-  bisk_metrics.compute_metrics_per_row(df)
+  bisk_metrics.compute_metrics_per_row(df, n_jobs=n_jobs)
 
 
 if __name__ == '__main__':
@@ -8,11 +8,29 @@ PREDICTED_RAW_COL_PREFIX = 'transcription_predicted_raw_'
 HAS_SENTENCE_MALE_AND_FEMALE_GENDER_COL = 'has_sentence_male_and_female_gender'
 
 AUDIO_PATH_COL = 'path'
+AUDIO_DURATION_COL = 'duration'
+AUDIO_SHARD_COL = 'audio_shard'
+AUDIO_OFFSET_COL = 'audio_offset'
+AUDIO_LENGTH_COL = 'audio_length'
 AUDIO_DIRNAME = 'audio'
 PROCESSED_SAMPLING_RATE = 16_000
 
+AUDIO_LOAD_TIME_PREFIX = 'audio_load_time_'
+INFERENCE_TIME_PREFIX = 'inference_time_'
+REAL_TIME_FACTOR_PREFIX = 'real_time_factor_'
+
 SUBSET_COL = 'subset'
 TEST_SET = 'test'
 
 WER_PREFIX = 'wer_'
 CER_PREFIX = 'cer_'
+
+WORD_SUBSTITUTIONS_PREFIX = 'word_substitutions_'
+WORD_INSERTIONS_PREFIX = 'word_insertions_'
+WORD_DELETIONS_PREFIX = 'word_deletions_'
+WORD_REFERENCE_LENGTH_COL = 'word_reference_length'
+
+CHAR_SUBSTITUTIONS_PREFIX = 'char_substitutions_'
+CHAR_INSERTIONS_PREFIX = 'char_insertions_'
+CHAR_DELETIONS_PREFIX = 'char_deletions_'
+CHAR_REFERENCE_LENGTH_COL = 'char_reference_length'
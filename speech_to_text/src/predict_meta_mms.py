@@ -1,13 +1,24 @@
+import functools
 import os
+import shutil
+import time
+from typing import Optional
 
 os.environ['TRANSFORMERS_CACHE'] = '/data/.cache'
 
 import click
 
 import pandas as pd
+import torch
 import tqdm
 
+import bisk_audio
+import bisk_instrumentation
+import bisk_models
 import bisk_predict
+import bisk_prefetch
+import bisk_shards
+import bisk_transcription_cache
 import config
 
 
@@ -15,42 +26,196 @@ import config
 @click.option('-a', '--audio-path', help='directory path containing audio samples', required=True)
 @click.option('-s', '--sentences-path', help='path to a parquet file containing input sentences', required=True)
 @click.option('-o', '--output-path', help='path to a parquet file containing input sentences plus predicted sentences', required=True)
+@click.option('-d', '--device', help='device to run the model on, e.g. "cpu" or "cuda:0"', required=False, default='cpu')
+@click.option('-b', '--batch-size',
+              help='number of audio samples of similar duration to transcribe at once',
+              required=False,
+              type=int,
+              default=1)
+@click.option('-t', '--n-threads',
+              help='if specified, number of threads used by PyTorch for inference on CPU',
+              required=False,
+              type=int,
+              default=None)
+@click.option('--n-prefetch-workers',
+              help='number of workers loading upcoming audio samples in the background; 0 loads them synchronously',
+              required=False,
+              type=int,
+              default=2)
+@click.option('--prefetch-queue-size',
+              help='maximum number of batches loaded ahead of the model',
+              required=False,
+              type=int,
+              default=4)
+@click.option('--prefetch-with-processes',
+              help='load audio samples in worker processes instead of threads',
+              is_flag=True,
+              default=False)
+@click.option('--shards-path',
+              help=('directory path to save predictions to in shards of rows as they are completed,'
+                    ' allowing to resume an interrupted prediction; defaults to the output path without the extension'
+                    ' and with the "_shards" suffix; removed once predictions are merged into the output file'),
+              required=False,
+              default=None)
+@click.option('--shard-size',
+              help='number of rows per shard',
+              required=False,
+              type=int,
+              default=bisk_shards.SHARD_SIZE)
+@click.option('--transcription-cache-path',
+              help=('if specified, path to a SQLite database caching transcriptions by audio content, model, language'
+                    ' and decoding options; only audio samples without a cached transcription are transcribed'),
+              required=False,
+              default=None)
+@click.option('--profile',
+              help='if specified, profile the run with cProfile and save statistics next to the run report',
+              is_flag=True,
+              default=False)
+@click.option('--trace-memory',
+              help='if specified, trace memory allocated by Python with tracemalloc and report its peak for each stage',
+              is_flag=True,
+              default=False)
 def main(
       audio_path: str,
       sentences_path: str,
       output_path: str,
+      device: str,
+      batch_size: int,
+      n_threads: Optional[int],
+      n_prefetch_workers: int,
+      prefetch_queue_size: int,
+      prefetch_with_processes: bool,
+      shards_path: Optional[str],
+      shard_size: int,
+      transcription_cache_path: Optional[str],
+      profile: bool,
+      trace_memory: bool,
 ):
-  tqdm.tqdm.pandas()
+  run_report = bisk_instrumentation.RunReport(
+    'predict_meta_mms',
+    bisk_instrumentation.get_report_filepath(output_path),
+    parameters=click.get_current_context().params,
+    profile=profile,
+    trace_memory=trace_memory,
+  )
 
-  predicted_col = f'{config.PREDICTED_COL_PREFIX}meta-mms_lang-sk'
+  with run_report:
+    tqdm.tqdm.pandas()
 
-  df_with_predictions = pd.read_parquet(sentences_path)
+    if n_threads is not None:
+      torch.set_num_threads(n_threads)
 
-  print(f'Predicting with Slovak language explicitly specified on input')
+    prefetch_kwargs = {
+      'n_workers': n_prefetch_workers,
+      'max_queue_size': prefetch_queue_size,
+      'use_processes': prefetch_with_processes,
+    }
 
-  bisk_predict.predict_meta_mms(
-    df_with_predictions,
-    config.AUDIO_PATH_COL,
-    audio_path,
-    'slk',
-    predicted_col,
-  )
+    if shards_path is None:
+      shards_path = f'{os.path.splitext(output_path)[0]}_shards'
 
-  predicted_col = f'{config.PREDICTED_COL_PREFIX}meta-mms_lang-auto'
+    if transcription_cache_path is not None:
+      transcription_cache = bisk_transcription_cache.TranscriptionCache(transcription_cache_path)
+    else:
+      transcription_cache = None
 
-  print(f'Predicting with automatic language recognition')
+    print(f'Loading model {bisk_models.META_MMS_MODEL_ID}')
 
-  bisk_predict.predict_meta_mms(
-    df_with_predictions,
-    config.AUDIO_PATH_COL,
-    audio_path,
-    None,
-    predicted_col,
-  )
+    with bisk_instrumentation.span('load_model'):
+      model = bisk_models.MetaMmsModel(device=device)
+
+    print(f'Loaded model in {model.load_time:.1f} s')
+
+    predicted_cols = [f'{config.PREDICTED_COL_PREFIX}meta-mms_lang-{language_name}' for language_name in ['sk', 'auto']]
+
+    with bisk_instrumentation.span('load_sentences') as span:
+      df_with_predictions = pd.read_parquet(sentences_path)
+      span['n_rows'] = len(df_with_predictions)
+
+    with bisk_instrumentation.span('add_audio_duration', n_rows=len(df_with_predictions)):
+      bisk_audio.add_audio_duration_col(df_with_predictions, config.AUDIO_PATH_COL, audio_path)
+
+    print(f'Predicting with Slovak language explicitly specified on input')
+
+    shards_dirpaths = [
+      _predict_meta_mms(
+        df_with_predictions, model, audio_path, 'slk', predicted_cols[0], batch_size, prefetch_kwargs, shards_path,
+        shard_size, transcription_cache),
+    ]
+
+    print(f'Predicting with automatic language recognition')
+
+    shards_dirpaths.append(_predict_meta_mms(
+      df_with_predictions, model, audio_path, None, predicted_cols[1], batch_size, prefetch_kwargs, shards_path,
+      shard_size, transcription_cache))
+
+    print(f'Merging predictions from {shards_path}')
+
+    with bisk_instrumentation.span('merge_shards', n_rows=len(df_with_predictions)):
+      bisk_shards.merge_shards(df_with_predictions, shards_dirpaths, output_path, shard_size=shard_size)
+
+    shutil.rmtree(shards_path)
+
+    throughput_summary = bisk_predict.save_throughput_summary(output_path, predicted_cols)
+    bisk_predict.print_throughput_summary(throughput_summary)
+    bisk_instrumentation.add_metrics(throughput=throughput_summary.to_dict('records'))
+
+    if transcription_cache is not None:
+      bisk_transcription_cache.print_statistics(transcription_cache)
+      bisk_instrumentation.add_metrics(transcription_cache=transcription_cache.get_statistics())
+      transcription_cache.close()
+
+    print('Done!')
+
+
+def _predict_meta_mms(
+      df, model, audio_path, language, predicted_col, batch_size, prefetch_kwargs, shards_path, shard_size,
+      transcription_cache):
+  shards_dirpath = os.path.join(shards_path, predicted_col)
+
+  load_time = model.load_time
+
+  start_time = time.perf_counter()
+
+  with bisk_instrumentation.span(f'predict__{predicted_col}') as span:
+    prefetch_statistics_per_shard, n_predicted_rows = bisk_shards.predict_in_shards(
+      df,
+      functools.partial(
+        bisk_predict.predict_meta_mms,
+        model=model,
+        input_col=config.AUDIO_PATH_COL,
+        root_dirpath=audio_path,
+        language=language,
+        predicted_col=predicted_col,
+        batch_size=batch_size,
+        prefetch_kwargs=prefetch_kwargs,
+        transcription_cache=transcription_cache,
+      ),
+      [predicted_col] + bisk_predict.get_timing_cols(predicted_col),
+      shards_dirpath,
+      shard_size=shard_size,
+    )
+    span['n_rows'] = n_predicted_rows
+
+  adapter_load_time = model.load_time - load_time
+  inference_time = time.perf_counter() - start_time - adapter_load_time
+
+  prefetch_statistics = bisk_prefetch.combine_statistics(prefetch_statistics_per_shard)
 
-  df_with_predictions.to_parquet(output_path)
+  print(f'Switched adapter in {adapter_load_time:.1f} s')
+  print(
+    f'Predicted {n_predicted_rows} rows in {inference_time:.1f} s'
+    f' ({n_predicted_rows / max(inference_time, 1e-9):.2f} rows/s)')
+  bisk_prefetch.print_statistics(prefetch_statistics)
+  bisk_instrumentation.add_metrics(**{
+    f'predict__{predicted_col}': {
+      'adapter_load_time': adapter_load_time,
+      'inference_time': inference_time,
+      'prefetch': prefetch_statistics,
+    },
+  })
 
-  print('Done!')
+  return shards_dirpath
 
 
 if __name__ == '__main__':
@@ -1,4 +1,8 @@
+import functools
 import os
+import shutil
+import time
+from typing import Optional
 
 os.environ['TRANSFORMERS_CACHE'] = '/data/.cache'
 
@@ -9,7 +13,13 @@ import tqdm
 
 import whisper
 
+import bisk_audio
+import bisk_feature_cache
+import bisk_instrumentation
 import bisk_predict
+import bisk_prefetch
+import bisk_shards
+import bisk_transcription_cache
 import config
 
 
@@ -18,53 +28,243 @@ import config
 @click.option('-s', '--sentences-path', help='path to a parquet file containing input sentences', required=True)
 @click.option('-m', '--model-size', help='size of the Whisper model', required=True)
 @click.option('-o', '--output-path', help='path to a parquet file containing input sentences plus predicted sentences', required=True)
+@click.option('-b', '--batch-size',
+              help=('if specified, decode this many audio samples at once and share the encoder output'
+                    ' between both language settings; otherwise, transcribe each sample individually for each'
+                    ' language setting with the full sliding window and temperature fallback of Whisper'),
+              required=False,
+              type=int,
+              default=None)
+@click.option('--feature-cache-dirpath',
+              help=('if specified, directory path to cache log-mel spectrograms in,'
+                    ' shared by Whisper models of all sizes; requires --batch-size'),
+              required=False,
+              default=None)
+@click.option('--feature-cache-max-size',
+              help='maximum size of the feature cache in GB; least recently used features are removed beyond the size',
+              required=False,
+              type=float,
+              default=50.0)
+@click.option('--n-prefetch-workers',
+              help='number of workers loading upcoming audio samples in the background; 0 loads them synchronously',
+              required=False,
+              type=int,
+              default=2)
+@click.option('--prefetch-queue-size',
+              help='maximum number of batches (or audio samples without --batch-size) loaded ahead of the model',
+              required=False,
+              type=int,
+              default=4)
+@click.option('--prefetch-with-processes',
+              help='load audio samples in worker processes instead of threads',
+              is_flag=True,
+              default=False)
+@click.option('--shards-path',
+              help=('directory path to save predictions to in shards of rows as they are completed,'
+                    ' allowing to resume an interrupted prediction; defaults to the output path without the extension'
+                    ' and with the "_shards" suffix; removed once predictions are merged into the output file'),
+              required=False,
+              default=None)
+@click.option('--shard-size',
+              help='number of rows per shard',
+              required=False,
+              type=int,
+              default=bisk_shards.SHARD_SIZE)
+@click.option('--transcription-cache-path',
+              help=('if specified, path to a SQLite database caching transcriptions by audio content, model, language'
+                    ' and decoding options; only audio samples without a cached transcription are transcribed'),
+              required=False,
+              default=None)
+@click.option('--profile',
+              help='if specified, profile the run with cProfile and save statistics next to the run report',
+              is_flag=True,
+              default=False)
+@click.option('--trace-memory',
+              help='if specified, trace memory allocated by Python with tracemalloc and report its peak for each stage',
+              is_flag=True,
+              default=False)
 def main(
       audio_path: str,
       sentences_path: str,
       model_size: str,
       output_path: str,
+      batch_size: Optional[int],
+      feature_cache_dirpath: Optional[str],
+      feature_cache_max_size: float,
+      n_prefetch_workers: int,
+      prefetch_queue_size: int,
+      prefetch_with_processes: bool,
+      shards_path: Optional[str],
+      shard_size: int,
+      transcription_cache_path: Optional[str],
+      profile: bool,
+      trace_memory: bool,
 ):
-  tqdm.tqdm.pandas()
+  run_report = bisk_instrumentation.RunReport(
+    'predict_whisper',
+    bisk_instrumentation.get_report_filepath(output_path),
+    parameters=click.get_current_context().params,
+    profile=profile,
+    trace_memory=trace_memory,
+  )
 
-  print(f'Downloading Whisper model, size {model_size}')
+  with run_report:
+    tqdm.tqdm.pandas()
 
-  model = whisper.load_model(model_size)
+    print(f'Downloading Whisper model, size {model_size}')
 
-  raw_predicted_col = f'{config.PREDICTED_RAW_COL_PREFIX}whisper-{model_size}_lang-sk'
-  predicted_col = f'{config.PREDICTED_COL_PREFIX}whisper-{model_size}_lang-sk'
+    with bisk_instrumentation.span('load_model'):
+      model = whisper.load_model(model_size)
 
-  df_with_predictions = pd.read_parquet(sentences_path)
+    with bisk_instrumentation.span('load_sentences') as span:
+      df_with_predictions = pd.read_parquet(sentences_path)
+      span['n_rows'] = len(df_with_predictions)
 
-  print(f'Predicting with Slovak language explicitly specified on input')
+    with bisk_instrumentation.span('add_audio_duration', n_rows=len(df_with_predictions)):
+      bisk_audio.add_audio_duration_col(df_with_predictions, config.AUDIO_PATH_COL, audio_path)
 
-  bisk_predict.predict_whisper(
-    df_with_predictions,
-    model,
-    config.AUDIO_PATH_COL,
-    audio_path,
-    'sk',
-    raw_predicted_col,
-    predicted_col,
-  )
+    languages = ['sk', None]
+    language_names = ['sk', 'auto']
 
-  raw_predicted_col = f'{config.PREDICTED_RAW_COL_PREFIX}whisper-{model_size}_lang-auto'
-  predicted_col = f'{config.PREDICTED_COL_PREFIX}whisper-{model_size}_lang-auto'
+    raw_predicted_cols = [
+      f'{config.PREDICTED_RAW_COL_PREFIX}whisper-{model_size}_lang-{language_name}' for language_name in language_names]
+    predicted_cols = [
+      f'{config.PREDICTED_COL_PREFIX}whisper-{model_size}_lang-{language_name}' for language_name in language_names]
 
-  print(f'Predicting with automatic language recognition')
+    prefetch_kwargs = {
+      'n_workers': n_prefetch_workers,
+      'max_queue_size': prefetch_queue_size,
+      'use_processes': prefetch_with_processes,
+    }
+
+    if shards_path is None:
+      shards_path = f'{os.path.splitext(output_path)[0]}_shards'
+
+    if transcription_cache_path is not None:
+      transcription_cache = bisk_transcription_cache.TranscriptionCache(transcription_cache_path)
+    else:
+      transcription_cache = None
+
+    if batch_size is not None:
+      if feature_cache_dirpath is not None:
+        feature_cache = bisk_feature_cache.FeatureCache(
+          feature_cache_dirpath, max_size_bytes=int(feature_cache_max_size * 1024 ** 3))
+      else:
+        feature_cache = None
+
+      print(f'Predicting with Slovak language explicitly specified on input and with automatic language recognition')
+
+      shards_dirpaths = [
+        _predict_in_shards(
+          df_with_predictions,
+          functools.partial(
+            bisk_predict.predict_whisper_multiple_languages,
+            model=model,
+            input_col=config.AUDIO_PATH_COL,
+            root_dirpath=audio_path,
+            languages=languages,
+            raw_predicted_cols=raw_predicted_cols,
+            predicted_cols=predicted_cols,
+            batch_size=batch_size,
+            feature_cache=feature_cache,
+            prefetch_kwargs=prefetch_kwargs,
+            transcription_cache=transcription_cache,
+            model_id=f'whisper-{model_size}',
+          ),
+          raw_predicted_cols + predicted_cols,
+          _get_timing_cols(predicted_cols),
+          shards_path,
+          shard_size,
+        ),
+      ]
+
+      if feature_cache is not None:
+        _print_feature_cache_statistics(feature_cache)
+        bisk_instrumentation.add_metrics(feature_cache=feature_cache.get_statistics())
+    else:
+      shards_dirpaths = []
+
+      for language, language_name, raw_predicted_col, predicted_col in zip(
+            languages, language_names, raw_predicted_cols, predicted_cols):
+        if language is not None:
+          print(f'Predicting with Slovak language explicitly specified on input')
+        else:
+          print(f'Predicting with automatic language recognition')
+
+        shards_dirpaths.append(_predict_in_shards(
+          df_with_predictions,
+          functools.partial(
+            bisk_predict.predict_whisper,
+            model=model,
+            input_col=config.AUDIO_PATH_COL,
+            root_dirpath=audio_path,
+            language=language,
+            raw_predicted_col=raw_predicted_col,
+            predicted_col=predicted_col,
+            prefetch_kwargs=prefetch_kwargs,
+            transcription_cache=transcription_cache,
+            model_id=f'whisper-{model_size}',
+          ),
+          [raw_predicted_col, predicted_col],
+          _get_timing_cols([predicted_col]),
+          shards_path,
+          shard_size,
+        ))
+
+    print(f'Merging predictions from {shards_path}')
+
+    with bisk_instrumentation.span('merge_shards', n_rows=len(df_with_predictions)):
+      bisk_shards.merge_shards(df_with_predictions, shards_dirpaths, output_path, shard_size=shard_size)
+
+    shutil.rmtree(shards_path)
+
+    throughput_summary = bisk_predict.save_throughput_summary(output_path, predicted_cols)
+    bisk_predict.print_throughput_summary(throughput_summary)
+    bisk_instrumentation.add_metrics(throughput=throughput_summary.to_dict('records'))
+
+    if transcription_cache is not None:
+      bisk_transcription_cache.print_statistics(transcription_cache)
+      bisk_instrumentation.add_metrics(transcription_cache=transcription_cache.get_statistics())
+      transcription_cache.close()
+
+    print('Done!')
+
+
+def _predict_in_shards(df, predict_func, predicted_cols, timing_cols, shards_path, shard_size):
+  shards_dirpath = os.path.join(shards_path, '__'.join(predicted_cols))
+
+  start_time = time.perf_counter()
+
+  with bisk_instrumentation.span(f'predict__{"__".join(predicted_cols)}') as span:
+    prefetch_statistics_per_shard, n_predicted_rows = bisk_shards.predict_in_shards(
+      df, predict_func, predicted_cols + timing_cols, shards_dirpath, shard_size=shard_size)
+    span['n_rows'] = n_predicted_rows
+
+  prefetch_statistics = bisk_prefetch.combine_statistics(prefetch_statistics_per_shard)
+
+  _print_throughput(n_predicted_rows, start_time)
+  bisk_prefetch.print_statistics(prefetch_statistics)
+  bisk_instrumentation.add_metrics(**{f'prefetch__{"__".join(predicted_cols)}': prefetch_statistics})
+
+  return shards_dirpath
+
+
+def _get_timing_cols(predicted_cols):
+  return [col for predicted_col in predicted_cols for col in bisk_predict.get_timing_cols(predicted_col)]
+
+
+def _print_throughput(n_rows, start_time):
+  elapsed_time = time.perf_counter() - start_time
+  print(f'Predicted {n_rows} rows in {elapsed_time:.1f} s ({n_rows / max(elapsed_time, 1e-9):.2f} rows/s)')
 
-  bisk_predict.predict_whisper(
-    df_with_predictions,
-    model,
-    config.AUDIO_PATH_COL,
-    audio_path,
-    None,
-    raw_predicted_col,
-    predicted_col,
-  )
 
-  df_with_predictions.to_parquet(output_path)
+def _print_feature_cache_statistics(feature_cache):
+  statistics = feature_cache.get_statistics()
 
-  print('Done!')
+  print(
+    f'Feature cache: {statistics["hits"]} hits, {statistics["misses"]} misses'
+    f' (hit rate {statistics["hit_rate"]:.1%}), {statistics["evictions"]} evictions,'
+    f' {statistics["n_files"]} files, {statistics["size_bytes"] / 1024 ** 3:.2f} GB')
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import os
+import time
 
 import pandas as pd
 
@@ -6,6 +7,8 @@ import click
 import tqdm
 
 import bisk_audio
+import bisk_instrumentation
+import bisk_packed_audio
 import bisk_preprocessing
 import config
 
@@ -16,55 +19,115 @@ AUDIO_ORIGINAL_DIRNAME = 'clips'
 @click.command()
 @click.option('-d', '--data-dirpath', help='directory path containing dataset', required=True)
 @click.option('-o', '--output-path', help='path containing preprocessed dataset', required=True)
+@click.option('-j', '--n-jobs',
+              help='number of parallel processes resampling audio samples; -1 uses all CPUs',
+              required=False,
+              type=int,
+              default=-1)
+@click.option('--skip-existing/--overwrite-existing',
+              help='skip audio samples already resampled to the target sampling rate',
+              default=True)
+@click.option('--audio-format',
+              help=('format of resampled audio samples; "packed-*" formats append samples to large shard files'
+                    f' in "{bisk_packed_audio.PACKED_AUDIO_DIRNAME}" read by predictors as memory-mapped arrays'),
+              required=False,
+              type=click.Choice(bisk_packed_audio.AUDIO_FORMATS),
+              default='files')
+@click.option('--profile',
+              help='if specified, profile the run with cProfile and save statistics next to the run report',
+              is_flag=True,
+              default=False)
+@click.option('--trace-memory',
+              help='if specified, trace memory allocated by Python with tracemalloc and report its peak for each stage',
+              is_flag=True,
+              default=False)
 def main(
       data_dirpath: str,
       output_path: str,
+      n_jobs: int,
+      skip_existing: bool,
+      audio_format: str,
+      profile: bool,
+      trace_memory: bool,
 ):
-  tqdm.tqdm.pandas()
+  run_report = bisk_instrumentation.RunReport(
+    'preprocess_common_voice',
+    bisk_instrumentation.get_report_filepath(output_path),
+    parameters=click.get_current_context().params,
+    profile=profile,
+    trace_memory=trace_memory,
+  )
 
-  print('Preprocessing dataset')
+  with run_report:
+    tqdm.tqdm.pandas()
 
-  os.makedirs(os.path.join(data_dirpath, config.AUDIO_DIRNAME), exist_ok=True)
+    print('Preprocessing dataset')
 
-  data_subdirpath = _find_data_subdirectory(data_dirpath)
-  if data_subdirpath is None:
-    data_subdirpath = data_dirpath
+    packed_audio_writer = bisk_packed_audio.get_packed_audio_writer(data_dirpath, audio_format)
 
-  df = pd.read_csv(os.path.join(data_subdirpath, 'validated.tsv'), sep='\t')
+    if packed_audio_writer is None:
+      os.makedirs(os.path.join(data_dirpath, config.AUDIO_DIRNAME), exist_ok=True)
 
-  df.loc[df[config.GENDER_COL].isnull(), config.GENDER_COL] = 'unknown'
+    data_subdirpath = _find_data_subdirectory(data_dirpath)
+    if data_subdirpath is None:
+      data_subdirpath = data_dirpath
 
-  df = df.rename(columns={'sentence': config.GROUND_TRUTH_RAW_COL, 'path': config.AUDIO_PATH_COL})
+    with bisk_instrumentation.span('read_tsv') as span:
+      df = pd.read_csv(os.path.join(data_subdirpath, 'validated.tsv'), sep='\t')
+      span['n_rows'] = len(df)
 
-  bisk_preprocessing.preprocess_transcriptions(df, config.GROUND_TRUTH_RAW_COL, config.GROUND_TRUTH_COL)
+    df.loc[df[config.GENDER_COL].isnull(), config.GENDER_COL] = 'unknown'
 
-  df = bisk_preprocessing.add_has_sentence_male_and_female_gender(df, config.GROUND_TRUTH_COL, config.GENDER_COL)
+    df = df.rename(columns={'sentence': config.GROUND_TRUTH_RAW_COL, 'path': config.AUDIO_PATH_COL})
 
-  print('Obtaining original audio metadata')
+    with bisk_instrumentation.span('preprocess_transcriptions', n_rows=len(df)):
+      bisk_preprocessing.preprocess_transcriptions(df, config.GROUND_TRUTH_RAW_COL, config.GROUND_TRUTH_COL)
 
-  df = df.progress_apply(
-    bisk_audio.get_audio_metadata,
-    axis=1,
-    args=(os.path.join(data_subdirpath, AUDIO_ORIGINAL_DIRNAME), config.AUDIO_PATH_COL))
+    with bisk_instrumentation.span('add_has_sentence_male_and_female_gender', n_rows=len(df)):
+      df = bisk_preprocessing.add_has_sentence_male_and_female_gender(df, config.GROUND_TRUTH_COL, config.GENDER_COL)
 
-  print(f'Converting audio samples to {config.PROCESSED_SAMPLING_RATE} sampling rate')
+    print(
+      f'Obtaining original audio metadata and converting audio samples to {config.PROCESSED_SAMPLING_RATE}'
+      ' sampling rate')
 
-  df = df.progress_apply(
-    bisk_audio.resample_audio,
-    axis=1,
-    args=(
-      os.path.join(data_subdirpath, AUDIO_ORIGINAL_DIRNAME),
-      config.AUDIO_PATH_COL,
-      'sample_rate',
-      os.path.join(data_dirpath, config.AUDIO_DIRNAME),
-      config.PROCESSED_SAMPLING_RATE))
+    start_time = time.perf_counter()
 
-  df[config.AUDIO_PATH_COL] = df[config.AUDIO_PATH_COL].apply(lambda p: os.path.join(config.AUDIO_DIRNAME, p))
+    with bisk_instrumentation.span('ingest_audio_files', n_rows=len(df)):
+      statuses = bisk_audio.ingest_audio_files(
+        df,
+        os.path.join(data_subdirpath, AUDIO_ORIGINAL_DIRNAME),
+        config.AUDIO_PATH_COL,
+        os.path.join(data_dirpath, config.AUDIO_DIRNAME),
+        config.PROCESSED_SAMPLING_RATE,
+        n_jobs=n_jobs,
+        skip_existing=skip_existing,
+        packed_audio_writer=packed_audio_writer,
+      )
 
-  print(f'Saving preprocessed file to "{output_path}"')
+      if packed_audio_writer is not None:
+        packed_audio_writer.close()
 
-  os.makedirs(os.path.dirname(output_path), exist_ok=True)
-  df.to_parquet(output_path)
+    _print_resampling_statistics(statuses, start_time)
+    bisk_instrumentation.add_metrics(
+      audio_files={status: statuses.count(status) for status in ['resampled', 'skipped', 'failed']})
+
+    df[config.AUDIO_PATH_COL] = df[config.AUDIO_PATH_COL].apply(lambda p: os.path.join(config.AUDIO_DIRNAME, p))
+
+    print(f'Saving preprocessed file to "{output_path}"')
+
+    with bisk_instrumentation.span('save', n_rows=len(df)):
+      os.makedirs(os.path.dirname(output_path), exist_ok=True)
+      df.to_parquet(output_path)
+
+
+def _print_resampling_statistics(statuses, start_time):
+  elapsed_time = time.perf_counter() - start_time
+  n_files = len(statuses)
+
+  print(
+    f'Processed {n_files} files in {elapsed_time:.1f} s ({n_files / max(elapsed_time, 1e-9):.2f} files/s):'
+    f' {statuses.count("resampled")} resampled, {statuses.count("skipped")} skipped,'
+    f' {statuses.count("failed")} failed')
 
 
 def _find_data_subdirectory(data_dirpath):
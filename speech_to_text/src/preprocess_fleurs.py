@@ -12,64 +12,150 @@ import tqdm
 import datasets
 
 import bisk_audio
+import bisk_instrumentation
+import bisk_packed_audio
 import bisk_preprocessing
 import config
 
 
+# Number of rows converted from the dataset to pandas at once
+BATCH_SIZE = 1000
+
+
 @click.command()
 @click.option('-d', '--data-dirpath', help='directory path containing dataset', required=True)
 @click.option('-o', '--output-path', help='path containing preprocessed dataset', required=True)
+@click.option('--audio-format',
+              help=('format of audio samples; "packed-*" formats additionally append samples resampled to'
+                    f' {config.PROCESSED_SAMPLING_RATE} Hz to large shard files in'
+                    f' "{bisk_packed_audio.PACKED_AUDIO_DIRNAME}" read by predictors as memory-mapped arrays'),
+              required=False,
+              type=click.Choice(bisk_packed_audio.AUDIO_FORMATS),
+              default='files')
+@click.option('-b', '--batch-size',
+              help='number of rows converted from the dataset at once; lower values reduce memory usage',
+              required=False,
+              type=int,
+              default=BATCH_SIZE)
+@click.option('--read-audio-headers/--no-read-audio-headers',
+              help=('read metadata from headers of all audio files, including bits per sample, number of channels'
+                    ' and encoding, instead of using sampling rate and number of samples stored in the dataset'),
+              default=False)
+@click.option('--profile',
+              help='if specified, profile the run with cProfile and save statistics next to the run report',
+              is_flag=True,
+              default=False)
+@click.option('--trace-memory',
+              help='if specified, trace memory allocated by Python with tracemalloc and report its peak for each stage',
+              is_flag=True,
+              default=False)
 def main(
       data_dirpath: str,
       output_path: str,
+      audio_format: str,
+      batch_size: int,
+      read_audio_headers: bool,
+      profile: bool,
+      trace_memory: bool,
 ):
-  tqdm.tqdm.pandas()
+  run_report = bisk_instrumentation.RunReport(
+    'preprocess_fleurs',
+    bisk_instrumentation.get_report_filepath(output_path),
+    parameters=click.get_current_context().params,
+    profile=profile,
+    trace_memory=trace_memory,
+  )
+
+  with run_report:
+    tqdm.tqdm.pandas()
+
+    data_dirpath = os.path.normpath(data_dirpath)
+
+    print('Downloading dataset')
+
+    with bisk_instrumentation.span('load_dataset'):
+      fleurs_asr_sk = datasets.load_dataset('google/xtreme_s', 'fleurs.sk_sk', cache_dir=data_dirpath)
+
+    print('Preprocessing dataset')
 
-  data_dirpath = os.path.normpath(data_dirpath)
+    with bisk_instrumentation.span('merge_subsets') as span:
+      df = _merge_subsets(fleurs_asr_sk, batch_size)
+      span['n_rows'] = len(df)
 
-  print('Downloading dataset')
+    df = _add_gender_col(df)
 
-  fleurs_asr_sk = datasets.load_dataset('google/xtreme_s', 'fleurs.sk_sk', cache_dir=data_dirpath)
+    df = df.rename(columns={'path': config.AUDIO_PATH_COL})
 
-  print('Preprocessing dataset')
+    df[config.AUDIO_PATH_COL] = df[config.AUDIO_PATH_COL].apply(lambda path: os.path.relpath(path, data_dirpath))
 
-  df = _merge_subsets(fleurs_asr_sk)
+    with bisk_instrumentation.span('preprocess_transcriptions', n_rows=len(df)):
+      bisk_preprocessing.preprocess_transcriptions(df, 'transcription', config.GROUND_TRUTH_COL)
 
-  df = _add_gender_col(df)
+    with bisk_instrumentation.span('add_has_sentence_male_and_female_gender', n_rows=len(df)):
+      df = bisk_preprocessing.add_has_sentence_male_and_female_gender(df, config.GROUND_TRUTH_COL, config.GENDER_COL)
 
-  df = df.rename(columns={'path': config.AUDIO_PATH_COL})
+    with bisk_instrumentation.span('add_audio_metadata', n_rows=len(df)):
+      if read_audio_headers:
+        print('Obtaining audio metadata from audio files')
 
-  df[config.AUDIO_PATH_COL] = df[config.AUDIO_PATH_COL].apply(lambda path: os.path.relpath(path, data_dirpath))
+        df = df.apply(bisk_audio.get_audio_metadata, axis=1, args=(data_dirpath, config.AUDIO_PATH_COL))
+      else:
+        _add_audio_metadata_from_dataset(df, fleurs_asr_sk)
 
-  bisk_preprocessing.preprocess_transcriptions(df, 'transcription', config.GROUND_TRUTH_COL)
+    packed_audio_writer = bisk_packed_audio.get_packed_audio_writer(data_dirpath, audio_format)
 
-  df = bisk_preprocessing.add_has_sentence_male_and_female_gender(df, config.GROUND_TRUTH_COL, config.GENDER_COL)
+    if packed_audio_writer is not None:
+      print(f'Packing audio samples with {config.PROCESSED_SAMPLING_RATE} sampling rate')
 
-  print('Obtaining audio metadata')
+      with packed_audio_writer, bisk_instrumentation.span('pack_audio_files', n_rows=len(df)):
+        bisk_audio.pack_audio_files(df, data_dirpath, config.AUDIO_PATH_COL, packed_audio_writer)
 
-  df = df.apply(bisk_audio.get_audio_metadata, axis=1, args=(data_dirpath, config.AUDIO_PATH_COL))
+    print(f'Saving preprocessed file to "{output_path}"')
 
-  print(f'Saving preprocessed file to "{output_path}"')
+    with bisk_instrumentation.span('save', n_rows=len(df)):
+      os.makedirs(os.path.dirname(output_path), exist_ok=True)
+      df.to_parquet(output_path)
 
-  os.makedirs(os.path.dirname(output_path), exist_ok=True)
-  df.to_parquet(output_path)
+    print(f'Peak memory usage: {bisk_instrumentation.get_peak_rss_mb():.1f} MB')
 
 
-def _merge_subsets(fleurs_asr):
-  df_train = fleurs_asr['train'].to_pandas()
-  df_train['subset'] = 'train'
+def _merge_subsets(fleurs_asr, batch_size=BATCH_SIZE):
+  """Concatenates rows of all subsets without the `audio` column.
 
-  df_validation = fleurs_asr['validation'].to_pandas()
-  df_validation['subset'] = 'validation'
+  Rows are converted in batches of `batch_size`, so that decoded audio is never loaded and only a batch of rows
+  is held in memory in addition to the resulting dataframe.
+  """
+  dfs = []
 
-  df_test = fleurs_asr['test'].to_pandas()
-  df_test['subset'] = 'test'
+  for subset in ['train', 'validation', 'test']:
+    dataset = fleurs_asr[subset]
+    dataset = dataset.select_columns([col for col in dataset.column_names if col != 'audio'])
 
-  df = pd.concat([df_train, df_validation, df_test], ignore_index=True)
+    for df_batch in dataset.to_pandas(batch_size=batch_size, batched=True):
+      df_batch['subset'] = subset
+      dfs.append(df_batch)
+
+  df = pd.concat(dfs, ignore_index=True)
 
   return df
 
 
+def _add_audio_metadata_from_dataset(df, fleurs_asr):
+  # FLEURS audio files are stored with the sampling rate of the audio feature, so it is not read from the files.
+  sampling_rates = {fleurs_asr[subset].features['audio'].sampling_rate for subset in fleurs_asr}
+
+  if len(sampling_rates) != 1 or None in sampling_rates:
+    raise ValueError(
+      f'Audio features of the dataset have sampling rates {sampling_rates} instead of a single fixed one,'
+      f' use --read-audio-headers to obtain them from audio files')
+
+  sampling_rate = sampling_rates.pop()
+
+  df['sample_rate'] = sampling_rate
+  df['num_frames'] = df['num_samples']
+  df[config.AUDIO_DURATION_COL] = df['num_samples'] / sampling_rate
+
+
 def _add_gender_col(df):
   df = df.rename(columns={config.GENDER_COL: 'gender_number'})
 
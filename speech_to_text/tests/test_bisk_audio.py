@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+
+import bisk_audio
+import bisk_feature_cache
+import bisk_packed_audio
+
+
+AUDIO_LENGTHS = [1000, 16000, 16150, 40123, 80000]
+
+
+@pytest.fixture
+def model():
+  torch.manual_seed(0)
+  dims = ModelDimensions(
+    n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+    n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1)
+  model = Whisper(dims).eval()
+
+  # Weights of a randomly initialized model are too small for its output to depend on the audio.
+  with torch.no_grad():
+    for name, parameter in model.named_parameters():
+      if name.startswith('encoder.') or '.cross_attn.' in name:
+        parameter.mul_(5)
+
+  return model
+
+
+@pytest.fixture
+def audio_clips(tmp_path):
+  rng = np.random.default_rng(0)
+
+  with bisk_packed_audio.PackedAudioWriter(str(tmp_path)) as writer:
+    locations = [writer.write(rng.standard_normal(length) * 0.1) for length in AUDIO_LENGTHS]
+
+  return [
+    bisk_packed_audio.PackedAudioClip(str(tmp_path / rel_filepath), offset, length)
+    for rel_filepath, offset, length in locations]
+
+
+@pytest.fixture
+def no_fallback_thresholds(monkeypatch):
+  monkeypatch.setattr(bisk_audio, 'WHISPER_COMPRESSION_RATIO_THRESHOLD', float('inf'))
+  monkeypatch.setattr(bisk_audio, 'WHISPER_LOGPROB_THRESHOLD', float('-inf'))
+  monkeypatch.setattr(bisk_audio, 'WHISPER_NO_SPEECH_THRESHOLD', float('inf'))
+
+  transcribe = whisper.transcribe
+
+  def _transcribe_without_fallback(*args, **kwargs):
+    return transcribe(
+      *args, compression_ratio_threshold=None, logprob_threshold=None, no_speech_threshold=None, **kwargs)
+
+  monkeypatch.setattr(whisper, 'transcribe', _transcribe_without_fallback)
+
+  return _transcribe_without_fallback
+
+
+@pytest.mark.parametrize('language', ['sk', None])
+def test_transcribe_audio_whisper_batch_matches_transcribe(model, audio_clips, no_fallback_thresholds, language):
+  results = bisk_audio.transcribe_audio_whisper_batch(audio_clips, model, languages=[language])[0]
+
+  for audio_clip, result in zip(audio_clips, results):
+    expected_result = no_fallback_thresholds(model, np.array(audio_clip.load()), language=language)
+
+    assert result['text'] == expected_result['text']
+    assert result['language'] == expected_result['language']
+    assert [segment['tokens'] for segment in result['segments']] == [
+      segment['tokens'] for segment in expected_result['segments']]
+
+
+def test_load_whisper_log_mel_spectrogram_pads_content_with_silence(audio_clips):
+  for audio_clip in audio_clips:
+    audio = np.array(audio_clip.load())
+    expected_mel = whisper.log_mel_spectrogram(audio, padding=whisper.audio.N_SAMPLES)
+
+    mel, n_content_frames = bisk_audio.load_whisper_log_mel_spectrogram(audio_clip, 80)
+
+    assert n_content_frames == len(audio) // whisper.audio.HOP_LENGTH
+    torch.testing.assert_close(mel, expected_mel[:, :whisper.audio.N_FRAMES])
+
+
+def test_load_whisper_log_mel_spectrogram_from_cache_matches_fresh_for_all_length_remainders(tmp_path):
+  rng = np.random.default_rng(0)
+  lengths = [whisper.audio.SAMPLE_RATE + remainder for remainder in range(whisper.audio.HOP_LENGTH)]
+
+  with bisk_packed_audio.PackedAudioWriter(str(tmp_path)) as writer:
+    locations = [writer.write(rng.standard_normal(length) * 0.1) for length in lengths]
+
+  feature_cache = bisk_feature_cache.FeatureCache(str(tmp_path / 'cache'))
+
+  for rel_filepath, offset, length in locations:
+    audio_clip = bisk_packed_audio.PackedAudioClip(str(tmp_path / rel_filepath), offset, length)
+
+    mel, n_content_frames = bisk_audio.load_whisper_log_mel_spectrogram(audio_clip, 80, feature_cache=feature_cache)
+    cached_mel, cached_n_content_frames = bisk_audio.load_whisper_log_mel_spectrogram(
+      audio_clip, 80, feature_cache=feature_cache)
+
+    assert cached_n_content_frames == n_content_frames
+    torch.testing.assert_close(cached_mel, mel, rtol=0, atol=0)
+
+  assert feature_cache.hits == len(lengths)
+
+
+def test_ingest_audio_files_marks_unreadable_files_as_failed(tmp_path):
+  df = pd.DataFrame({'path': ['missing.mp3']})
+
+  statuses = bisk_audio.ingest_audio_files(df, str(tmp_path), 'path', str(tmp_path / 'output'), 16000)
+
+  assert statuses == ['failed']
+  assert not df['audio_resample_success'].iloc[0]
+
+
+def test_get_audio_sources_raises_error_naming_rows_that_failed_to_be_packed(tmp_path):
+  df = pd.DataFrame({'path': ['a.mp3', 'b.mp3', 'c.mp3']}, index=[10, 11, 12])
+  bisk_packed_audio.set_packed_audio_cols(df, [('shard_00000.float32', 0, 100), (None, None, None), (None, None, None)])
+
+  with pytest.raises(ValueError, match=r'2 rows failed to be packed.*\[11, 12\]'):
+    bisk_audio.get_audio_sources(df, 'path', str(tmp_path))
+
+  audio_sources = bisk_audio.get_audio_sources(df.loc[[10]], 'path', str(tmp_path))
+
+  assert audio_sources == [bisk_packed_audio.PackedAudioClip(str(tmp_path / 'shard_00000.float32'), 0, 100)]
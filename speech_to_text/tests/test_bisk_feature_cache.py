@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+import bisk_feature_cache
+
+
+def test_feature_cache_evicts_least_recently_used_files(tmp_path):
+  features = np.zeros(100, dtype=np.float32)
+  feature_cache = bisk_feature_cache.FeatureCache(str(tmp_path))
+
+  feature_cache.save('a', features)
+  file_size = feature_cache.get_statistics()['size_bytes']
+  feature_cache.max_size_bytes = 2 * file_size
+
+  feature_cache.save('b', features)
+  assert feature_cache.load('a') is not None
+
+  feature_cache.save('c', features)
+
+  assert feature_cache.load('b') is None
+  assert feature_cache.load('a') is not None
+  assert feature_cache.load('c') is not None
+
+  statistics = feature_cache.get_statistics()
+  assert statistics['evictions'] == 1
+  assert statistics['n_files'] == 2
+  assert statistics['size_bytes'] == 2 * file_size
+
+
+def test_feature_cache_restores_recency_and_size_of_existing_files(tmp_path):
+  features = np.zeros(100, dtype=np.float32)
+  feature_cache = bisk_feature_cache.FeatureCache(str(tmp_path))
+
+  for key in ['a', 'b']:
+    feature_cache.save(key, features)
+
+  file_size = feature_cache.get_statistics()['size_bytes'] // 2
+
+  # Recency of existing files is given by their modification time.
+  os.utime(tmp_path / 'a.npy', (2000, 2000))
+  os.utime(tmp_path / 'b.npy', (1000, 1000))
+
+  feature_cache = bisk_feature_cache.FeatureCache(str(tmp_path), max_size_bytes=2 * file_size)
+  feature_cache.save('c', features)
+
+  assert sorted(path.name for path in tmp_path.iterdir()) == ['a.npy', 'c.npy']
+  assert feature_cache.get_statistics()['size_bytes'] == 2 * file_size
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bisk_metrics
+
+
+def test_get_confidence_interval_summary_skips_columns_other_than_metrics():
+  rng = np.random.default_rng(0)
+  metric_col = 'wer_micro_average_whisper-tiny_lang-sk_recorded_by_male__age_20-29__test_set'
+  df_metrics = pd.DataFrame({
+    metric_col: rng.uniform(size=100),
+    'sampled_indexes_recorded_by_male': rng.integers(0, 1000, size=100),
+  })
+
+  with pytest.warns(UserWarning, match='sampled_indexes_recorded_by_male'):
+    summary = bisk_metrics.get_confidence_interval_summary(df_metrics)
+
+  assert summary['name'].tolist() == [metric_col]
+  assert summary[bisk_metrics.SUMMARY_DIM_COLS].astype(str).iloc[0].tolist() == [
+    'whisper-tiny', 'sk', 'wer', 'micro_average', 'recorded_by_male', '20-29', 'test']
@@ -0,0 +1,51 @@
+import matplotlib
+import numpy as np
+
+matplotlib.use('Agg')
+
+from matplotlib import pyplot as plt
+
+import bisk_benchmark
+import bisk_metrics
+import bisk_plot
+import bisk_preprocessing
+import config
+
+
+def test_plot_bars_from_summary_matches_plot_bars_from_bootstrapped_metrics():
+  df = bisk_benchmark._preprocess(bisk_benchmark.generate_dataset(500, random_state=0))
+  df = bisk_preprocessing.add_has_sentence_male_and_female_gender(df, config.GROUND_TRUTH_COL, config.GENDER_COL)
+  bisk_metrics.compute_metrics_per_row(df)
+  df_metrics = bisk_benchmark._compute_metrics_via_bootstrapping(df, 50, 0)
+  summary = bisk_metrics.get_confidence_interval_summary(df_metrics)
+
+  models = sorted(summary['model'].unique())
+  scenario_suffixes = ['_all_genders', '_male_only', '_female_only']
+  kwargs = dict(group_names=models, within_group_names=['all genders', 'male', 'female'], title='', ylabel='')
+
+  fig, ax = bisk_plot.plot_bars(
+    df_metrics,
+    affixes_to_match=[config.WER_PREFIX, 'micro_average', '_lang-sk'],
+    affixes_for_splitting=[
+      [f'{model}_lang-sk' for model in models], [lambda col: col.endswith(tuple(scenario_suffixes))]],
+    **kwargs)
+  heights = [patch.get_height() for patch in ax.patches]
+  plt.close(fig)
+
+  fig, ax = bisk_plot.plot_bars(
+    summary,
+    affixes_to_match={
+      'metric': config.WER_PREFIX.rstrip('_'),
+      'average': 'micro_average',
+      'language': 'sk',
+      'scenario': [suffix.lstrip('_') for suffix in scenario_suffixes],
+      config.AGE_GROUP_COL: 'all',
+      config.SUBSET_COL: 'all',
+    },
+    affixes_for_splitting=[[{'model': model} for model in models]],
+    **kwargs)
+  summary_heights = [patch.get_height() for patch in ax.patches]
+  plt.close(fig)
+
+  assert len(heights) == len(models) * 3
+  np.testing.assert_allclose(summary_heights, heights)
@@ -0,0 +1,56 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import bisk_preprocessing
+
+
+WHITESPACE_CHARACTERS = [chr(code_point) for code_point in range(sys.maxunicode + 1) if chr(code_point).isspace()]
+
+# Characters lowercased differently by Python and Arrow or depending on their context
+SPECIAL_CHARACTERS = ['İ', 'Σ', 'ẞ', 'ǅ', 'Ω', 'K', 'Å', 'ﬃ']
+
+SENTENCES = [
+  'İstanbul ΣΑΣ', 'a\x1cb', 'x　y', 'a\x85b', 'x y', ' 　Dobrý, deň!\v ', 'Ab „c“\td', '', '  ', None,
+]
+
+STRING_DTYPES = [
+  'str', 'string[python]', 'string[pyarrow]', pd.ArrowDtype(pa.string()), pd.ArrowDtype(pa.large_string())]
+
+
+def _generate_sentences(n_sentences, seed=0):
+  rng = np.random.default_rng(seed)
+  characters = np.array(
+    list('aáBČ ') + list(bisk_preprocessing.UNWANTED_CHARACTERS + bisk_preprocessing.PUNCTUATION_INCLUDING_PERIODS)
+    + WHITESPACE_CHARACTERS + SPECIAL_CHARACTERS,
+    dtype=object)
+
+  return SENTENCES + [
+    ''.join(rng.choice(characters, size=rng.integers(0, 20))) for _ in range(n_sentences)]
+
+
+def _preprocess_transcriptions_multiple_passes(sentences):
+  sentences = sentences.str.lower()
+  sentences = bisk_preprocessing.remove_unwanted_characters(sentences)
+  sentences = bisk_preprocessing.remove_punctuation_including_periods(sentences)
+  sentences = bisk_preprocessing.remove_extra_space(sentences)
+  return sentences.str.strip()
+
+
+@pytest.mark.parametrize('dtype', [object] + STRING_DTYPES)
+def test_normalize_transcriptions_matches_multiple_passes(dtype):
+  sentences = pd.Series(_generate_sentences(2000), dtype=dtype)
+
+  pd.testing.assert_series_equal(
+    bisk_preprocessing.normalize_transcriptions(sentences), _preprocess_transcriptions_multiple_passes(sentences))
+
+
+def test_normalize_transcriptions_matches_multiple_passes_for_chunked_arrow_strings():
+  sentences = _generate_sentences(2000)
+  sentences = pd.Series(pd.arrays.ArrowExtensionArray(pa.chunked_array([sentences[:1000], sentences[1000:]])))
+
+  pd.testing.assert_series_equal(
+    bisk_preprocessing.normalize_transcriptions(sentences), _preprocess_transcriptions_multiple_passes(sentences))